@@ -0,0 +1,438 @@
+import argparse
+import glob
+import hashlib
+import json
+import multiprocessing
+import os
+import sqlite3
+import sys
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from tqdm import tqdm
+
+from utils import get_absolute_path
+
+VIDEO_EXTENSIONS = (".mp4", ".avi", ".mov", ".mkv", ".m4v", ".wmv")
+
+# 工作进程中的模型实例：每个进程只加载一次，处理多个视频
+_worker_model = None
+
+
+def find_videos(inputs, recursive=False):
+    """
+    把目录、通配符与文件路径展开为视频文件列表（绝对路径，去重后排序）。
+    参数:
+        inputs: 路径列表；目录会按 VIDEO_EXTENSIONS 列出其中的视频。
+        recursive (bool): 目录是否递归查找，通配符中的 ** 是否匹配多级目录。
+    """
+    videos = set()
+    for item in inputs:
+        if os.path.isdir(item):
+            pattern = os.path.join(item, "**", "*") if recursive else os.path.join(item, "*")
+            candidates = glob.glob(pattern, recursive=recursive)
+        else:
+            candidates = glob.glob(item, recursive=recursive) or [item]
+        for path in candidates:
+            if os.path.isfile(path) and path.lower().endswith(VIDEO_EXTENSIONS):
+                videos.add(os.path.abspath(path))
+    return sorted(videos)
+
+
+def _output_names(videos):
+    """每个视频的输出名；不同目录下的同名视频加上路径哈希，避免结果目录冲突。"""
+    stems = Counter(os.path.splitext(os.path.basename(path))[0] for path in videos)
+    names = {}
+    for path in videos:
+        stem = os.path.splitext(os.path.basename(path))[0]
+        if stems[stem] > 1:
+            stem = f"{stem}_{hashlib.sha1(path.encode('utf-8')).hexdigest()[:8]}"
+        names[path] = stem
+    return names
+
+
+class JobDatabase:
+    def __init__(self, db_path):
+        """
+        批处理任务数据库（SQLite）。
+        每个 (视频, 设置) 组合一行，状态为 pending / running / done / failed；
+        状态在每次变化时立即提交，进程被中断后重新运行同一命令即可从未完成的视频继续。
+        只由主进程访问，工作进程不直接读写数据库。
+        参数:
+            db_path (str): 数据库文件路径。
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path)
+        self.conn.row_factory = sqlite3.Row
+        with self.conn:
+            self.conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    video_path TEXT NOT NULL,
+                    settings_key TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    frames INTEGER,
+                    csv_path TEXT,
+                    video_out TEXT,
+                    error TEXT,
+                    seconds REAL,
+                    updated REAL,
+                    PRIMARY KEY (video_path, settings_key)
+                )
+                """
+            )
+
+    @staticmethod
+    def make_settings_key(settings):
+        """处理设置的哈希；设置改变后同一个视频会作为新任务重新处理。"""
+        return hashlib.sha256(json.dumps(settings, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+    def add_jobs(self, videos, settings_key):
+        """登记任务，已存在的任务保持原状态。"""
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO jobs (video_path, settings_key, updated) VALUES (?, ?, ?)",
+                [(path, settings_key, time.time()) for path in videos],
+            )
+
+    def recover(self, settings_key, retry_failed=False):
+        """
+        把上次运行中断时仍为 running 的任务重置为 pending；retry_failed 时失败的任务也重新排队。
+        返回:
+            被重置的任务数。
+        """
+        statuses = ("running", "failed") if retry_failed else ("running",)
+        with self.conn:
+            cursor = self.conn.execute(
+                f"UPDATE jobs SET status = 'pending', updated = ? WHERE settings_key = ? "
+                f"AND status IN ({', '.join('?' * len(statuses))})",
+                (time.time(), settings_key, *statuses),
+            )
+        return cursor.rowcount
+
+    def pending(self, settings_key, videos):
+        """给定视频中仍需处理的任务，按路径排序。"""
+        rows = self.conn.execute(
+            "SELECT video_path FROM jobs WHERE settings_key = ? AND status = 'pending' ORDER BY video_path",
+            (settings_key,),
+        ).fetchall()
+        wanted = set(videos)
+        return [row["video_path"] for row in rows if row["video_path"] in wanted]
+
+    def mark_running(self, video_path, settings_key):
+        with self.conn:
+            self.conn.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, error = NULL, updated = ? "
+                "WHERE video_path = ? AND settings_key = ?",
+                (time.time(), video_path, settings_key),
+            )
+
+    def mark_done(self, video_path, settings_key, result):
+        with self.conn:
+            self.conn.execute(
+                "UPDATE jobs SET status = 'done', frames = ?, csv_path = ?, video_out = ?, seconds = ?, updated = ? "
+                "WHERE video_path = ? AND settings_key = ?",
+                (result["frames"], result["csv_path"], result["video_path"], result["seconds"], time.time(),
+                 video_path, settings_key),
+            )
+
+    def mark_failed(self, video_path, settings_key, error):
+        with self.conn:
+            self.conn.execute(
+                "UPDATE jobs SET status = 'failed', error = ?, updated = ? WHERE video_path = ? AND settings_key = ?",
+                (str(error), time.time(), video_path, settings_key),
+            )
+
+    def mark_pending(self, video_paths, settings_key):
+        with self.conn:
+            self.conn.executemany(
+                "UPDATE jobs SET status = 'pending', updated = ? WHERE video_path = ? AND settings_key = ?",
+                [(time.time(), path, settings_key) for path in video_paths],
+            )
+
+    def counts(self, settings_key=None):
+        """各状态的任务数；settings_key 为 None 时统计所有设置。"""
+        query = "SELECT status, COUNT(*) AS n FROM jobs"
+        params = ()
+        if settings_key is not None:
+            query += " WHERE settings_key = ?"
+            params = (settings_key,)
+        rows = self.conn.execute(query + " GROUP BY status", params).fetchall()
+        return {row["status"]: row["n"] for row in rows}
+
+    def failures(self, settings_key=None):
+        """失败的任务 [(video_path, error)]。"""
+        query = "SELECT video_path, error FROM jobs WHERE status = 'failed'"
+        params = ()
+        if settings_key is not None:
+            query += " AND settings_key = ?"
+            params = (settings_key,)
+        return [(row["video_path"], row["error"]) for row in self.conn.execute(query, params)]
+
+    def close(self):
+        self.conn.close()
+
+
+def _init_worker(model_path, model_kwargs, threads_per_worker):
+    """工作进程初始化：加载一次模型，供该进程处理的所有视频使用。"""
+    global _worker_model
+    from model_loader import ModelLoader
+    from sharded_processing import _build_tf_config
+
+    model_kwargs = dict(model_kwargs)
+    if threads_per_worker:
+        model_kwargs.setdefault("tf_config", _build_tf_config(threads_per_worker))
+    _worker_model = ModelLoader(model_path, **model_kwargs)
+
+
+def _process_job(video_path, output_name, settings, checkpoint_key, use_result_index=True):
+    """
+    工作进程入口：处理一个视频，保存 CSV 与标注视频。
+    结果按内容登记到 ResultIndex，与界面共享；已有相同结果时直接返回，不再推理。
+    处理过程中定期写入以 checkpoint_key 命名的检查点，进程被中断后再次处理该视频时从最后提交的帧继续。
+    返回:
+        dict(csv_path, video_path, frames, seconds, reused)
+    """
+    from pipeline import VideoProcessingPipeline
+    from result_index import ResultIndex
+    from checkpoint_recorder import CheckpointedRecorder, default_checkpoint_root
+    from video_loader import LocalVideoLoader
+
+    begin = time.perf_counter()
+    stride = settings["stride"]
+    partial = stride > 1 or any(settings[key] is not None
+                                for key in ("start_frame", "end_frame", "start_time", "end_time"))
+    result_index = ResultIndex() if use_result_index else None
+    # 需要列式存储时不复用已有结果（已有结果只有 CSV 与视频），处理完成后仍登记到索引
+    if result_index is not None:
+        result_key = result_index.key_for_run(
+            video_path, settings["model_path"], settings["resize"], settings["pcutoff"],
+            model_type=settings["model_type"], display=settings["display"], stride=stride,
+            start_time=settings["start_time"], end_time=settings["end_time"],
+            start_frame=settings["start_frame"], end_frame=settings["end_frame"],
+        )
+        cached = None if settings["write_store"] else result_index.lookup(result_key)
+        if cached is not None:
+            return {"csv_path": cached["csv_path"], "video_path": cached["video_path"], "frames": cached["frames"],
+                    "seconds": time.perf_counter() - begin, "reused": True}
+
+    recorder = CheckpointedRecorder(None, os.path.join(default_checkpoint_root(), checkpoint_key),
+                                    include_frame_index=partial, write_store=settings["write_store"])
+    resume_frame = recorder.resume_frame(stride)
+    try:
+        # 从检查点继续时起点已是原视频帧号，不再按 start_time 定位
+        loader = LocalVideoLoader(
+            video_path,
+            start_frame=resume_frame if resume_frame is not None else settings["start_frame"] or 0,
+            end_frame=settings["end_frame"],
+            start_time=settings["start_time"] if resume_frame is None else None,
+            end_time=settings["end_time"],
+            stride=stride,
+        )
+    except IOError:
+        # 视频无法打开时不留下空的检查点目录
+        if not recorder.num_frames:
+            recorder.remove_checkpoint()
+        raise
+    recorder.fps = loader.fps / stride
+    recorder.source_fps = loader.fps
+    pipeline = VideoProcessingPipeline(loader, _worker_model, recorder, display=settings["display"],
+                                       pcutoff=settings["pcutoff"], batch_size=settings["batch_size"])
+    try:
+        for _ in pipeline.run():
+            pass
+    except BaseException:
+        recorder.discard_video()
+        raise
+    finally:
+        loader.release()
+
+    csv_path, result_video_path = recorder.save(output_name)
+    if result_index is not None:
+        result_index.add(result_key, csv_path, result_video_path, recorder.frame_indices, recorder.diameters,
+                         video_name=os.path.basename(video_path),
+                         model_name=os.path.basename(os.path.normpath(settings["model_path"])))
+    return {"csv_path": csv_path, "video_path": result_video_path if os.path.exists(result_video_path) else None,
+            "frames": recorder.num_frames, "seconds": time.perf_counter() - begin, "reused": False}
+
+
+def run_batch(videos, model_path, num_workers=1, db_path=None, resize=1.0, pcutoff=0.5, model_type="base",
+              display=True, stride=1, batch_size=1, write_store=False, retry_failed=False, use_result_index=True,
+              start_frame=None, end_frame=None, start_time=None, end_time=None):
+    """
+    用多个工作进程批量处理视频，进度记录在任务数据库中。
+    每个工作进程加载一份模型并依次处理分配给它的视频；同时在处理中的视频数不超过 num_workers，
+    因此数据库中 running 的任务就是实际正在处理的视频。中断（Ctrl+C）后这些任务被重置为 pending，
+    再次运行相同命令时只处理尚未完成的视频。
+    参数:
+        videos (list[str]): 视频路径（find_videos 的结果）。
+        model_path (str): 模型目录。
+        num_workers (int): 工作进程数。
+        db_path (str): 任务数据库路径，默认 output/batch_jobs.sqlite。
+        resize, pcutoff, model_type: 模型参数。
+        display (bool): 是否在输出视频中绘制关键点。
+        stride (int): 每隔 stride 帧处理一帧。
+        start_frame, end_frame: 只处理每个视频 [start_frame, end_frame) 内的帧。
+        start_time, end_time: 按时间（秒）指定处理范围，优先于 start_frame / end_frame。
+        batch_size (int): 每个工作进程的批量推理大小。
+        write_store (bool): 是否同时保存分块列式存储（<名称>.track，见 tracking_store）。
+        retry_failed (bool): 是否重新处理之前失败的视频。
+        use_result_index (bool): 是否复用/登记 ResultIndex 中的结果。
+    返回:
+        各状态的任务数 dict。
+    """
+    num_workers = max(1, int(num_workers))
+    db = JobDatabase(db_path or os.path.join(get_absolute_path("output"), "batch_jobs.sqlite"))
+    settings = {
+        "model_path": os.path.abspath(model_path),
+        "model_type": model_type,
+        "resize": float(resize),
+        "pcutoff": float(pcutoff),
+        "display": bool(display),
+        "stride": max(1, int(stride)),
+        "start_frame": int(start_frame) if start_frame else None,
+        "end_frame": None if end_frame is None else int(end_frame),
+        "start_time": float(start_time) if start_time else None,
+        "end_time": None if end_time is None else float(end_time),
+        "batch_size": max(1, int(batch_size)),
+        "write_store": bool(write_store),
+    }
+    # batch_size 不影响结果，不计入任务键；未指定的处理范围也不计入，以免改变已有任务的键
+    settings_key = db.make_settings_key({k: v for k, v in settings.items() if k != "batch_size" and v is not None})
+    db.add_jobs(videos, settings_key)
+    recovered = db.recover(settings_key, retry_failed)
+    if recovered:
+        print(f"重新排队 {recovered} 个未完成的任务")
+
+    todo = db.pending(settings_key, videos)
+    print(f"共 {len(videos)} 个视频，待处理 {len(todo)} 个，使用 {num_workers} 个进程。")
+    if not todo:
+        counts = db.counts(settings_key)
+        db.close()
+        return counts
+
+    names = _output_names(videos)
+    model_kwargs = {"resize": settings["resize"], "pcutoff": settings["pcutoff"], "model_type": model_type}
+    threads_per_worker = max(1, (os.cpu_count() or 1) // num_workers)
+    # TensorFlow 不支持 fork 后继续使用，统一使用 spawn 启动工作进程
+    context = multiprocessing.get_context("spawn")
+    executor = ProcessPoolExecutor(max_workers=num_workers, mp_context=context, initializer=_init_worker,
+                                   initargs=(settings["model_path"], model_kwargs, threads_per_worker))
+    running = {}
+    queue = list(reversed(todo))
+    try:
+        with tqdm(total=len(todo), desc="批处理") as progress:
+            while queue or running:
+                while queue and len(running) < num_workers:
+                    video_path = queue.pop()
+                    db.mark_running(video_path, settings_key)
+                    checkpoint_key = "batch_" + hashlib.sha1(f"{settings_key}:{video_path}".encode("utf-8")).hexdigest()[:16]
+                    future = executor.submit(_process_job, video_path, names[video_path], settings, checkpoint_key,
+                                             use_result_index)
+                    running[future] = video_path
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    video_path = running[future]
+                    try:
+                        result = future.result()
+                    except BrokenProcessPool:
+                        raise
+                    except Exception as e:
+                        del running[future]
+                        db.mark_failed(video_path, settings_key, f"{type(e).__name__}: {e}")
+                        tqdm.write(f"处理失败: {video_path}: {e}")
+                    else:
+                        del running[future]
+                        db.mark_done(video_path, settings_key, result)
+                        if result["reused"]:
+                            tqdm.write(f"复用已有结果: {video_path}")
+                    progress.update(1)
+    except (KeyboardInterrupt, BrokenProcessPool):
+        # 正在处理的视频重新排队，下次运行时从这些视频继续
+        db.mark_pending(list(running.values()), settings_key)
+        executor.shutdown(wait=False, cancel_futures=True)
+        db.close()
+        raise
+    executor.shutdown()
+    counts = db.counts(settings_key)
+    db.close()
+    return counts
+
+
+def print_status(db_path, show_failures=True):
+    """打印任务数据库中各状态的任务数与失败原因。"""
+    db = JobDatabase(db_path)
+    counts = db.counts()
+    print("  ".join(f"{status}: {counts.get(status, 0)}" for status in ("pending", "running", "done", "failed")))
+    if show_failures:
+        for video_path, error in db.failures():
+            print(f"[failed] {video_path}: {error}")
+    db.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="无界面批量处理视频（可中断后继续）")
+    parser.add_argument("inputs", nargs="*", help="视频文件、目录或通配符（如 'data/*.mp4'）")
+    parser.add_argument("--model", help="模型目录")
+    parser.add_argument("--workers", type=int, default=1, help="工作进程数，每个进程各加载一份模型")
+    parser.add_argument("--db", default=None, help="任务数据库路径，默认 output/batch_jobs.sqlite")
+    parser.add_argument("--recursive", action="store_true", help="递归查找目录中的视频")
+    parser.add_argument("--resize", type=float, default=1.0)
+    parser.add_argument("--pcutoff", type=float, default=0.5)
+    parser.add_argument("--model-type", default="base")
+    parser.add_argument("--no-display", action="store_true", help="输出视频中不绘制关键点")
+    parser.add_argument("--stride", type=int, default=1, help="每隔 stride 帧处理一帧")
+    parser.add_argument("--start-frame", type=int, default=None, help="起始帧（含）")
+    parser.add_argument("--end-frame", type=int, default=None, help="结束帧（不含）")
+    parser.add_argument("--start-time", type=float, default=None, help="起始时间（秒），优先于 --start-frame")
+    parser.add_argument("--end-time", type=float, default=None, help="结束时间（秒），优先于 --end-frame")
+    parser.add_argument("--batch-size", type=int, default=1, help="批量推理大小")
+    parser.add_argument("--retry-failed", action="store_true", help="重新处理之前失败的视频")
+    parser.add_argument("--store", action="store_true", help="同时保存分块列式存储（.track），便于按时间范围查询")
+    parser.add_argument("--no-result-index", action="store_true", help="不复用也不登记结果索引")
+    parser.add_argument("--status", action="store_true", help="只显示任务数据库的状态")
+    args = parser.parse_args()
+
+    db_path = args.db or os.path.join(get_absolute_path("output"), "batch_jobs.sqlite")
+    if args.status:
+        print_status(db_path)
+        sys.exit(0)
+    if not args.inputs or not args.model:
+        parser.error("需要指定输入视频与 --model")
+
+    videos = find_videos(args.inputs, recursive=args.recursive)
+    if not videos:
+        parser.error("没有找到视频文件")
+    try:
+        counts = run_batch(
+            videos,
+            args.model,
+            num_workers=args.workers,
+            db_path=db_path,
+            resize=args.resize,
+            pcutoff=args.pcutoff,
+            model_type=args.model_type,
+            display=not args.no_display,
+            stride=args.stride,
+            start_frame=args.start_frame,
+            end_frame=args.end_frame,
+            start_time=args.start_time,
+            end_time=args.end_time,
+            batch_size=args.batch_size,
+            write_store=args.store,
+            retry_failed=args.retry_failed,
+            use_result_index=not args.no_result_index,
+        )
+    except KeyboardInterrupt:
+        print("\n已中断，再次运行相同命令将从未完成的视频继续。")
+        sys.exit(130)
+    except BrokenProcessPool as e:
+        # 工作进程异常退出（例如模型加载失败或内存不足），未完成的视频已重新排队
+        print(f"工作进程异常退出: {e}")
+        sys.exit(1)
+    print("  ".join(f"{status}: {counts.get(status, 0)}" for status in ("pending", "running", "done", "failed")))
+    sys.exit(1 if counts.get("failed") else 0)
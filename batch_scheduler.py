@@ -0,0 +1,346 @@
+import argparse
+import os
+import queue
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from concurrent.futures import Future
+
+import numpy as np
+
+from instrumentation import span
+
+# 关闭调度器时放入队列的结束标记
+_CLOSE = object()
+
+
+class _Request:
+    __slots__ = ("frame", "future", "stream_id", "submitted")
+
+    def __init__(self, frame, stream_id):
+        self.frame = frame
+        self.future = Future()
+        self.stream_id = stream_id
+        self.submitted = time.perf_counter()
+
+
+class BatchScheduler:
+    def __init__(self, model, max_batch_size=16, max_wait_ms=5.0, window=1000):
+        """
+        跨视频流的微批调度器：多个视频/摄像头共用一个模型实例。
+        各个流用 submit() 提交单帧，调度线程把等待中的帧合并为一个微批，调用一次 infer_pose_batch，
+        再把每帧的姿态通过 Future 交回对应的流。
+        一个批次从收到第一帧起最多再等待 max_wait_ms 毫秒，或凑满 max_batch_size 帧就立即推理；
+        推理进行期间到达的帧在队列中累积，负载越高批次越大，因此吞吐随批大小增长，
+        而不需要为每个流各加载一份模型。
+        形状不同的帧（不同分辨率的相机）在同一批次内按形状分组推理。
+        注意: 共享模型时各流的 ROI 状态会相互干扰，因此调度器会关闭模型的 ROI 模式。
+        参数:
+            model: ModelLoader 实例（需要 infer_pose_batch）。
+            max_batch_size (int): 每个微批的最大帧数。
+            max_wait_ms (float): 为凑批次，一帧最多额外等待的时间（毫秒）。
+            window (int): 统计排队延迟时保留的最近样本数。
+        """
+        if getattr(model, "roi_mode", False):
+            print("BatchScheduler: 多个视频流共享模型时不支持 ROI 模式，已关闭。")
+            model.roi_mode = False
+        self.model = model
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self._queue = queue.Queue()
+        self._closed = False
+        self._error = None  # 调度线程意外退出时的异常
+        # submit 与 close 共用的锁，保证关闭后不会再有帧排在结束标记之后
+        self._submit_lock = threading.Lock()
+        self._batch_sizes = Counter()
+        self._stream_frames = Counter()
+        self._queue_delays = deque(maxlen=window)
+        self._stats_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="BatchScheduler", daemon=True)
+        self._thread.start()
+
+    def submit(self, frame, stream_id=None):
+        """
+        提交一帧。
+        返回:
+            concurrent.futures.Future，结果为该帧的姿态 (P, 3)。
+        """
+        request = _Request(frame, stream_id)
+        with self._submit_lock:
+            if self._closed:
+                raise RuntimeError("调度器已关闭") from self._error
+            self._queue.put(request)
+        return request.future
+
+    def client(self, stream_id=None):
+        """返回一个接口与 ModelLoader 相同的客户端，可直接交给 VideoProcessingPipeline 使用。"""
+        return SchedulerClient(self, stream_id)
+
+    def _collect(self):
+        """
+        取出下一个微批：阻塞等待第一帧，然后在截止时间前继续收集，直到凑满 max_batch_size。
+        返回:
+            list[_Request]；调度器关闭且队列为空时返回 None。
+        """
+        first = self._queue.get()
+        if first is _CLOSE:
+            return None
+        batch = [first]
+        deadline = first.submitted + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                request = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if request is _CLOSE:
+                # 先处理完已收集的帧，下一轮再退出
+                self._queue.put(_CLOSE)
+                break
+            batch.append(request)
+        return batch
+
+    def _run(self):
+        batch = []
+        try:
+            while True:
+                batch = self._collect()
+                if batch is None:
+                    return
+                self._process(batch)
+        except BaseException as e:
+            # 推理以外的意外错误：停止接收新的帧，让正在等待的各个流收到异常而不是一直等待
+            print(f"BatchScheduler: 调度线程出错: {e}")
+            self._fail_pending(batch, e)
+
+    def _fail_pending(self, batch, error):
+        """关闭调度器，并把当前批次与队列中所有未完成的请求设为失败。"""
+        with self._submit_lock:
+            self._closed = True
+            self._error = error
+        pending = list(batch)
+        while True:
+            try:
+                request = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if request is not _CLOSE:
+                pending.append(request)
+        for request in pending:
+            if not request.future.done():
+                request.future.set_exception(error)
+
+    def _process(self, batch):
+        """推理一个微批，并把结果交回各帧的 Future。"""
+        begin = time.perf_counter()
+        # 不同分辨率的帧不能堆叠成一个张量，按形状分组
+        groups = defaultdict(list)
+        for request in batch:
+            groups[(request.frame.shape, request.frame.dtype.str)].append(request)
+        for requests in groups.values():
+            try:
+                with span("scheduler.batch"):
+                    poses = self.model.infer_pose_batch([request.frame for request in requests],
+                                                        batch_size=len(requests))
+                if len(poses) != len(requests):
+                    raise ValueError(f"模型返回 {len(poses)} 个姿态，提交了 {len(requests)} 帧")
+            except Exception as e:
+                for request in requests:
+                    request.future.set_exception(e)
+                continue
+            for request, pose in zip(requests, poses):
+                request.future.set_result(pose)
+        with self._stats_lock:
+            for requests in groups.values():
+                self._batch_sizes[len(requests)] += 1
+            for request in batch:
+                self._stream_frames[request.stream_id] += 1
+                self._queue_delays.append(begin - request.submitted)
+
+    def stats(self):
+        """
+        返回调度统计:
+            {"batches": 推理调用次数, "frames": 帧数, "mean_batch_size": 平均批大小,
+             "p50_queue_ms"/"p95_queue_ms": 帧从提交到开始推理的等待时间, "frames_per_stream": {流: 帧数}}
+        """
+        with self._stats_lock:
+            batch_sizes = dict(self._batch_sizes)
+            delays = np.fromiter(self._queue_delays, dtype=np.float64)
+            frames_per_stream = dict(self._stream_frames)
+        batches = sum(batch_sizes.values())
+        frames = sum(size * count for size, count in batch_sizes.items())
+        p50, p95 = np.percentile(delays, [50, 95]) * 1000 if len(delays) else (0.0, 0.0)
+        return {
+            "batches": batches,
+            "frames": frames,
+            "mean_batch_size": frames / batches if batches else 0.0,
+            "p50_queue_ms": float(p50),
+            "p95_queue_ms": float(p95),
+            "frames_per_stream": frames_per_stream,
+        }
+
+    def close(self):
+        """处理完已提交的帧后停止调度线程。"""
+        with self._submit_lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(_CLOSE)
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+class SchedulerClient:
+    def __init__(self, scheduler, stream_id=None):
+        """
+        一个视频流使用的模型代理：infer_pose / infer_pose_batch 把帧提交给共享的 BatchScheduler。
+        交给 VideoProcessingPipeline 时，流水线的 batch_size 就是每个流同时在途的帧数，
+        调度器把各个流在途的帧合并为更大的批次。
+        """
+        self.scheduler = scheduler
+        self.stream_id = stream_id
+
+    @property
+    def pcutoff_value(self):
+        return self.scheduler.model.pcutoff_value
+
+    def infer_pose(self, frame):
+        return self.scheduler.submit(frame, self.stream_id).result()
+
+    def infer_pose_batch(self, frames, batch_size=None):
+        futures = [self.scheduler.submit(frame, self.stream_id) for frame in frames]
+        return np.stack([future.result() for future in futures])
+
+    def reset_roi(self):
+        # 共享模型不使用 ROI，无需重置
+        pass
+
+
+def _output_names(sources):
+    """每个流的输出名；名称相同的流（不同目录下的同名视频、重复的来源）加上流编号，避免结果相互覆盖。"""
+    names = [f"camera{source}" if str(source).isdigit() else os.path.splitext(os.path.basename(source))[0]
+             for source in sources]
+    counts = Counter(names)
+    return [f"{name}_{stream_id}" if counts[name] > 1 else name for stream_id, name in enumerate(names)]
+
+
+def run_streams(sources, model, max_batch_size=16, max_wait_ms=5.0, frames_in_flight=4, display=True,
+                pcutoff=0.5, save=True, stop_event=None, max_seconds=None):
+    """
+    用一个共享模型同时处理多个视频流，每个流有独立的加载器、流水线与记录器。
+    参数:
+        sources (list): 视频文件路径，或 CameraVideoLoader 可接受的摄像头编号（整数或数字字符串）。
+        model: 共享的 ModelLoader。
+        max_batch_size, max_wait_ms: 同 BatchScheduler。
+        frames_in_flight (int): 每个流同时提交给调度器的帧数（即流水线的 batch_size）。
+        display (bool): 是否在输出视频中绘制关键点。
+        pcutoff (float): 绘制关键点的置信度阈值。
+        save (bool): 结束后是否保存每个流的 CSV 与视频。
+        stop_event (threading.Event): 置位后所有流停止处理，已处理的部分照常保存（用于摄像头等没有终点的流）。
+        max_seconds (float): 最长处理时间（秒），超时后同 stop_event。
+        按 Ctrl+C 同样会停止所有流并保存已处理的部分。
+    返回:
+        (recorders, stats)：每个流的 TrackingDataRecorder 与调度统计。
+    """
+    from pipeline import VideoProcessingPipeline
+    from tracking_data_recorder import TrackingDataRecorder
+    from video_loader import CameraVideoLoader, LocalVideoLoader
+
+    def open_loader(source):
+        if isinstance(source, int) or str(source).isdigit():
+            return CameraVideoLoader(int(source))
+        return LocalVideoLoader(source)
+
+    errors = {}
+    stop_event = stop_event or threading.Event()
+    deadline = time.perf_counter() + max_seconds if max_seconds else None
+    loaders = []
+    try:
+        # 在 try 中逐个打开，某个来源打不开时释放已经打开的加载器（摄像头）
+        for source in sources:
+            loaders.append(open_loader(source))
+        recorders = [TrackingDataRecorder(fps=loader.fps or 30.0) for loader in loaders]
+
+        with BatchScheduler(model, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms) as scheduler:
+            def consume(stream_id, loader, recorder):
+                pipeline = VideoProcessingPipeline(loader, scheduler.client(stream_id), recorder, display=display,
+                                                   pcutoff=pcutoff, batch_size=frames_in_flight)
+                try:
+                    for _ in pipeline.run():
+                        if stop_event.is_set() or (deadline is not None and time.perf_counter() >= deadline):
+                            # 退出生成器会停止流水线，已记录的帧保留
+                            break
+                except Exception as e:
+                    errors[stream_id] = e
+                    recorder.discard_video()
+
+            threads = [threading.Thread(target=consume, args=(i, loader, recorder), name=f"stream-{i}")
+                       for i, (loader, recorder) in enumerate(zip(loaders, recorders))]
+            for thread in threads:
+                thread.start()
+            try:
+                for thread in threads:
+                    # 带超时等待，主线程才能及时收到 Ctrl+C
+                    while thread.is_alive():
+                        thread.join(0.5)
+            except KeyboardInterrupt:
+                print("收到中断，停止所有视频流并保存已处理的部分……")
+                stop_event.set()
+                for thread in threads:
+                    thread.join()
+            stats = scheduler.stats()
+    finally:
+        for loader in loaders:
+            loader.release()
+
+    for stream_id, error in errors.items():
+        print(f"视频流 {sources[stream_id]} 处理失败: {error}")
+    if save:
+        names = _output_names(sources)
+        for stream_id, recorder in enumerate(recorders):
+            if stream_id not in errors:
+                recorder.save(names[stream_id])
+    else:
+        # 不保存时删除流式写入的临时视频与存储，并结束编码线程
+        for recorder in recorders:
+            recorder.discard_video()
+    return recorders, stats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="用一个共享模型同时处理多个视频或摄像头（跨流微批推理）")
+    parser.add_argument("sources", nargs="+", help="视频文件路径或摄像头编号")
+    parser.add_argument("--model", required=True, help="模型目录")
+    parser.add_argument("--resize", type=float, default=1.0)
+    parser.add_argument("--pcutoff", type=float, default=0.5)
+    parser.add_argument("--max-batch", type=int, default=16, help="每个微批的最大帧数")
+    parser.add_argument("--max-wait-ms", type=float, default=5.0, help="为凑批次一帧最多额外等待的时间（毫秒）")
+    parser.add_argument("--in-flight", type=int, default=4, help="每个流同时提交的帧数")
+    parser.add_argument("--no-display", action="store_true", help="输出视频中不绘制关键点")
+    parser.add_argument("--max-seconds", type=float, default=None, help="最长处理时间（秒），摄像头默认一直处理到 Ctrl+C")
+    args = parser.parse_args()
+
+    from model_loader import ModelLoader
+
+    begin = time.perf_counter()
+    recorders, stats = run_streams(
+        args.sources,
+        ModelLoader(args.model, resize=args.resize, pcutoff=args.pcutoff),
+        max_batch_size=args.max_batch,
+        max_wait_ms=args.max_wait_ms,
+        frames_in_flight=args.in_flight,
+        display=not args.no_display,
+        pcutoff=args.pcutoff,
+        max_seconds=args.max_seconds,
+    )
+    elapsed = time.perf_counter() - begin
+    print(f"{len(args.sources)} 个视频流共 {stats['frames']} 帧，用时 {elapsed:.1f} 秒 "
+          f"({stats['frames'] / elapsed:.1f} 帧/秒)")
+    print(f"推理调用 {stats['batches']} 次，平均批大小 {stats['mean_batch_size']:.1f}，"
+          f"排队等待 p50/p95 {stats['p50_queue_ms']:.1f}/{stats['p95_queue_ms']:.1f} ms")
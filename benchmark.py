@@ -0,0 +1,307 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+from live_plot import LivePlot
+from pipeline import VideoProcessingPipeline
+from tracking_data_recorder import TrackingDataRecorder
+from utils import draw_keypoints, estimate_pupil_diameter, generate_plotly_lineplot, get_absolute_path
+from video_loader import LocalVideoLoader
+
+# 基准 JSON 格式版本，字段含义改变时递增
+BENCHMARK_FORMAT_VERSION = 1
+
+
+class StubModelLoader:
+    def __init__(self, num_points=8, latency_ms=0.0, pcutoff=0.5):
+        """
+        不需要模型权重的确定性替身模型，接口与 ModelLoader 相同，用于基准测试与调试流水线。
+        关键点围绕画面中心排成一圈，半径随画面亮度变化，因此下游的绘制、直径计算等与真实数据的开销一致。
+        参数:
+            num_points (int): 关键点数。
+            latency_ms (float): 每帧额外等待的时间（毫秒），用于模拟真实模型的推理耗时。
+            pcutoff (float): 置信度阈值（只用于与 ModelLoader 保持相同的属性）。
+        """
+        self.num_points = num_points
+        self.latency_ms = latency_ms
+        self.pcutoff_value = pcutoff
+        self.roi_mode = False
+        self._angles = np.linspace(0, 2 * np.pi, num_points, endpoint=False)
+
+    def infer_pose(self, frame):
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000.0)
+        height, width = frame.shape[:2]
+        brightness = float(frame[::16, ::16].mean())
+        radius = min(height, width) * (0.1 + 0.1 * brightness / 255.0)
+        pose = np.empty((self.num_points, 3))
+        pose[:, 0] = width / 2 + radius * np.cos(self._angles)
+        pose[:, 1] = height / 2 + radius * np.sin(self._angles)
+        pose[:, 2] = 0.9
+        return pose
+
+    def infer_pose_batch(self, frames, batch_size=None):
+        return np.stack([self.infer_pose(frame) for frame in frames])
+
+    def set_pcutoff(self, pcutoff):
+        self.pcutoff_value = pcutoff
+
+    def reset_roi(self):
+        pass
+
+
+def _rss_mb():
+    """当前进程的常驻内存（MB）；无法获取时返回 None。"""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / 1024 ** 2
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 ** 2
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _measure(name, body, items=None, measure_memory=True, repeats=3):
+    """
+    运行一个阶段并记录吞吐与内存。
+    计时重复 repeats 次取最快的一次以减小波动；内存单独再运行一次：tracemalloc 会拖慢分配，计时时不开启。
+    body 每次调用都要完整执行一遍该阶段；items 为 None 时使用 body 的返回值作为处理的项数。
+    """
+    rss_before = _rss_mb()
+    seconds = float("inf")
+    for _ in range(max(1, repeats)):
+        begin = time.perf_counter()
+        returned = body()
+        seconds = min(seconds, time.perf_counter() - begin)
+    rss_after = _rss_mb()
+    items = returned if items is None else items
+
+    peak_traced_mb = None
+    if measure_memory:
+        tracemalloc.start()
+        try:
+            body()
+            peak_traced_mb = tracemalloc.get_traced_memory()[1] / 1024 ** 2
+        finally:
+            tracemalloc.stop()
+
+    result = {
+        "items": items,
+        "seconds": seconds,
+        "items_per_second": items / seconds if seconds > 0 else float("inf"),
+        "peak_traced_mb": peak_traced_mb,
+        "rss_delta_mb": None if rss_before is None or rss_after is None else rss_after - rss_before,
+    }
+    print(f"{name:<28} {items:>7} 项  {seconds:8.3f}s  {result['items_per_second']:10.1f} 项/秒"
+          + (f"  峰值 {peak_traced_mb:8.1f} MB" if peak_traced_mb is not None else ""))
+    return result
+
+
+def run_benchmark(video_path, model=None, max_frames=None, batch_size=8, plot_calls=20, measure_memory=True,
+                  repeats=3):
+    """
+    在视频上分别测量各阶段的吞吐与内存。
+    参数:
+        video_path (str): 基准视频（默认 Example.mp4）。
+        model: ModelLoader 实例；None 时使用 StubModelLoader。
+        max_frames (int): 最多使用的帧数，None 表示整段视频。
+        batch_size (int): infer_pose_batch 阶段的批大小。
+        plot_calls (int): 绘图阶段重复调用的次数。
+        measure_memory (bool): 是否额外运行一遍以测量 tracemalloc 峰值内存。
+        repeats (int): 每个阶段计时的重复次数，取最快的一次。
+    返回:
+        dict，包含 meta 与 stages 两部分，可直接写为 JSON。
+    """
+    stub = model is None
+    model = StubModelLoader() if stub else model
+    stages = {}
+
+    def measure(name, body, items=None, memory=measure_memory):
+        return _measure(name, body, items, memory, repeats)
+
+    frames = []
+
+    def decode():
+        frames.clear()
+        loader = LocalVideoLoader(video_path, end_frame=max_frames)
+        while (frame := loader.get_frame()) is not None:
+            frames.append(frame)
+        loader.release()
+        return len(frames)
+
+    # 解码阶段的峰值内存包含保留在 frames 中的所有帧
+    stages["decode"] = measure("LocalVideoLoader 解码", decode)
+    num_frames = len(frames)
+    if num_frames == 0:
+        raise ValueError(f"视频中没有可读取的帧: {video_path}")
+
+    # 真实模型的第一帧包含会话初始化，单独运行一次，不计入吞吐
+    model.infer_pose(frames[0])
+    poses = []
+
+    def infer():
+        poses[:] = [model.infer_pose(frame) for frame in frames]
+
+    stages["infer_pose"] = measure("ModelLoader.infer_pose", infer, num_frames)
+    if hasattr(model, "infer_pose_batch") and batch_size > 1:
+        stages["infer_pose_batch"] = measure(
+            f"infer_pose_batch (批大小 {batch_size})",
+            lambda: model.infer_pose_batch(frames, batch_size=batch_size), num_frames
+        )
+
+    pcutoff = model.pcutoff_value
+    stages["draw_keypoints"] = measure(
+        "draw_keypoints",
+        lambda: [draw_keypoints(frame, pose, pcutoff=pcutoff) for frame, pose in zip(frames, poses)],
+        num_frames
+    )
+    stages["estimate_pupil_diameter"] = measure(
+        "estimate_pupil_diameter", lambda: [estimate_pupil_diameter(pose) for pose in poses], num_frames
+    )
+
+    tmp_dir = tempfile.mkdtemp(prefix="benchmark_")
+    try:
+        recorder_holder = []
+
+        def record_append():
+            recorder = TrackingDataRecorder(fps=30, stream_video=False)
+            for pose in poses:
+                recorder.add_frame_pose(pose)
+            recorder_holder[:] = [recorder]
+
+        stages["recorder_append"] = measure("TrackingDataRecorder 追加", record_append, num_frames)
+        stages["recorder_save_csv"] = measure(
+            "TrackingDataRecorder.save_csv",
+            lambda: recorder_holder[0].save_csv(os.path.join(tmp_dir, "benchmark.csv")), num_frames
+        )
+
+        def record_video():
+            recorder = TrackingDataRecorder(fps=30, stream_video=True)
+            recorder.save_data_root = tmp_dir
+            for frame in frames:
+                recorder.add_frame(frame)
+            recorder.save_video(os.path.join(tmp_dir, "benchmark.mp4"))
+
+        stages["recorder_video"] = measure("TrackingDataRecorder 视频编码", record_video, num_frames)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    diameters = [float(estimate_pupil_diameter(pose)) for pose in poses]
+    indices = list(range(num_frames))
+    stages["generate_plotly_lineplot"] = measure(
+        f"generate_plotly_lineplot ({num_frames} 点)",
+        lambda: [generate_plotly_lineplot(indices, diameters) for _ in range(plot_calls)], plot_calls
+    )
+
+    def live_plot():
+        plot = LivePlot(refresh_hz=1e9)
+        plot.extend(indices, diameters)
+        for _ in range(plot_calls):
+            plot.render(force=True)
+
+    stages["live_plot_render"] = measure(f"LivePlot.render ({num_frames} 点)", live_plot, plot_calls)
+
+    def end_to_end():
+        recorder = TrackingDataRecorder(fps=30, stream_video=False)
+        pipeline = VideoProcessingPipeline(LocalVideoLoader(video_path, end_frame=max_frames), model, recorder)
+        for _ in pipeline.run():
+            pass
+
+    stages["pipeline_end_to_end"] = measure("VideoProcessingPipeline 端到端", end_to_end, num_frames, memory=False)
+
+    height, width = frames[0].shape[:2]
+    return {
+        "version": BENCHMARK_FORMAT_VERSION,
+        "meta": {
+            "video": os.path.basename(video_path),
+            "frames": num_frames,
+            "resolution": [width, height],
+            "model": "stub" if stub else getattr(model, "model_path", type(model).__name__),
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "opencv": cv2.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "stages": stages,
+    }
+
+
+def compare_results(current, baseline, tolerance=0.10):
+    """
+    与基准结果比较各阶段的吞吐。
+    返回:
+        (report_lines, regressions)，regressions 为吞吐下降超过 tolerance 的阶段名列表。
+    """
+    lines = [f"{'阶段':<28} {'基准':>12} {'当前':>12} {'变化':>8}"]
+    regressions = []
+    for name, stage in current["stages"].items():
+        base = baseline.get("stages", {}).get(name)
+        if base is None:
+            lines.append(f"{name:<28} {'-':>12} {stage['items_per_second']:>12.1f}")
+            continue
+        ratio = stage["items_per_second"] / base["items_per_second"] if base["items_per_second"] else float("inf")
+        flag = ""
+        if ratio < 1 - tolerance:
+            regressions.append(name)
+            flag = "  <-- 变慢"
+        lines.append(f"{name:<28} {base['items_per_second']:>12.1f} {stage['items_per_second']:>12.1f} "
+                     f"{(ratio - 1) * 100:>+7.1f}%{flag}")
+    if current["meta"].get("frames") != baseline.get("meta", {}).get("frames"):
+        lines.append("警告: 两次运行使用的帧数不同，结果不可直接比较。")
+    return lines, regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="测量流水线各阶段的吞吐与内存")
+    parser.add_argument("--video", default=get_absolute_path("Example.mp4"), help="基准视频，默认 Example.mp4")
+    parser.add_argument("--model", default=None, help="模型目录；不指定时使用确定性的替身模型")
+    parser.add_argument("--resize", type=float, default=1.0)
+    parser.add_argument("--max-frames", type=int, default=None, help="最多使用的帧数")
+    parser.add_argument("--batch-size", type=int, default=8, help="infer_pose_batch 阶段的批大小")
+    parser.add_argument("--repeats", type=int, default=3, help="每个阶段计时的重复次数，取最快的一次")
+    parser.add_argument("--no-memory", action="store_true", help="不测量 tracemalloc 峰值内存（运行更快）")
+    parser.add_argument("--output", default=None, help="结果 JSON 路径，默认 output/benchmark_<时间>.json")
+    parser.add_argument("--compare", default=None, help="与之比较的基准 JSON")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="吞吐下降超过该比例视为退化")
+    args = parser.parse_args()
+
+    model = None
+    if args.model:
+        from model_loader import ModelLoader
+        model = ModelLoader(args.model, resize=args.resize)
+
+    result = run_benchmark(args.video, model=model, max_frames=args.max_frames, batch_size=args.batch_size,
+                           measure_memory=not args.no_memory, repeats=args.repeats)
+
+    output_path = args.output
+    if output_path is None:
+        output_dir = get_absolute_path("output")
+        os.makedirs(output_dir, exist_ok=True)
+        output_path = os.path.join(output_dir, f"benchmark_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2, ensure_ascii=False)
+    print(f"基准结果已保存到 {output_path}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        lines, regressions = compare_results(result, baseline, args.tolerance)
+        print("\n".join(lines))
+        if regressions:
+            print(f"以下阶段吞吐下降超过 {args.tolerance:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
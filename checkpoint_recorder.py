@@ -0,0 +1,290 @@
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+from instrumentation import span
+from tracking_data_recorder import TrackingDataRecorder
+from utils import get_absolute_path, write_json_atomic
+
+# 检查点格式版本，改变 poses.bin 的记录格式或清单字段时递增
+CHECKPOINT_VERSION = 1
+
+_MANIFEST_NAME = "manifest.json"
+_POSES_NAME = "poses.bin"
+
+
+def _record_dtype(num_points):
+    """poses.bin 中每行的二进制格式：帧号、是否插值、姿态 (P, 3)、直径。"""
+    return np.dtype([
+        ("frame_index", "<i8"),
+        ("interpolated", "u1"),
+        ("pose", "<f4", (num_points, 3)),
+        ("diameter", "<f4"),
+    ])
+
+
+def _read_manifest(checkpoint_dir):
+    """读取检查点清单；不存在、损坏或版本不符时返回 None。"""
+    try:
+        with open(os.path.join(checkpoint_dir, _MANIFEST_NAME), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get("version") != CHECKPOINT_VERSION:
+        return None
+    return manifest
+
+
+def _fsync_file(path):
+    with open(path, "ab") as f:
+        os.fsync(f.fileno())
+
+
+def default_checkpoint_root():
+    return os.path.join(get_absolute_path("output"), ".checkpoints")
+
+
+def checkpoint_key(video_path, **settings):
+    """
+    检查点目录名：由视频文件名、大小、修改时间与处理设置（值需可 JSON 序列化）组成。
+    不读取视频内容，开始处理前即可得到；视频被替换或修改后键随之改变。
+    """
+    stat = os.stat(video_path)
+    payload = json.dumps(
+        {
+            "version": CHECKPOINT_VERSION,
+            "video": os.path.basename(video_path),
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            **settings,
+        },
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+
+def remove_stale_checkpoints(root=None, max_age_seconds=7 * 86400):
+    """
+    删除超过 max_age_seconds 没有更新的检查点目录（中断后一直没有继续的处理）。
+    返回:
+        被删除的目录数。
+    """
+    root = root or default_checkpoint_root()
+    if not os.path.isdir(root):
+        return 0
+    removed = 0
+    now = time.time()
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        if os.path.isdir(path) and now - os.path.getmtime(path) > max_age_seconds:
+            shutil.rmtree(path, ignore_errors=True)
+            removed += 1
+    return removed
+
+
+class CheckpointedRecorder(TrackingDataRecorder):
+    def __init__(self, fps, checkpoint_dir, checkpoint_frames=None, checkpoint_seconds=300.0, **kwargs):
+        """
+        定期把结果落盘的记录器，长时间处理中途崩溃后可以从最近的检查点继续。
+        每个检查点：结束当前视频分段（segment_XXXXX.mp4）、把新增的姿态行追加写入 poses.bin，
+        最后原子地写入 manifest.json 记录已提交的行数、最后一帧的帧号与分段列表。
+        清单是唯一的提交标记：崩溃时未提交的分段和 poses.bin 末尾多出的数据在下次打开时丢弃，
+        因此最多需要重新处理一个检查点间隔内的帧。
+        每个检查点都会结束一个视频分段，间隔默认按处理时间取几分钟：中断后的返工不超过这段时间，
+        长时间处理也只产生几十个分段，而不是每几百帧一个。
+        checkpoint_dir 中已有有效检查点时自动恢复已提交的数据，调用方用 resume_frame() 得到继续处理的起始帧。
+        save() 时只有一个分段（没有中断过的短处理）则直接移动为最终视频；
+        多个分段有 ffmpeg 时直接拼接，否则重新编码。然后写出 CSV 并删除检查点目录。
+        参数:
+            fps: 输出视频的帧率。
+            checkpoint_dir (str): 检查点目录，同一次处理（相同视频与设置）应使用相同的目录。
+            checkpoint_frames (int): 每记录多少帧做一次检查点，None 表示只按时间。
+            checkpoint_seconds (float): 距上次检查点超过该时间（秒）时做一次检查点，None 表示只按帧数。
+            kwargs: 其它 TrackingDataRecorder 参数（stream_video 固定为 True）。
+        """
+        kwargs["stream_video"] = True
+        super().__init__(fps, **kwargs)
+        self.checkpoint_dir = checkpoint_dir
+        self.checkpoint_frames = max(1, int(checkpoint_frames)) if checkpoint_frames is not None else None
+        self.checkpoint_seconds = checkpoint_seconds
+        self._record_dtype = _record_dtype(len(self.point_names))
+        self._committed_rows = 0
+        self._segments = []  # 已提交的分段 [{"file": 文件名, "frames": 帧数}]
+        self._last_checkpoint_time = time.monotonic()
+        self.resumed_rows = 0
+        os.makedirs(checkpoint_dir, exist_ok=True)
+        self._restore()
+
+    @property
+    def _poses_path(self):
+        return os.path.join(self.checkpoint_dir, _POSES_NAME)
+
+    def _restore(self):
+        """读取已提交的检查点，并清理上次崩溃时留下的未提交数据。"""
+        manifest = _read_manifest(self.checkpoint_dir)
+        if manifest is not None and manifest["point_names"] != list(self.point_names):
+            raise ValueError(f"检查点 {self.checkpoint_dir} 的关键点与当前设置不一致")
+        if manifest is not None and not all(os.path.exists(os.path.join(self.checkpoint_dir, segment["file"]))
+                                            for segment in manifest["segments"]):
+            # 分段已被移走（保存过程中被中断），检查点不再完整，从头处理
+            manifest = None
+        if manifest is not None:
+            self._segments = manifest["segments"]
+            self._committed_rows = manifest["committed_rows"]
+        # 截断 poses.bin 中未提交的尾部，删除未提交的分段
+        with open(self._poses_path, "ab") as f:
+            f.truncate(self._committed_rows * self._record_dtype.itemsize)
+        keep = {_MANIFEST_NAME, _POSES_NAME} | {segment["file"] for segment in self._segments}
+        for name in os.listdir(self.checkpoint_dir):
+            if name in keep:
+                continue
+            path = os.path.join(self.checkpoint_dir, name)
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                os.remove(path)
+        if not self._committed_rows:
+            return
+
+        records = np.fromfile(self._poses_path, dtype=self._record_dtype, count=self._committed_rows)
+        self._ensure_capacity(len(records))
+        self._poses[:len(records)] = records["pose"]
+        self._diameters[:len(records)] = records["diameter"]
+        self._frame_indices[:len(records)] = records["frame_index"]
+        self._interpolated[:len(records)] = records["interpolated"].astype(bool)
+        self._num_poses = len(records)
+        self.resumed_rows = len(records)
+        print(f"从检查点恢复 {len(records)} 帧，最后一帧为第 {int(records['frame_index'][-1])} 帧")
+
+    def resume_frame(self, stride=1):
+        """继续处理的起始帧号；没有已提交的数据时返回 None（从头处理）。"""
+        if not self._committed_rows:
+            return None
+        return int(self._frame_indices[self._committed_rows - 1]) + max(1, int(stride))
+
+    def _new_video_path(self):
+        return os.path.join(self.checkpoint_dir, f"segment_{len(self._segments):05d}.mp4")
+
+    def _new_store_path(self):
+        # 列式存储不属于检查点：恢复时由已提交的行重新写出
+        return os.path.join(self.checkpoint_dir, "store")
+
+    def add_frame_pose(self, pose_data, frame_index=None, interpolated=False):
+        diameter = super().add_frame_pose(pose_data, frame_index, interpolated)
+        pending = self._num_poses - self._committed_rows
+        if (self.checkpoint_frames is not None and pending >= self.checkpoint_frames) or (
+                self.checkpoint_seconds is not None
+                and time.monotonic() - self._last_checkpoint_time >= self.checkpoint_seconds):
+            self.checkpoint()
+        return diameter
+
+    def checkpoint(self):
+        """
+        提交目前为止记录的所有帧。
+        调用方需保证每帧的 add_frame 与 add_frame_pose 都已完成（流水线的记录阶段在两者之后才进入下一帧）。
+        """
+        with span("recorder.checkpoint"):
+            if self._video_stream is not None:
+                stream, self._video_stream = self._video_stream, None
+                stream.finish()
+                _fsync_file(stream.path)
+                if stream.frames_written:
+                    self._segments.append({"file": os.path.basename(stream.path), "frames": stream.frames_written})
+                else:
+                    os.remove(stream.path)
+
+            start, end = self._committed_rows, self._num_poses
+            if end > start:
+                records = np.empty(end - start, dtype=self._record_dtype)
+                records["frame_index"] = self._frame_indices[start:end]
+                records["interpolated"] = self._interpolated[start:end]
+                records["pose"] = self._poses[start:end]
+                records["diameter"] = self._diameters[start:end]
+                with open(self._poses_path, "ab") as f:
+                    records.tofile(f)
+                    f.flush()
+                    os.fsync(f.fileno())
+
+            # 清单最后写入，作为这次检查点的提交标记
+            write_json_atomic(os.path.join(self.checkpoint_dir, _MANIFEST_NAME), {
+                "version": CHECKPOINT_VERSION,
+                "point_names": list(self.point_names),
+                "fps": self.fps,
+                "committed_rows": end,
+                "last_frame_index": int(self._frame_indices[end - 1]) if end else None,
+                "segments": self._segments,
+                "updated": time.time(),
+            })
+            self._committed_rows = end
+            self._last_checkpoint_time = time.monotonic()
+
+    def save_video(self, file_name="tracking_output"):
+        """把所有已提交的分段合并为 file_name。"""
+        paths = [os.path.join(self.checkpoint_dir, segment["file"]) for segment in self._segments]
+        if not paths:
+            print("没有帧可保存！")
+            return
+        if len(paths) == 1:
+            os.replace(paths[0], file_name)
+        elif not self._concat_with_ffmpeg(paths, file_name):
+            self._concat_with_opencv(paths, file_name)
+        print(f"视频已保存到 {file_name}")
+
+    def _concat_with_ffmpeg(self, paths, file_name):
+        """用 ffmpeg concat 直接拼接分段（不重新编码）；没有 ffmpeg 或拼接失败时返回 False。"""
+        ffmpeg = shutil.which("ffmpeg")
+        if ffmpeg is None:
+            return False
+        fd, list_path = tempfile.mkstemp(suffix=".txt", dir=self.checkpoint_dir)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            for path in paths:
+                f.write(f"file '{os.path.abspath(path)}'\n")
+        try:
+            subprocess.run([ffmpeg, "-y", "-loglevel", "error", "-f", "concat", "-safe", "0", "-i", list_path,
+                            "-c", "copy", file_name], check=True)
+            return True
+        except (OSError, subprocess.CalledProcessError) as e:
+            print(f"ffmpeg 拼接失败，改为重新编码: {e}")
+            return False
+        finally:
+            os.remove(list_path)
+
+    def _concat_with_opencv(self, paths, file_name):
+        """逐帧读取分段并重新编码为一个视频。"""
+        writer = None
+        try:
+            for path in paths:
+                cap = cv2.VideoCapture(path)
+                while True:
+                    ret, frame = cap.read()
+                    if not ret:
+                        break
+                    if writer is None:
+                        height, width = frame.shape[:2]
+                        writer = cv2.VideoWriter(file_name, cv2.VideoWriter_fourcc(*'mp4v'), self.fps,
+                                                 (width, height))
+                    writer.write(frame)
+                cap.release()
+        finally:
+            if writer is not None:
+                writer.release()
+
+    def save(self, file_name="tracking_output"):
+        """提交剩余的帧，写出最终的 CSV 与合并后的视频，然后删除检查点目录。"""
+        self.checkpoint()
+        paths = super().save(file_name)
+        self.remove_checkpoint()
+        return paths
+
+    def remove_checkpoint(self):
+        """删除检查点目录（处理完成或不再需要继续时）。"""
+        if self._video_stream is not None:
+            self.discard_video()
+        shutil.rmtree(self.checkpoint_dir, ignore_errors=True)
@@ -0,0 +1,247 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+
+import numpy as np
+
+from utils import file_sha256, get_absolute_path, write_json_atomic
+
+# 缓存格式版本，改变存储方式时递增以使旧缓存失效
+CACHE_FORMAT_VERSION = 1
+
+
+class _FrameCacheWriter:
+    """
+    把解码出的帧顺序写入一个预分配的内存映射 .npy 临时文件。
+    commit() 时原子地重命名为正式条目，abort() 时删除临时文件。
+    """
+
+    # 每写入多少帧刷新一次锁文件的时间戳，表明写入者仍然存活
+    _HEARTBEAT_FRAMES = 100
+
+    def __init__(self, cache, key, frame_shape, dtype, max_frames, fps, metadata_frame_count):
+        self.cache = cache
+        self.key = key
+        self.max_frames = max_frames
+        self.fps = fps
+        self.metadata_frame_count = metadata_frame_count
+        self.frames_written = 0
+        self._tmp_path = os.path.join(cache.cache_dir, f"{key}.{uuid.uuid4().hex}.tmp.npy")
+        self._array = np.lib.format.open_memmap(
+            self._tmp_path, mode="w+", dtype=dtype, shape=(max_frames,) + tuple(frame_shape)
+        )
+        self.closed = False
+
+    def write(self, frame):
+        """
+        写入下一帧。
+        返回:
+            bool，帧数超出预分配大小或形状不符时返回 False，此时应调用 abort()。
+        """
+        if self.closed or self.frames_written >= self.max_frames or frame.shape != self._array.shape[1:]:
+            return False
+        self._array[self.frames_written] = frame
+        self.frames_written += 1
+        if self.frames_written % self._HEARTBEAT_FRAMES == 0:
+            self.cache._touch_lock(self.key)
+        return True
+
+    def commit(self):
+        """完成写入：刷新到磁盘、重命名为正式条目并写入元数据。"""
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self._array.flush()
+            del self._array
+            os.replace(self._tmp_path, self.cache._data_path(self.key))
+            meta = {
+                "version": CACHE_FORMAT_VERSION,
+                "frames": self.frames_written,
+                "fps": self.fps,
+                "metadata_frame_count": self.metadata_frame_count,
+                "created": time.time(),
+            }
+            # 元数据最后写入，作为条目完整可用的标记
+            write_json_atomic(self.cache._meta_path(self.key), meta)
+            print(f"解码帧已写入缓存: {self.key} ({self.frames_written} 帧)")
+        finally:
+            self.cache._release_lock(self.key)
+        self.cache.evict()
+
+    def abort(self):
+        """放弃写入并删除临时文件。"""
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            del self._array
+            os.remove(self._tmp_path)
+        except OSError:
+            pass
+        finally:
+            self.cache._release_lock(self.key)
+
+
+class FrameCache:
+    def __init__(self, cache_dir=None, max_bytes=20 * 1024 ** 3, stale_lock_seconds=600):
+        """
+        基于内存映射文件的持久化解码帧缓存。
+        条目按视频文件内容哈希与解码设置作为键，以 .npy 格式保存，读取时通过 np.load(mmap_mode='r')
+        零拷贝访问，不再运行解码器。总大小超过 max_bytes 时按最近使用时间淘汰。
+        写入使用临时文件 + 原子重命名，并用锁文件避免多个进程重复填充同一条目，可在多个工作进程中同时使用。
+        参数:
+            cache_dir (str): 缓存目录，默认 cache/frames。
+            max_bytes (int): 缓存总大小上限（字节）。
+            stale_lock_seconds (float): 锁文件超过该时间未更新即视为写入者已退出。
+        """
+        self.cache_dir = cache_dir or get_absolute_path(os.path.join("cache", "frames"))
+        self.max_bytes = max_bytes
+        self.stale_lock_seconds = stale_lock_seconds
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _data_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.npy")
+
+    def _meta_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _lock_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.lock")
+
+    def make_key(self, video_path, **decode_settings):
+        """根据视频内容哈希与解码设置生成缓存键。"""
+        payload = json.dumps(
+            {"video": file_sha256(video_path), "version": CACHE_FORMAT_VERSION, **decode_settings},
+            sort_keys=True,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+    def lookup(self, key):
+        """
+        查找缓存条目。
+        返回:
+            (frames, meta)，frames 为只读内存映射数组 (N, H, W, 3)；未命中时返回 None。
+        """
+        meta_path = self._meta_path(key)
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            frames = np.load(self._data_path(key), mmap_mode="r")
+        except (OSError, ValueError):
+            return None
+        if meta.get("version") != CACHE_FORMAT_VERSION:
+            return None
+        # 更新修改时间，作为 LRU 淘汰的依据
+        try:
+            os.utime(meta_path)
+        except OSError:
+            pass
+        return frames[:meta["frames"]], meta
+
+    def _acquire_lock(self, key):
+        lock_path = self._lock_path(key)
+        for _ in range(2):
+            try:
+                fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                os.write(fd, str(os.getpid()).encode())
+                os.close(fd)
+                return True
+            except FileExistsError:
+                try:
+                    if time.time() - os.path.getmtime(lock_path) < self.stale_lock_seconds:
+                        return False
+                    os.remove(lock_path)  # 写入者已退出，清理过期的锁
+                except OSError:
+                    return False
+        return False
+
+    def _touch_lock(self, key):
+        try:
+            os.utime(self._lock_path(key))
+        except OSError:
+            pass
+
+    def _release_lock(self, key):
+        try:
+            os.remove(self._lock_path(key))
+        except OSError:
+            pass
+
+    def create_writer(self, key, frame_shape, dtype, max_frames, fps=0, metadata_frame_count=0):
+        """
+        为缓存未命中的视频创建写入器。
+        返回:
+            _FrameCacheWriter；如果其它进程正在填充该条目、预计大小超过上限或磁盘空间不足，返回 None。
+        """
+        if max_frames <= 0:
+            return None
+        required = int(np.prod(frame_shape)) * np.dtype(dtype).itemsize * max_frames
+        if required > self.max_bytes:
+            print(f"视频解码后约 {required / 1024 ** 3:.1f} GB，超过缓存上限，不进行缓存。")
+            return None
+        if not self._acquire_lock(key):
+            return None
+        try:
+            self.evict(reserve_bytes=required)
+            if shutil.disk_usage(self.cache_dir).free < required:
+                print("磁盘剩余空间不足，不进行解码帧缓存。")
+                self._release_lock(key)
+                return None
+            return _FrameCacheWriter(self, key, frame_shape, dtype, max_frames, fps, metadata_frame_count)
+        except OSError as e:
+            print(f"创建解码帧缓存失败: {e}")
+            self._release_lock(key)
+            return None
+
+    def entries(self):
+        """列出所有完整条目，返回 [(key, size_bytes, last_used)]，按最近使用时间从旧到新排序。"""
+        result = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".json"):
+                continue
+            key = name[:-len(".json")]
+            try:
+                size = os.path.getsize(self._data_path(key))
+                last_used = os.path.getmtime(self._meta_path(key))
+            except OSError:
+                continue
+            result.append((key, size, last_used))
+        result.sort(key=lambda entry: entry[2])
+        return result
+
+    def remove(self, key):
+        """删除一个条目。先删除元数据，使其它进程不再命中。"""
+        for path in (self._meta_path(key), self._data_path(key)):
+            try:
+                os.remove(path)
+            except OSError:
+                # Windows 下仍被映射的文件无法删除，留待下次淘汰
+                pass
+
+    def evict(self, reserve_bytes=0):
+        """按最近使用时间淘汰条目，直到总大小加上 reserve_bytes 不超过 max_bytes。"""
+        # 顺带清理崩溃的写入者遗留的临时文件
+        now = time.time()
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            try:
+                if name.endswith(".tmp.npy") and now - os.path.getmtime(path) > self.stale_lock_seconds:
+                    os.remove(path)
+            except OSError:
+                pass
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for key, size, _ in entries:
+            if total + reserve_bytes <= self.max_bytes:
+                break
+            self.remove(key)
+            total -= size
+
+    def clear(self):
+        """删除所有条目。"""
+        for key, _, _ in self.entries():
+            self.remove(key)
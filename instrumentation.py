@@ -0,0 +1,151 @@
+import threading
+import time
+from array import array
+from collections import deque
+
+import numpy as np
+
+# 每个线程当前生效的 Instrumentation 与正在处理的帧号
+_local = threading.local()
+
+
+class _NullSpan:
+    """未启用计时时使用的空上下文，进入/退出几乎没有开销。"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ("instrumentation", "name", "frame_index", "begin")
+
+    def __init__(self, instrumentation, name, frame_index):
+        self.instrumentation = instrumentation
+        self.name = name
+        self.frame_index = frame_index
+
+    def __enter__(self):
+        self.begin = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.instrumentation.add(self.frame_index, self.name, time.perf_counter() - self.begin)
+        return False
+
+
+def span(name):
+    """
+    计时一个命名区间：with span("inference"): ...
+    耗时记录到当前线程激活的 Instrumentation 中，归属于 set_frame 设置的帧；
+    当前线程没有激活 Instrumentation 时返回空上下文，开销只有一次线程局部变量查找。
+    """
+    instrumentation = getattr(_local, "instrumentation", None)
+    if instrumentation is None:
+        return _NULL_SPAN
+    return _Span(instrumentation, name, _local.frame_index)
+
+
+def set_frame(frame_index):
+    """设置当前线程接下来的区间所属的帧号。"""
+    if getattr(_local, "instrumentation", None) is not None:
+        _local.frame_index = frame_index
+
+
+class Instrumentation:
+    def __init__(self, window=300):
+        """
+        逐帧阶段耗时记录器。
+        在线程中调用 activate() 后，该线程里的 span() 都会记录到本实例；未激活的线程中 span() 是空操作，
+        因此模型、记录器等模块中的计时点在未启用时几乎没有开销。
+        每个阶段的耗时以列式数组保存（帧号 + 秒数），另外保留最近 window 个样本用于计算滚动 p50/p95。
+        参数:
+            window (int): 滚动统计使用的最近样本数。
+        """
+        self.window = window
+        self._samples = {}  # 阶段名 -> (帧号 array('q'), 耗时 array('d'))
+        self._recent = {}  # 阶段名 -> deque(耗时)
+        self._frame_times = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def activate(self):
+        """让当前线程中的 span() 记录到本实例。"""
+        _local.instrumentation = self
+        _local.frame_index = None
+
+    @staticmethod
+    def deactivate():
+        """停止在当前线程中记录。"""
+        _local.instrumentation = None
+        _local.frame_index = None
+
+    def add(self, frame_index, name, seconds):
+        """记录一个阶段耗时；frame_index 为 None 时只计入滚动统计，不写入逐帧记录。"""
+        with self._lock:
+            recent = self._recent.get(name)
+            if recent is None:
+                recent = self._recent[name] = deque(maxlen=self.window)
+                self._samples[name] = (array("q"), array("d"))
+            recent.append(seconds)
+            if frame_index is not None:
+                indices, durations = self._samples[name]
+                indices.append(frame_index)
+                durations.append(seconds)
+
+    def frame_done(self):
+        """标记一帧处理完成，用于计算吞吐。"""
+        self._frame_times.append(time.perf_counter())
+
+    def throughput(self):
+        """最近 window 帧的平均吞吐（帧/秒）。"""
+        times = list(self._frame_times)
+        if len(times) < 2 or times[-1] <= times[0]:
+            return 0.0
+        return (len(times) - 1) / (times[-1] - times[0])
+
+    def summary(self):
+        """
+        返回滚动统计:
+            {阶段名: {"p50": 毫秒, "p95": 毫秒, "count": 累计样本数}}
+        """
+        with self._lock:
+            recent = {name: np.fromiter(values, dtype=np.float64) for name, values in self._recent.items()}
+            counts = {name: len(self._samples[name][1]) or len(self._recent[name]) for name in self._recent}
+        result = {}
+        for name, values in recent.items():
+            p50, p95 = np.percentile(values, [50, 95]) * 1000
+            result[name] = {"p50": float(p50), "p95": float(p95), "count": counts[name]}
+        return result
+
+    def summary_text(self):
+        """滚动统计的单行文本，用于界面显示。"""
+        parts = [f"{name} {stats['p50']:.1f}/{stats['p95']:.1f}ms" for name, stats in self.summary().items()]
+        return f"吞吐 {self.throughput():.1f} fps | p50/p95: " + ", ".join(parts)
+
+    def to_dataframe(self):
+        """逐帧耗时表：每行一帧，每个阶段一列（毫秒，同一帧多次进入的区间累加）。"""
+        import pandas as pd
+        with self._lock:
+            frames = [
+                pd.DataFrame({"frame_index": np.frombuffer(indices, dtype=np.int64),
+                              "stage": name,
+                              "ms": np.frombuffer(durations, dtype=np.float64) * 1000})
+                for name, (indices, durations) in self._samples.items() if len(indices)
+            ]
+        if not frames:
+            return pd.DataFrame(columns=["frame_index"])
+        table = pd.concat(frames).pivot_table(index="frame_index", columns="stage", values="ms", aggfunc="sum")
+        table.columns.name = None
+        return table.reset_index()
+
+    def save_csv(self, file_name):
+        """把逐帧耗时保存为 CSV（与追踪数据 CSV 放在一起的旁车文件）。"""
+        self.to_dataframe().to_csv(file_name, index=False, float_format="%.3f")
+        print(f"[INFO] Frame timings saved to {file_name}")
@@ -0,0 +1,265 @@
+import argparse
+import os
+import time
+
+import cv2
+import numpy as np
+from tqdm import tqdm
+
+from pupil_metrics import pupil_diameters
+from utils import get_absolute_path
+from video_loader import LocalVideoLoader
+
+# 运动检测使用的缩略图尺寸 (宽, 高)
+_THUMBNAIL_SIZE = (64, 48)
+
+
+def _thumbnail(frame):
+    """把帧缩小为灰度缩略图用于运动检测；输入已是缩略图时原样返回。"""
+    if frame.ndim == 3:
+        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    if frame.shape[1::-1] != _THUMBNAIL_SIZE:
+        frame = cv2.resize(frame, _THUMBNAIL_SIZE, interpolation=cv2.INTER_AREA)
+    return frame
+
+
+def interpolate_poses(start_pose, end_pose, num_between):
+    """
+    在两个关键帧姿态之间线性插值。
+    返回:
+        (num_between, P, 3) 数组；坐标与置信度都线性插值。
+    """
+    weights = (np.arange(1, num_between + 1) / (num_between + 1))[:, None, None]
+    return (1 - weights) * start_pose[None] + weights * end_pose[None]
+
+
+def extrapolate_pose(prev_pose, last_pose, gap, steps):
+    """
+    恒速预测：按最近两个关键帧之间的速度外推 steps 帧之后的姿态。
+    置信度取两个关键帧中较小的一个，避免预测结果比实测更可信。
+    """
+    pose = np.array(last_pose, dtype=np.float64)
+    if prev_pose is not None and gap > 0:
+        pose[:, :2] += (last_pose[:, :2] - prev_pose[:, :2]) * (steps / gap)
+        pose[:, 2] = np.minimum(prev_pose[:, 2], last_pose[:, 2])
+    return pose
+
+
+class KeyframeInference:
+    def __init__(self, model, interval=4, motion_threshold=None, predictor="linear"):
+        """
+        关键帧推理：只对每 interval 帧中的一帧（或画面变化超过阈值的帧）运行模型，其余帧的姿态由关键帧填充。
+        参数:
+            model: 提供 infer_pose(frame) 的模型（ModelLoader）。
+            interval (int): 关键帧间隔，1 表示每帧都推理。
+            motion_threshold (float): 与上一关键帧缩略图的平均灰度差超过该值时立即推理，None 表示不检测运动。
+            predictor (str): "linear" 在相邻关键帧之间线性插值（需要缓存最多 interval-1 帧，结果有相应延迟）；
+                             "velocity" 按最近两个关键帧的速度恒速外推（无延迟）。
+        """
+        if predictor not in ("linear", "velocity"):
+            raise ValueError(f"未知的填充方式: {predictor}")
+        self.model = model
+        self.interval = max(1, int(interval))
+        self.motion_threshold = motion_threshold
+        self.predictor = predictor
+        self.reset()
+
+    def reset(self):
+        self._pending = []  # linear 模式下等待下一个关键帧的 (frame_index, frame)
+        self._last_key = None  # (frame_index, pose)
+        self._prev_key = None
+        self._last_key_thumbnail = None
+        self._since_key = 0
+        self.keyframes = 0
+        self.filled = 0
+
+    def _infer(self, frame_index, frame):
+        return self.model.infer_pose(frame)
+
+    def _is_keyframe(self, frame):
+        if self._last_key is None or self._since_key + 1 >= self.interval:
+            return True
+        if self.motion_threshold is None:
+            return False
+        diff = cv2.absdiff(_thumbnail(frame), self._last_key_thumbnail)
+        return float(diff.mean()) > self.motion_threshold
+
+    def _run_keyframe(self, frame_index, frame):
+        pose = np.asarray(self._infer(frame_index, frame), dtype=np.float64)
+        self._prev_key = self._last_key
+        self._last_key = (frame_index, pose)
+        if self.motion_threshold is not None:
+            self._last_key_thumbnail = _thumbnail(frame)
+        self._since_key = 0
+        self.keyframes += 1
+        return pose
+
+    def _fill_pending(self, end_pose):
+        """用上一关键帧和 end_pose 之间的线性插值填充缓存的帧。"""
+        if not self._pending:
+            return []
+        self.filled += len(self._pending)
+        start_pose = self._prev_key[1]
+        poses = interpolate_poses(start_pose, end_pose, len(self._pending))
+        results = [(index, frame, pose, True) for (index, frame), pose in zip(self._pending, poses)]
+        self._pending = []
+        return results
+
+    def process(self, frame_index, frame):
+        """
+        处理一帧。
+        返回:
+            list[(frame_index, frame, pose, interpolated)]，按帧顺序；linear 模式下非关键帧会被缓存，
+            直到下一个关键帧到达时一并返回。
+        """
+        if self._is_keyframe(frame):
+            pose = self._run_keyframe(frame_index, frame)
+            return self._fill_pending(pose) + [(frame_index, frame, pose, False)]
+
+        self._since_key += 1
+        if self.predictor == "linear":
+            self._pending.append((frame_index, frame))
+            return []
+        self.filled += 1
+        prev_pose = None if self._prev_key is None else self._prev_key[1]
+        gap = 0 if self._prev_key is None else self._last_key[0] - self._prev_key[0]
+        pose = extrapolate_pose(prev_pose, self._last_key[1], gap, frame_index - self._last_key[0])
+        return [(frame_index, frame, pose, True)]
+
+    def flush(self):
+        """视频结束时调用：把最后一个缓存帧作为关键帧推理，并插值填充其余缓存帧。"""
+        if not self._pending:
+            return []
+        frame_index, frame = self._pending.pop()
+        pose = self._run_keyframe(frame_index, frame)
+        return self._fill_pending(pose) + [(frame_index, frame, pose, False)]
+
+
+class _ReplayKeyframeInference(KeyframeInference):
+    """评估用：关键帧的姿态直接取自全量推理的结果，不再运行模型。"""
+
+    def __init__(self, reference_poses, interval, motion_threshold, predictor):
+        super().__init__(None, interval, motion_threshold, predictor)
+        self.reference_poses = reference_poses
+
+    def _infer(self, frame_index, frame):
+        return self.reference_poses[frame_index]
+
+
+def evaluate_intervals(video_path, model, intervals=(1, 2, 4, 8, 16), predictor="linear", motion_threshold=None,
+                       max_frames=3000, pcutoff=None):
+    """
+    在参考视频上比较不同关键帧间隔的精度与速度，用于选择 interval。
+    先对每一帧做一次全量推理作为参考，再对每个 interval 重放关键帧选择与填充过程（关键帧直接取参考结果），
+    与参考结果比较。速度按实测的单帧推理耗时与运动检测耗时估算。
+    注意: 启用自适应 ROI 时关键帧的实际结果会依赖前一关键帧，评估时应关闭 ROI。
+    参数:
+        video_path (str): 参考视频。
+        model: ModelLoader 实例。
+        intervals: 要评估的关键帧间隔。
+        predictor, motion_threshold: 同 KeyframeInference。
+        max_frames (int): 最多使用的帧数，None 表示整段视频。
+        pcutoff (float): 计算直径误差时使用的置信度阈值。
+    返回:
+        list[dict]，每个 interval 一行。
+    """
+    loader = LocalVideoLoader(video_path, end_frame=max_frames)
+    thumbnails = []
+    reference = []
+    infer_seconds = []
+    thumbnail_seconds = 0.0
+    with tqdm(total=loader.get_expected_frame_count(), desc="全量推理") as progress:
+        while (frame := loader.get_frame()) is not None:
+            begin = time.perf_counter()
+            thumbnails.append(_thumbnail(frame))
+            thumbnail_seconds += time.perf_counter() - begin
+            begin = time.perf_counter()
+            reference.append(np.asarray(model.infer_pose(frame), dtype=np.float64))
+            infer_seconds.append(time.perf_counter() - begin)
+            progress.update(1)
+    loader.release()
+    if not reference:
+        raise ValueError(f"视频中没有可读取的帧: {video_path}")
+
+    reference = np.stack(reference)
+    num_frames = len(reference)
+    # 第一帧包含模型预热，不计入单帧耗时
+    per_frame_infer = float(np.mean(infer_seconds[1:] if num_frames > 1 else infer_seconds))
+    per_frame_thumbnail = thumbnail_seconds / num_frames
+    reference_diameters = pupil_diameters(reference, pcutoff=pcutoff)
+
+    rows = []
+    for interval in intervals:
+        replay = _ReplayKeyframeInference(reference, interval, motion_threshold, predictor)
+        poses = np.empty_like(reference)
+        interpolated = np.zeros(num_frames, dtype=bool)
+        outputs = []
+        for frame_index, thumbnail in enumerate(thumbnails):
+            outputs.extend(replay.process(frame_index, thumbnail))
+        outputs.extend(replay.flush())
+        for frame_index, _, pose, is_filled in outputs:
+            poses[frame_index] = pose
+            interpolated[frame_index] = is_filled
+
+        diameters = pupil_diameters(poses, pcutoff=pcutoff)
+        diameter_error = np.abs(diameters - reference_diameters)
+        keypoint_error = np.linalg.norm(poses[:, :, :2] - reference[:, :, :2], axis=2)
+        check_motion = motion_threshold is not None and interval > 1
+        estimated_seconds = replay.keyframes * per_frame_infer + (num_frames * per_frame_thumbnail if check_motion else 0)
+        rows.append({
+            "interval": interval,
+            "keyframes": replay.keyframes,
+            "interpolated_frames": int(interpolated.sum()),
+            "diameter_mae": float(np.nanmean(diameter_error)),
+            "diameter_p95_error": float(np.nanpercentile(diameter_error, 95)),
+            "diameter_relative_error": float(np.nanmean(diameter_error / np.abs(reference_diameters))),
+            "keypoint_rmse": float(np.sqrt(np.mean(keypoint_error ** 2))),
+            "estimated_fps": num_frames / estimated_seconds if estimated_seconds > 0 else float("inf"),
+            "estimated_speedup": (num_frames * per_frame_infer) / estimated_seconds if estimated_seconds > 0 else float("inf"),
+        })
+    return rows
+
+
+def format_report(rows):
+    """把 evaluate_intervals 的结果格式化为文本表格。"""
+    lines = [f"{'interval':>8} {'keyframes':>10} {'diam MAE':>10} {'diam p95':>10} {'diam rel%':>10} "
+             f"{'kp RMSE':>9} {'est fps':>9} {'speedup':>8}"]
+    for row in rows:
+        lines.append(
+            f"{row['interval']:>8} {row['keyframes']:>10} {row['diameter_mae']:>10.3f} {row['diameter_p95_error']:>10.3f} "
+            f"{row['diameter_relative_error'] * 100:>10.2f} {row['keypoint_rmse']:>9.3f} {row['estimated_fps']:>9.1f} "
+            f"{row['estimated_speedup']:>7.1f}x"
+        )
+    return "\n".join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="评估关键帧推理在不同间隔下的精度与速度")
+    parser.add_argument("video", help="参考视频路径")
+    parser.add_argument("--model", required=True, help="模型目录")
+    parser.add_argument("--intervals", type=int, nargs="+", default=[1, 2, 4, 8, 16], help="要评估的关键帧间隔")
+    parser.add_argument("--predictor", choices=["linear", "velocity"], default="linear", help="非关键帧的填充方式")
+    parser.add_argument("--motion-threshold", type=float, default=None, help="运动检测阈值（平均灰度差）")
+    parser.add_argument("--max-frames", type=int, default=3000, help="最多使用的帧数")
+    parser.add_argument("--resize", type=float, default=1.0)
+    parser.add_argument("--pcutoff", type=float, default=0.5)
+    parser.add_argument("--output", default=None, help="把报告另存为 CSV 的文件名（保存在 output 目录下）")
+    args = parser.parse_args()
+
+    from model_loader import ModelLoader
+
+    rows = evaluate_intervals(
+        args.video,
+        ModelLoader(args.model, resize=args.resize, pcutoff=args.pcutoff),
+        intervals=args.intervals,
+        predictor=args.predictor,
+        motion_threshold=args.motion_threshold,
+        max_frames=args.max_frames,
+        pcutoff=args.pcutoff,
+    )
+    print(format_report(rows))
+    if args.output:
+        import pandas as pd
+        output_path = os.path.join(get_absolute_path("output"), args.output)
+        pd.DataFrame(rows).to_csv(output_path, index=False)
+        print(f"报告已保存到 {output_path}")
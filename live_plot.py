@@ -0,0 +1,98 @@
+import numpy as np
+
+from utils import RateLimiter, generate_plotly_lineplot
+
+
+def lttb_downsample(x, y, n_out):
+    """
+    Largest-Triangle-Three-Buckets 降采样：保留曲线的峰谷形状，把点数压缩到 n_out。
+    参数:
+        x, y: 一维数组，x 需单调递增。
+        n_out: 输出点数（至少 3）；点数不超过 n_out 时原样返回。
+    返回:
+        (x_out, y_out)
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return x, y
+
+    # 首尾点固定，中间的点平均分成 n_out - 2 个桶
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    selected = np.empty(n_out, dtype=int)
+    selected[0] = 0
+    selected[-1] = n - 1
+    prev = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        # 下一个桶的平均点作为三角形的第三个顶点
+        next_start, next_end = end, edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+        areas = np.abs(
+            (x[prev] - avg_x) * (y[start:end] - y[prev])
+            - (x[prev] - x[start:end]) * (avg_y - y[prev])
+        )
+        prev = start + int(np.argmax(areas))
+        selected[i + 1] = prev
+    return x[selected], y[selected]
+
+
+class LivePlot:
+    def __init__(self, refresh_hz=4.0, max_points=1000, window_size=50, use_sliding_window=False,
+                 initial_capacity=4096):
+        """
+        实时直径曲线：数据追加到预分配的数组中，按 refresh_hz 限频重绘，
+        历史过长时用 LTTB 降采样到 max_points 个点，使每次刷新的开销与视频长度无关。
+        参数:
+            refresh_hz (float): 最大刷新频率，<= 0 表示每次都刷新。
+            max_points (int): 每次绘图最多发送到前端的点数。
+            window_size (int): 滑动窗口大小（帧）。
+            use_sliding_window (bool): 是否只显示最近 window_size 帧。
+            initial_capacity (int): 数据数组的初始容量。
+        """
+        self.max_points = max_points
+        self.window_size = window_size
+        self.use_sliding_window = use_sliding_window
+        self._limiter = RateLimiter(refresh_hz)
+        self._x = np.empty(initial_capacity, dtype=np.float64)
+        self._y = np.empty(initial_capacity, dtype=np.float64)
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def append(self, frame_index, value):
+        """追加一个数据点，容量不足时翻倍扩容。"""
+        if self._count == len(self._x):
+            self._x = np.concatenate([self._x, np.empty_like(self._x)])
+            self._y = np.concatenate([self._y, np.empty_like(self._y)])
+        self._x[self._count] = frame_index
+        self._y[self._count] = value
+        self._count += 1
+
+    def extend(self, frame_indices, values):
+        """一次追加多个数据点。"""
+        for frame_index, value in zip(frame_indices, values):
+            self.append(frame_index, value)
+
+    def render(self, force=False):
+        """
+        生成当前的 Plotly 图。
+        返回:
+            go.Figure；未到刷新时间（且 force 为 False）或没有数据时返回 None。
+        """
+        if self._count == 0 or not (self._limiter.ready() or force):
+            return None
+        x = self._x[:self._count]
+        y = self._y[:self._count]
+        if self.use_sliding_window:
+            x = x[-self.window_size:]
+            y = y[-self.window_size:]
+        x, y = lttb_downsample(x, y, self.max_points)
+        return generate_plotly_lineplot(
+            x.tolist(), y.tolist(),
+            window_size=self.window_size,
+            use_sliding_window=self.use_sliding_window,
+        )
@@ -1,26 +1,68 @@
+import startup  # 最先导入，启动计时从这里开始
+
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import time
 from datetime import datetime
-import gradio as gr
+
+import cv2
+
+with startup.timer.phase("import gradio"):
+    import gradio as gr
 from tqdm import tqdm
 
-from model_loader import ModelLoader
-from utils import *
-from video_loader import LocalVideoLoader
-from tracking_data_recorder import TrackingDataRecorder
+# TensorFlow / DLCLive / pandas / plotly 都在首次使用时才导入，界面启动后由后台线程预加载
+with startup.timer.phase("import app modules"):
+    from model_cache import ModelCache
+    from frame_cache import FrameCache
+    from instrumentation import Instrumentation
+    from live_plot import LivePlot
+    from keyframe_inference import KeyframeInference
+    from pipeline import VideoProcessingPipeline
+    from preview_policy import PreviewPolicy
+    from result_index import ResultIndex
+    from utils import *
+    from video_loader import LocalVideoLoader
+    from checkpoint_recorder import CheckpointedRecorder, checkpoint_key, default_checkpoint_root, remove_stale_checkpoints
 
 class MainWindow:
-    def __init__(self):
+    def __init__(self, max_concurrent_jobs=2, max_queue_size=16):
+        """
+        参数:
+            max_concurrent_jobs (int): 同时处理视频的最大任务数（即同时被占用的模型实例数），其余请求排队。
+            max_queue_size (int): 排队等待的最大请求数，超出时新请求被拒绝。
+        """
         # print("strat loading backend...")
         # 参数选择模块
         print(get_absolute_path("pretrain_model"))
-        self.loaded_model_instance : ModelLoader = None
-        self.data_recorder_instance :TrackingDataRecorder= None
-        self.is_tensorrt_available = check_tensorrt_available()
+        # 当前选择的模型与后处理参数按会话保存在 gr.State 中，多个用户同时使用时互不影响
+        self.max_concurrent_jobs = max(1, int(max_concurrent_jobs))
+        self.max_queue_size = max_queue_size
+        with startup.timer.phase("probe tensorrt"):
+            self.is_tensorrt_available = check_tensorrt_available()
         self.current_model_names = get_pretrain_models()
         self.display = True
+        self.frame_cache: FrameCache = None
+        # 已加载模型的缓存与实例池：切换模型/缩放比例时复用已预热的实例，每个任务独占一个实例
+        self.model_cache = ModelCache(max_models=max(3, self.max_concurrent_jobs),
+                                      max_concurrent=self.max_concurrent_jobs)
+        # 已处理结果的索引：相同视频、模型与设置再次处理时直接返回已有结果
+        self.result_index = ResultIndex()
+        # 不复用结果时，结果键（需要读取整个视频与模型目录计算哈希）在后台计算，不延迟处理的开始
+        self._result_key_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="result-key")
+        # 正在处理的检查点键：相同视频与设置共用一个检查点目录，不能同时处理
+        self._active_results = set()
+        self._active_results_lock = threading.Lock()
+        # 清理很久没有继续的中断处理留下的检查点
+        remove_stale_checkpoints()
+        # 实时曲线的刷新频率 (Hz) 与最多绘制的点数
+        self.plot_refresh_hz = 4.0
+        self.plot_max_points = 1000
 
         with gr.Blocks(title="MouseEyeTracker Demo", theme=gr.themes.Soft()) as self.demo:
+            # 每个浏览器会话独立的状态：所选模型（路径、类型、缩放比例）与 pcutoff / ROI 设置
+            self.session_state = gr.State(self._new_session_state())
             # 第1行：标题
             with gr.Row():
                 with gr.Column(scale=4): # 标题占据更多空间
@@ -37,6 +79,30 @@ class MainWindow:
                             value=False,  # 默认不选中
                             interactive=self.is_tensorrt_available
                         )
+                    with gr.Row():
+                        self.roi_checkbox = gr.Checkbox(
+                            label="启用自适应 ROI 裁剪",
+                            value=False,  # 默认不选中
+                            interactive=True
+                        )
+                    with gr.Row():
+                        self.frame_cache_checkbox = gr.Checkbox(
+                            label="启用解码帧缓存",
+                            value=False,  # 默认不选中
+                            interactive=True
+                        )
+                    with gr.Row():
+                        self.reuse_results_checkbox = gr.Checkbox(
+                            label="复用已有的处理结果",
+                            value=True,  # 默认选中
+                            interactive=True
+                        )
+                    with gr.Row():
+                        self.profiling_checkbox = gr.Checkbox(
+                            label="启用逐帧性能分析",
+                            value=False,  # 默认不选中
+                            interactive=True
+                        )
                     with gr.Row():
                         self.slidingwindow_checkbox = gr.Checkbox(
                             label="启用滑动窗口绘图",
@@ -92,6 +158,62 @@ class MainWindow:
                         height=360  # 可以调整显示高度
                     )
 
+            with gr.Row():
+                self.start_time_number = gr.Number(
+                    label="起始时间 (秒, Start Time)",
+                    value=0,
+                    minimum=0,
+                    interactive=True
+                )
+                self.end_time_number = gr.Number(
+                    label="结束时间 (秒, 0 表示到结尾, End Time)",
+                    value=0,
+                    minimum=0,
+                    interactive=True
+                )
+                self.stride_number = gr.Number(
+                    label="帧间隔 (Stride)",
+                    value=1,
+                    minimum=1,
+                    precision=0,
+                    interactive=True
+                )
+                self.keyframe_interval_number = gr.Number(
+                    label="关键帧间隔 (1 表示每帧推理, Keyframe Interval)",
+                    value=1,
+                    minimum=1,
+                    precision=0,
+                    interactive=True
+                )
+                self.motion_threshold_number = gr.Number(
+                    label="运动检测阈值 (0 表示不检测, 关键帧间隔大于 1 时生效)",
+                    value=0,
+                    minimum=0,
+                    interactive=True
+                )
+
+            with gr.Row():
+                self.preview_fps_slider = gr.Slider(
+                    label="预览帧率 (Preview FPS)",
+                    minimum=1,
+                    maximum=30,
+                    step=1,
+                    value=10,
+                    interactive=True
+                )
+                self.preview_scale_dropdown = gr.Dropdown(
+                    label="预览缩放比例 (Preview Scale)",
+                    choices=[0.25, 0.5, 1.0],
+                    value=1.0,
+                    interactive=True
+                )
+                self.stats_textbox = gr.Textbox(
+                    label="处理统计 (Stats)",
+                    value="",
+                    interactive=False,
+                    lines=2
+                )
+
             # 第4行：处理按钮
             self.process_button = gr.Button("开始处理视频 (Process Video)", variant="primary")
 
@@ -100,6 +222,12 @@ class MainWindow:
                     label="瞳孔直径变化图 (Pupil Diameter over Time)",
                 )
 
+            self.result_files = gr.File(
+                label="结果文件 (Result Files)",
+                file_count="multiple",
+                interactive=False
+            )
+
             # --- 定义组件的交互行为 ---
 
             # 刷新模型列表按钮的行为
@@ -109,50 +237,228 @@ class MainWindow:
                 outputs=[self.model_param_selector]  # 更新模型下拉列表
             )
 
-            self.model_param_selector.change(
-                fn=self.load_model_by_name,
-                inputs=[self.model_param_selector,self.resize_dropdown, self.pcutoff_dropdown],
-                outputs=[self.status_textbox]
+            # 模型、缩放比例或 TensorRT 改变时需要换用另一个模型实例（命中缓存时无需重新加载）
+            model_inputs = [self.model_param_selector, self.resize_dropdown, self.pcutoff_dropdown,
+                            self.roi_checkbox, self.tensorrt_checkbox]
+            for component in (self.model_param_selector, self.resize_dropdown, self.tensorrt_checkbox):
+                component.change(
+                    fn=self.load_model_by_name,
+                    inputs=model_inputs + [self.session_state],
+                    outputs=[self.status_textbox, self.session_state]
+                )
+
+            # pcutoff 与 ROI 只影响后处理，只更新会话设置，处理时应用到取出的模型实例上
+            self.pcutoff_dropdown.change(
+                fn=self.update_pcutoff,
+                inputs=[self.pcutoff_dropdown, self.session_state],
+                outputs=[self.status_textbox, self.session_state]
+            )
+            self.roi_checkbox.change(
+                fn=self.update_roi_mode,
+                inputs=[self.roi_checkbox, self.session_state],
+                outputs=[self.status_textbox, self.session_state]
             )
 
             # 处理视频按钮的行为
             self.process_button.click(
                 fn=self.gradio_video_processor_wrapper,
-                inputs=[self.video_input_component],
-                outputs=[self.video_output_component,self.plot_component]
+                inputs=[self.video_input_component, self.preview_fps_slider, self.preview_scale_dropdown,
+                        self.frame_cache_checkbox, self.start_time_number, self.end_time_number,
+                        self.stride_number, self.keyframe_interval_number, self.motion_threshold_number,
+                        self.profiling_checkbox, self.reuse_results_checkbox, self.session_state],
+                outputs=[self.video_output_component, self.plot_component, self.stats_textbox, self.result_files],
+                # 超出并发数的请求在 Gradio 队列中排队，不会同时抢占模型实例
+                concurrency_limit=self.max_concurrent_jobs,
+                concurrency_id="process_video"
             )
 
-    def gradio_video_processor_wrapper(self,video_path):
+    @staticmethod
+    def _new_session_state():
+        return {"model": None, "model_name": None, "pcutoff": 0.5, "roi_mode": False}
 
-        if self.loaded_model_instance is None:
-            self.status_textbox.value = "模型未加载，请加载模型后重试"
+    def gradio_video_processor_wrapper(self, video_path, preview_fps=10, preview_scale=1.0, use_frame_cache=False,
+                                       start_time=0, end_time=0, stride=1, keyframe_interval=1, motion_threshold=0,
+                                       profiling=False, reuse_results=True, session=None):
+        """
+        从模型池中独占一个实例处理视频，处理结束（或中断）后归还。
+        相同视频、模型与设置已处理过时直接返回已有结果，不再运行流水线。
+        """
+        if not session or session.get("model") is None:
+            gr.Warning("模型未加载，请加载模型后重试")
+            return
+        if not video_path:
+            gr.Warning("请先上传视频")
             return
-        video_loader = LocalVideoLoader(video_path)
-        model = self.loaded_model_instance
-        frame_indices = []
-        diameters = []
-        self.data_recorder_instance = TrackingDataRecorder(fps=video_loader.fps)
-        it = tqdm(range(len(video_loader.frame_list)))
-        for i in it:
-            frame = video_loader.get_frame()
-            if frame is None:
+
+        model_settings = session["model"]
+        stride = max(1, int(stride or 1))
+        keyframe_interval = max(1, int(keyframe_interval or 1))
+        settings = dict(
+            model_type=model_settings["model_type"], roi_mode=session["roi_mode"], display=self.display,
+            start_time=start_time, end_time=end_time, stride=stride,
+            keyframe_interval=keyframe_interval, motion_threshold=motion_threshold,
+        )
+
+        def content_key():
+            return self.result_index.key_for_run(
+                video_path, model_settings["model_path"], model_settings["resize"], session["pcutoff"], **settings
+            )
+
+        result_key = result_key_future = None
+        if reuse_results:
+            result_key = content_key()
+            entry = self.result_index.lookup(result_key)
+            if entry is not None:
+                yield from self._replay_result(result_key, entry)
                 return
-            pose = model.infer_pose(frame)
-            if self.display:
-                frame = draw_keypoints(frame, pose)
-            self.data_recorder_instance.add_frame(frame)
-            self.data_recorder_instance.add_frame_pose(pose)
-            diameter = estimate_pupil_diameter(pose)  # 你已有的函数
-            diameters.append(diameter)
-            frame_indices.append(i)
-            plot_fig = generate_plotly_lineplot(frame_indices, diameters, window_size=50)
-            yield frame,plot_fig
+        else:
+            # 不复用结果时不等待内容哈希，处理结束登记结果前再取
+            result_key_future = self._result_key_executor.submit(content_key)
+
+        # 检查点只按文件名、大小与修改时间区分视频，不读取视频内容
+        run_key = checkpoint_key(video_path, model_path=model_settings["model_path"], resize=model_settings["resize"],
+                                 pcutoff=session["pcutoff"], **settings)
+        with self._active_results_lock:
+            if run_key in self._active_results:
+                gr.Warning("相同的视频与设置正在处理中，请等待其完成")
+                return
+            self._active_results.add(run_key)
+        try:
+            with self.model_cache.acquire(**model_settings, pcutoff=session["pcutoff"],
+                                          roi_mode=session["roi_mode"]) as model:
+                csv_path, result_video_path, recorder = yield from self._process_video(
+                    model, video_path, preview_fps, preview_scale, use_frame_cache, start_time, end_time, stride,
+                    keyframe_interval, motion_threshold, profiling, run_key, reuse_results
+                )
+        finally:
+            with self._active_results_lock:
+                self._active_results.discard(run_key)
+        if result_key_future is not None:
+            result_key = result_key_future.result()
+        # 关键帧的位置依赖处理的起点，从检查点继续的关键帧结果与一次处理完的不同，不登记到结果索引
+        if not (recorder.resumed_rows and keyframe_interval > 1):
+            self.result_index.add(
+                result_key, csv_path, result_video_path, recorder.frame_indices, recorder.diameters,
+                video_name=os.path.basename(video_path), model_name=session.get("model_name"),
+            )
+        yield gr.skip(), gr.skip(), gr.skip(), [path for path in (csv_path, result_video_path) if os.path.exists(path)]
+
+    def _replay_result(self, result_key, entry):
+        """命中结果索引：显示已有视频的第一帧，并把保存的直径序列分段推送到曲线图。"""
+        gr.Info("该视频已用相同的模型与设置处理过，直接返回已有结果。")
+        files = [path for path in (entry["csv_path"], entry.get("video_path")) if path]
+        preview = gr.skip()
+        if entry.get("video_path"):
+            cap = cv2.VideoCapture(entry["video_path"])
+            ret, frame = cap.read()
+            cap.release()
+            if ret:
+                preview = frame
+        series = self.result_index.load_series(result_key)
+        if series is None:
+            yield preview, gr.skip(), "已复用处理结果", files
+            return
+        frame_indices, diameters = series
+        live_plot = LivePlot(refresh_hz=self.plot_refresh_hz, max_points=self.plot_max_points, window_size=50)
+        chunk = max(1, len(diameters) // 10)
+        for start in range(0, len(diameters), chunk):
+            live_plot.extend(frame_indices[start:start + chunk], diameters[start:start + chunk])
+            yield preview, live_plot.render(force=True), f"已复用处理结果 ({min(start + chunk, len(diameters))}/{len(diameters)} 帧)", files
+            preview = gr.skip()
+
+    def _process_video(self, model, video_path, preview_fps, preview_scale, use_frame_cache,
+                       start_time, end_time, stride, keyframe_interval, motion_threshold, profiling, run_key,
+                       reuse_results=True):
+        """
+        运行处理流水线并按预览帧率推送画面与曲线。
+        结果定期写入以 run_key 命名的检查点目录；上次处理中断时从最后提交的帧继续
+        （reuse_results 为 False 时删除旧检查点，从头处理）。
+        返回（生成器的返回值）:
+            (csv_path, video_path, recorder)
+        """
+        if use_frame_cache and self.frame_cache is None:
+            self.frame_cache = FrameCache()
+        # 只处理部分范围时，在 CSV 中写出每行对应的原视频帧索引
+        partial = bool(start_time or end_time) or stride > 1
+        # 关键帧模式：只对每 keyframe_interval 帧（或画面变化较大的帧）推理，其余帧插值，并在 CSV 中标记
+        keyframe_inference = None
+        if keyframe_interval > 1:
+            keyframe_inference = KeyframeInference(model, interval=keyframe_interval,
+                                                   motion_threshold=motion_threshold or None)
+        # 帧率在打开视频后设置，视频写入器在收到第一帧时才创建
+        def create_recorder():
+            return CheckpointedRecorder(None, os.path.join(default_checkpoint_root(), run_key),
+                                        include_frame_index=partial,
+                                        track_interpolation=keyframe_inference is not None)
+
+        recorder = create_recorder()
+        if not reuse_results and recorder.resumed_rows:
+            recorder.remove_checkpoint()
+            recorder = create_recorder()
+        resume_frame = recorder.resume_frame(stride)
+        if resume_frame is not None:
+            gr.Info(f"从第 {resume_frame} 帧继续上次中断的处理")
+        video_loader = LocalVideoLoader(
+            video_path,
+            frame_cache=self.frame_cache if use_frame_cache else None,
+            start_frame=resume_frame or 0,
+            start_time=None if resume_frame is not None else start_time or None,
+            end_time=end_time or None,
+            stride=stride,
+        )
+        recorder.fps = video_loader.fps / stride
+        preview_policy = PreviewPolicy(target_fps=preview_fps, scale=preview_scale)
+        live_plot = LivePlot(refresh_hz=self.plot_refresh_hz, max_points=self.plot_max_points, window_size=50)
+        if recorder.num_frames:
+            live_plot.extend(recorder.frame_indices, recorder.diameters)
+        # 性能分析：记录每帧各阶段耗时，界面显示滚动 p50/p95，结束后保存为 CSV 旁车文件
+        instrumentation = Instrumentation() if profiling else None
+        pipeline = VideoProcessingPipeline(video_loader, model, recorder, display=self.display,
+                                           pcutoff=model.pcutoff_value, keyframe_inference=keyframe_inference,
+                                           instrumentation=instrumentation)
+
+        def stats_text():
+            if instrumentation is None:
+                return preview_policy.stats_text()
+            return preview_policy.stats_text() + "\n" + instrumentation.summary_text()
+
+        it = tqdm(total=video_loader.get_expected_frame_count())
+        try:
+            frame = None
+            for i, frame, pose, diameter in pipeline.run():
+                live_plot.append(i, diameter)
+                it.update(1)
+                # 每帧都推理，但只按预览帧率推送画面；未到刷新时间时不更新曲线，避免每帧重建整张图
+                ui_begin = time.perf_counter()
+                preview = preview_policy.offer(frame)
+                plot_fig = live_plot.render()
+                if instrumentation is not None:
+                    instrumentation.add(i, "ui_render", time.perf_counter() - ui_begin)
+                if preview is None and plot_fig is None:
+                    continue
+                yield_begin = time.perf_counter()
+                yield (gr.skip() if preview is None else preview,
+                       gr.skip() if plot_fig is None else plot_fig,
+                       stats_text(),
+                       gr.skip())
+                if instrumentation is not None:
+                    instrumentation.add(i, "ui_yield", time.perf_counter() - yield_begin)
+            if frame is not None:
+                yield preview_policy.final(frame), live_plot.render(force=True), stats_text(), gr.skip()
+        except BaseException:
+            # 处理被中断或出错时，丢弃未提交的视频分段；已提交的检查点保留，下次处理相同视频时继续
+            recorder.discard_video()
+            raise
+        finally:
+            it.close()
 
         base_name = os.path.basename(video_path)
         filename, _ = os.path.splitext(base_name)
-        self.data_recorder_instance.save(filename)
-        self.status_textbox.value = f"{base_name}处理完成"
-        return
+        csv_path, result_video_path = recorder.save(filename)
+        if instrumentation is not None:
+            instrumentation.save_csv(os.path.splitext(csv_path)[0] + "_timings.csv")
+        gr.Info(f"{base_name}处理完成")
+        return csv_path, result_video_path, recorder
 
     def handle_refresh_models(self):
         """
@@ -166,32 +472,69 @@ class MainWindow:
         print(f"UI事件：模型列表已更新为 {self.current_model_names}，将默认选中 '{new_value}'")
         return gr.update(choices=self.current_model_names, value=new_value)
 
-    def load_model_by_name(self, model_name_to_load,resize, pcutoff):
+    def load_model_by_name(self, model_name_to_load,resize, pcutoff, roi_mode=False, use_tensorrt=False, session=None):
         """
         根据选择的模型名称加载模型。
-        这个函数会被 Dropdown 的 change 事件调用。
+        这个函数会被模型、缩放比例和 TensorRT 选项的 change 事件调用；
+        所选模型记录在会话状态中，模型实例在 ModelCache 中创建并在后台预热，处理视频时再从池中取出。
         """
+        session = dict(session or self._new_session_state())
+        session["pcutoff"] = pcutoff
+        session["roi_mode"] = roi_mode
         if not model_name_to_load or model_name_to_load == "请选择模型":
-            self.loaded_model_instance = None
+            session["model"] = None
+            session["model_name"] = None
             status_message = "没有选择模型。"
             print(status_message)
-            return status_message  # 返回状态给 UI
+            return status_message, session  # 返回状态给 UI
 
         base_path = get_absolute_path("pretrain_model")
         model_path = os.path.join(base_path, model_name_to_load)
         if os.path.exists(model_path):
+            model_type = "tensorrt" if use_tensorrt and self.is_tensorrt_available else "base"
+            cached = self.model_cache.is_ready(model_path, model_type, resize)
             print(f"开始加载模型: {model_name_to_load}...")
-            self.loaded_model_instance = ModelLoader(model_path,resize=resize, pcutoff=pcutoff)
-            status_message = f"模型 '{model_name_to_load}' 加载成功！"
+            self.model_cache.preload(model_path, model_type=model_type, resize=resize)
+            session["model"] = {"model_path": model_path, "model_type": model_type, "resize": resize}
+            session["model_name"] = model_name_to_load
+            if cached:
+                status_message = f"模型 '{model_name_to_load}' 已从缓存加载！"
+            else:
+                status_message = f"模型 '{model_name_to_load}' 正在后台加载与预热，处理视频时会等待其就绪。"
         else :
-            print(f"模型{model_name_to_load}不存在")
+            session["model"] = None
+            session["model_name"] = None
+            status_message = f"模型{model_name_to_load}不存在"
+            print(status_message)
+
+        return status_message, session
+
+    def update_pcutoff(self, pcutoff, session):
+        """pcutoff 只影响绘制与后处理，只更新会话设置，不重新加载模型。"""
+        session = dict(session)
+        session["pcutoff"] = pcutoff
+        return f"置信度阈值已设为 {pcutoff}", session
 
-        return status_message
+    def update_roi_mode(self, roi_mode, session):
+        """切换自适应 ROI 裁剪，不重新加载模型。"""
+        session = dict(session)
+        session["roi_mode"] = roi_mode
+        return f"自适应 ROI 裁剪已{'启用' if roi_mode else '关闭'}", session
     
     def run(self):
-        self.demo.launch(server_name="127.0.0.1", server_port=28989, share=False, inbrowser=False)
+        with startup.timer.phase("launch server"):
+            # 所有事件经过队列：处理视频的并发数由 concurrency_limit 控制，超出 max_size 的请求直接被拒绝
+            self.demo.queue(max_size=self.max_queue_size)
+            self.demo.launch(server_name="127.0.0.1", server_port=28989, share=False, inbrowser=False,
+                             prevent_thread_lock=True)
+        print(f"界面已就绪，用时 {startup.timer.elapsed():.2f}s")
+        # 界面可用之后再在后台加载 TensorFlow 等模块，完成时输出完整的启动报告
+        startup.preload_modules(on_done=lambda: print(startup.timer.report()))
+        self.demo.block_thread()
 
 
 
 if __name__ == '__main__':
-    MainWindow().run()
\ No newline at end of file
+    with startup.timer.phase("build ui"):
+        window = MainWindow()
+    window.run()
\ No newline at end of file
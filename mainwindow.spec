@@ -13,7 +13,8 @@ a = Analysis(
     pathex=[],
     binaries=[],
     datas=datas,
-    hiddenimports=[],
+    # imported lazily (startup.preload_modules / first use), listed so they are always bundled
+    hiddenimports=['tensorflow', 'dlclive', 'pandas', 'plotly.graph_objects'],
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
@@ -0,0 +1,201 @@
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from model_loader import ModelLoader
+
+
+def _directory_size(path):
+    """模型目录下所有文件的总大小（字节），用来估算模型加载后的内存占用。"""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class _CacheEntry:
+    """一个模型实例及其状态；busy 表示正被某个任务独占使用。"""
+
+    def __init__(self, model, size_bytes):
+        self.model = model
+        self.size_bytes = size_bytes
+        self.ready = threading.Event()
+        self.error = None
+        self.busy = False
+
+
+class ModelCache:
+    def __init__(self, max_models=3, max_bytes=4 * 1024 ** 3, warmup_shape=(480, 640, 3), memory_factor=3.0,
+                 max_instances_per_model=2, max_concurrent=2):
+        """
+        已加载模型的 LRU 缓存与实例池。
+        以 (模型路径, model_type, resize, precision) 为键，切换回最近用过的模型时无需重新加载 TensorFlow 图；
+        新模型在后台线程中用空白帧预热，首次推理不再额外付出 init_inference 的开销。
+        推理任务通过 acquire() 独占一个实例：同一个键最多创建 max_instances_per_model 个实例，
+        所有键合计最多 max_concurrent 个实例同时被占用，超出时排队等待，因此多个用户之间不会共享
+        DLCLive 会话或互相覆盖 pcutoff / ROI 状态。
+        pcutoff、ROI 等只影响后处理的参数不属于键，在 acquire 时应用到取出的实例上。
+        参数:
+            max_models (int): 最多同时保留的模型实例数（空闲的实例按最近使用顺序淘汰）。
+            max_bytes (int): 估算内存占用的上限（字节）。
+            warmup_shape (tuple): 预热用空白帧的形状。
+            memory_factor (float): 模型文件大小到加载后内存占用的估算倍数。
+            max_instances_per_model (int): 同一个键最多创建的实例数。
+            max_concurrent (int): 所有键合计最多同时被占用的实例数。
+        """
+        self.max_models = max(1, int(max_models))
+        self.max_bytes = max_bytes
+        self.warmup_shape = warmup_shape
+        self.memory_factor = memory_factor
+        self.max_instances_per_model = max(1, int(max_instances_per_model))
+        self.max_concurrent = max(1, int(max_concurrent))
+        self._entries = OrderedDict()  # 键 -> [_CacheEntry]
+        self._condition = threading.Condition()
+
+    @staticmethod
+    def make_key(model_path, model_type="base", resize=1.0, precision="FP32"):
+        return os.path.abspath(model_path), model_type, float(resize), precision
+
+    def _create_entry(self, key, model_kwargs):
+        """创建一个新实例并在后台预热（调用方持有锁）。"""
+        model_path, model_type, resize, precision = key
+        model = ModelLoader(model_path, model_type=model_type, resize=resize, precision=precision, **model_kwargs)
+        entry = _CacheEntry(model, _directory_size(model_path) * self.memory_factor)
+        self._entries.setdefault(key, []).append(entry)
+        self._entries.move_to_end(key)
+        threading.Thread(target=self._warmup, args=(entry,), name="ModelCache-warmup", daemon=True).start()
+        self._evict()
+        return entry
+
+    def preload(self, model_path, model_type="base", resize=1.0, precision="FP32", **model_kwargs):
+        """确保该模型至少有一个实例（没有时创建并在后台预热），不占用实例。"""
+        key = self.make_key(model_path, model_type, resize, precision)
+        with self._condition:
+            if self._entries.get(key):
+                self._entries.move_to_end(key)
+            else:
+                self._create_entry(key, model_kwargs)
+
+    @contextmanager
+    def acquire(self, model_path, model_type="base", resize=1.0, precision="FP32", pcutoff=0.5, roi_mode=False,
+                timeout=None, **model_kwargs):
+        """
+        独占一个模型实例：with cache.acquire(path, resize=0.5, pcutoff=0.6) as model: ...
+        有空闲实例时直接取出，否则在数量限制内新建，达到限制时等待其它任务释放。
+        参数:
+            pcutoff, roi_mode: 本次使用的后处理参数，应用到取出的实例上。
+            timeout (float): 最长等待时间（秒），None 表示一直等待；超时抛出 TimeoutError。
+        """
+        key = self.make_key(model_path, model_type, resize, precision)
+        with self._condition:
+            entry = None
+
+            def reserve():
+                nonlocal entry
+                entry = self._try_reserve(key, model_kwargs)
+                return entry is not None
+
+            if not self._condition.wait_for(reserve, timeout):
+                raise TimeoutError("等待空闲模型实例超时")
+
+        try:
+            # 预热失败（例如模型文件损坏）时把错误交给调用方，并从缓存中移除该实例
+            entry.ready.wait()
+            if entry.error is not None:
+                raise entry.error
+            entry.model.set_pcutoff(pcutoff)
+            entry.model.roi_mode = roi_mode
+            entry.model.reset_roi()
+            yield entry.model
+        finally:
+            with self._condition:
+                entry.busy = False
+                if entry.error is not None:
+                    self._discard(key, entry)
+                self._evict()
+                self._condition.notify_all()
+
+    def _try_reserve(self, key, model_kwargs):
+        """
+        在并发限制内占用一个实例：优先使用该键的空闲实例，其次新建实例（调用方持有锁）。
+        返回:
+            被占用的 _CacheEntry；达到限制时返回 None。
+        """
+        if sum(e.busy for es in self._entries.values() for e in es) >= self.max_concurrent:
+            return None
+        entries = self._entries.get(key, [])
+        entry = next((e for e in entries if not e.busy and e.error is None), None)
+        if entry is None:
+            if len(entries) >= self.max_instances_per_model:
+                return None
+            entry = self._create_entry(key, model_kwargs)
+        entry.busy = True
+        self._entries.move_to_end(key)
+        return entry
+
+    def _warmup(self, entry):
+        try:
+            entry.model.warmup(self.warmup_shape)
+        except Exception as e:
+            entry.error = e
+            print(f"模型预热失败: {e}")
+        finally:
+            entry.ready.set()
+
+    def is_ready(self, model_path, model_type="base", resize=1.0, precision="FP32"):
+        """该模型是否已有完成预热的实例。"""
+        with self._condition:
+            entries = list(self._entries.get(self.make_key(model_path, model_type, resize, precision), []))
+        return any(entry.ready.is_set() and entry.error is None for entry in entries)
+
+    def stats(self):
+        """返回 (实例总数, 被占用的实例数)。"""
+        with self._condition:
+            entries = [e for es in self._entries.values() for e in es]
+        return len(entries), sum(e.busy for e in entries)
+
+    def _discard(self, key, entry):
+        """从缓存中移除一个实例并关闭其会话（调用方持有锁）。"""
+        entries = self._entries.get(key, [])
+        if entry in entries:
+            entries.remove(entry)
+        if not entries:
+            self._entries.pop(key, None)
+        entry.model.close()
+
+    def _evict(self):
+        """按最近使用顺序淘汰空闲实例，直到数量与估算内存都不超过上限（调用方持有锁）。"""
+        entries = [(key, e) for key, es in self._entries.items() for e in es]
+        count = len(entries)
+        total = sum(e.size_bytes for _, e in entries)
+        for key, entry in entries:
+            if count <= self.max_models and total <= self.max_bytes:
+                break
+            # 正在使用或尚未完成预热的实例不淘汰
+            if entry.busy or not entry.ready.is_set():
+                continue
+            print(f"模型缓存已满，释放模型: {key[0]} (resize={key[2]})")
+            self._discard(key, entry)
+            count -= 1
+            total -= entry.size_bytes
+
+    def remove(self, model_path, model_type="base", resize=1.0, precision="FP32"):
+        """移除该模型的所有空闲实例。"""
+        key = self.make_key(model_path, model_type, resize, precision)
+        with self._condition:
+            for entry in list(self._entries.get(key, [])):
+                if not entry.busy:
+                    self._discard(key, entry)
+
+    def clear(self):
+        """移除所有空闲实例。"""
+        with self._condition:
+            for key in list(self._entries):
+                for entry in list(self._entries.get(key, [])):
+                    if not entry.busy:
+                        self._discard(key, entry)
@@ -1,15 +1,21 @@
+import threading
 import warnings
-from typing import Optional
+from typing import TYPE_CHECKING, Optional
 
 import numpy as np  # For creating a dummy frame if needed for init
-from dlclive import DLCLive, Processor  # Assuming Processor is correctly importable or defined
-from dlclive.exceptions import DLCLiveError  # For error handling
+
+from instrumentation import span
+
+# dlclive pulls in TensorFlow, which takes seconds to import, so it is only imported
+# when a model is actually constructed. This keeps the UI start-up fast.
+if TYPE_CHECKING:
+    from dlclive import DLCLive, Processor
 
 
 class ModelLoader:
     def __init__(self,
                  model_path: str,
-                 processor: Optional[Processor] = None,
+                 processor: Optional["Processor"] = None,
                  model_type: str = "base",
                  # Explicit parameters with defaults for DLCLive
                  resize: float = 1.0,  # 1.0 means no resize, pass directly to DLCLive
@@ -17,6 +23,13 @@ class ModelLoader:
                  display_frames: bool = False, # Maps to DLCLive's 'display'
                  display_radius: int = 3,
                  display_cmap: str = "bmy",
+                 # Number of frames sent through the session per call in infer_pose_batch
+                 batch_size: int = 8,
+                 # Adaptive eye ROI: infer on a padded crop around the previous frame's keypoints
+                 roi_mode: bool = False,
+                 roi_margin: float = 0.5,  # padding on each side, as a fraction of the keypoint box size
+                 roi_min_size: int = 96,  # smallest crop side in pixels
+                 roi_align: int = 32,  # crop sides are rounded up to a multiple of this to keep input shapes stable
                  # For any other DLCLive parameters
                  **other_dlc_live_kwargs):
         self.model_path = model_path
@@ -28,9 +41,24 @@ class ModelLoader:
         self.show_display = display_frames
         self.marker_radius = display_radius
         self.marker_cmap = display_cmap
+        self.batch_size = max(1, int(batch_size))
+        # None = not probed yet, False = graph rejected a batched feed
+        self._batch_supported: Optional[bool] = None
+
+        if roi_mode and other_dlc_live_kwargs.get("cropping") is not None:
+            warnings.warn("Adaptive ROI cannot be combined with static cropping, ROI mode disabled.")
+            roi_mode = False
+        self.roi_mode = roi_mode
+        self.roi_margin = roi_margin
+        self.roi_min_size = roi_min_size
+        self.roi_align = max(1, int(roi_align))
+        self._roi = None  # (x0, y0, x1, y1) in full-frame pixels, None = next frame runs full-frame
+        self.roi_stats = {"roi": 0, "full": 0, "fallback": 0}
 
-        self.live: Optional[DLCLive] = None
+        self.live: Optional["DLCLive"] = None
         self.is_initialized: bool = False
+        # Serializes warm-up and inference, which share one DLCLive session
+        self._lock = threading.RLock()
         dlc_constructor_args = {
             "model_path": self.model_path,
             "model_type": self.model_type,
@@ -44,16 +72,181 @@ class ModelLoader:
         }
         print("-"*8+"当前模型参数"+"-"*8)
         print(dlc_constructor_args)
+        from dlclive import DLCLive
         self.live = DLCLive(**dlc_constructor_args)
 
+    def set_pcutoff(self, pcutoff: float):
+        """pcutoff only affects post-processing (ROI fallback, drawing), so it can change without a reload."""
+        self.pcutoff_value = pcutoff
+        if self.live is not None:
+            self.live.pcutoff = pcutoff
+
+    def warmup(self, frame_shape=(480, 640, 3)):
+        """Build the session and run one dummy frame so the first real infer_pose is not slow."""
+        with self._lock:
+            if not self.is_initialized:
+                self.live.init_inference(np.zeros(frame_shape, dtype=np.uint8))
+                self.is_initialized = True
+
+    def close(self):
+        """Release the underlying TensorFlow session."""
+        with self._lock:
+            if self.live is not None and self.is_initialized:
+                try:
+                    self.live.close()
+                except Exception as e:
+                    warnings.warn(f"Failed to close DLCLive session: {e}")
+            self.is_initialized = False
+
     def infer_pose(self, frame: np.ndarray) -> Optional[np.ndarray]:
+        with span("model.lock_wait"):
+            self._lock.acquire()
+        try:
+            return self._infer_pose(frame)
+        finally:
+            self._lock.release()
+
+    def _infer_pose(self, frame: np.ndarray) -> Optional[np.ndarray]:
         if not self.is_initialized:
-            pose = self.live.init_inference(frame)
+            with span("model.init"):
+                pose = self.live.init_inference(frame)
             self.is_initialized = True
+        elif self.roi_mode and self._roi is not None:
+            with span("model.roi"):
+                pose = self._infer_roi(frame)
         else:
-            pose = self.live.get_pose(frame)
+            with span("model.full"):
+                pose = self.live.get_pose(frame)
+            self.roi_stats["full"] += 1
+        if self.roi_mode:
+            self._roi = self._next_roi(pose, frame.shape)
         return pose
 
+    def reset_roi(self):
+        """Forget the tracked ROI, e.g. before starting a new video."""
+        self._roi = None
+        self.roi_stats = {"roi": 0, "full": 0, "fallback": 0}
+
+    def _infer_roi(self, frame: np.ndarray) -> np.ndarray:
+        """Infer on the current ROI crop and map the pose back to full-frame coordinates."""
+        x0, y0, x1, y1 = self._roi
+        pose = self.live.get_pose(frame[y0:y1, x0:x1])
+        pose[:, 0] += x0
+        pose[:, 1] += y0
+        if np.mean(pose[:, 2]) >= self.pcutoff_value:
+            self.roi_stats["roi"] += 1
+            return pose
+        # The eye left the crop or tracking degraded, redo this frame on the full image
+        self.roi_stats["fallback"] += 1
+        self._roi = None
+        return self.live.get_pose(frame)
+
+    def _next_roi(self, pose: np.ndarray, frame_shape) -> Optional[tuple]:
+        """Padded box around the confident keypoints of pose, or None if a full-frame pass is needed."""
+        confident = pose[:, 2] > self.pcutoff_value
+        if np.count_nonzero(confident) < 3:
+            return None
+        height, width = frame_shape[:2]
+        xs = pose[confident, 0]
+        ys = pose[confident, 1]
+        box_size = max(xs.max() - xs.min(), ys.max() - ys.min())
+        side = max(box_size * (1 + 2 * self.roi_margin), self.roi_min_size)
+        side = int(np.ceil(side / self.roi_align) * self.roi_align)
+        if side * side >= 0.75 * width * height:
+            return None  # a crop this large saves nothing
+        crop_w = min(side, width)
+        crop_h = min(side, height)
+        center_x = (xs.max() + xs.min()) / 2
+        center_y = (ys.max() + ys.min()) / 2
+        x0 = int(np.clip(round(center_x - crop_w / 2), 0, width - crop_w))
+        y0 = int(np.clip(round(center_y - crop_h / 2), 0, height - crop_h))
+        return x0, y0, x0 + crop_w, y0 + crop_h
+
+    def infer_pose_batch(self, frames, batch_size: Optional[int] = None) -> np.ndarray:
+        """
+        Run pose estimation on a stack of frames.
+
+        frames: an (N, H, W, 3) array or a sequence of N frames sharing one shape.
+        batch_size: frames per session call, defaults to self.batch_size.
+        Returns an (N, num_keypoints, 3) array, identical to stacking infer_pose results.
+        """
+        num_frames = len(frames)
+        if num_frames == 0:
+            return np.empty((0, 0, 3))
+        batch_size = self.batch_size if batch_size is None else max(1, int(batch_size))
+
+        with self._lock:
+            poses = []
+            start = 0
+            if not self.is_initialized:
+                # init_inference builds the session, so the first frame has to go through it alone
+                poses.append(self._infer_pose(frames[0]))
+                start = 1
+            for i in range(start, num_frames, batch_size):
+                poses.extend(self._get_pose_batch(frames[i:i + batch_size]))
+            return np.stack(poses)
+
+    def _can_batch(self) -> bool:
+        """Batching bypasses DLCLive.get_pose, so only allow it where get_pose has no per-frame state."""
+        if self._batch_supported is False:
+            return False
+        live = self.live
+        dynamic = getattr(live, "dynamic", None)
+        return (
+            self.model_type in ("base", "tensorrt")
+            and getattr(live, "sess", None) is not None
+            and getattr(live, "display", None) is None
+            and not (dynamic and dynamic[0])
+        )
+
+    def _get_pose_batch(self, frames) -> list:
+        if self.roi_mode:
+            # Each crop depends on the previous frame's pose, so ROI mode stays sequential
+            return [self._infer_pose(frame) for frame in frames]
+        if len(frames) == 1 or not self._can_batch():
+            return [self.live.get_pose(frame) for frame in frames]
+
+        live = self.live
+        with span("model.preprocess"):
+            batch = np.stack([live.process_frame(frame) for frame in frames]).astype(float)
+        try:
+            with span("model.session"):
+                outputs = live.sess.run(live.outputs, feed_dict={live.inputs: batch})
+        except Exception as e:
+            # Graphs exported with a fixed batch dimension reject anything but a single frame
+            warnings.warn(f"Batched inference not supported by this model ({e}), falling back to per-frame inference.")
+            self._batch_supported = False
+            return [live.get_pose(frame) for frame in frames]
+        if len(outputs) < 2:
+            # TFGPUinference graphs already decode poses on the device and do not expose per-frame maps
+            self._batch_supported = False
+            return [live.get_pose(frame) for frame in frames]
+        self._batch_supported = True
+
+        from dlclive.pose import argmax_pose_predict, extract_cnn_output, multi_pose_predict
+
+        cfg = live.cfg
+        num_outputs = cfg.get("num_outputs", 1)
+        poses = []
+        with span("model.postprocess"):
+            for b in range(len(frames)):
+                # Same post-processing as DLCLive.get_pose, applied to one slice of the batch
+                scmap, locref = extract_cnn_output([out[b:b + 1] for out in outputs], cfg)
+                if num_outputs > 1:
+                    pose = multi_pose_predict(scmap, locref, cfg["stride"], num_outputs)
+                else:
+                    pose = argmax_pose_predict(scmap, locref, cfg["stride"])
+                if live.resize is not None:
+                    pose[:, :2] *= 1 / live.resize
+                if live.cropping is not None:
+                    pose[:, 0] += live.cropping[0]
+                    pose[:, 1] += live.cropping[2]
+                if live.processor:
+                    pose = live.processor.process(pose)
+                poses.append(pose)
+        live.pose = poses[-1]
+        return poses
+
 
 if __name__ == '__main__':
     from video_loader import LocalVideoLoader
@@ -0,0 +1,242 @@
+import queue
+import threading
+import time
+
+from instrumentation import set_frame, span
+from utils import draw_keypoints
+
+# 阶段之间传递的结束标记
+_END_OF_STREAM = object()
+
+
+class _StageFailure:
+    """某个阶段抛出异常时向下游传递的包装对象，由消费者重新抛出。"""
+
+    def __init__(self, stage_name, error):
+        self.stage_name = stage_name
+        self.error = error
+
+
+class VideoProcessingPipeline:
+    def __init__(self, video_loader, model, recorder, display=True, pcutoff=0.5,
+                 queue_size=32, batch_size=1, keyframe_inference=None, instrumentation=None):
+        """
+        解码 → 推理 → 绘制/记录 的流水线。
+        各阶段运行在独立线程上，阶段之间用有界队列连接：下游处理不过来时上游会阻塞（背压），
+        因此内存占用有上限，整体吞吐接近最慢的阶段（通常是推理）。
+        解码阶段即 LocalVideoLoader 自身的后台解码线程。
+        参数:
+            video_loader: 提供 get_frame() 的视频加载器，读完时返回 None。
+            model: ModelLoader 实例。
+            recorder: TrackingDataRecorder 实例。
+            display (bool): 是否在帧上绘制关键点。
+            pcutoff (float): 绘制关键点的置信度阈值。
+            queue_size (int): 每个阶段间队列的最大长度。
+            batch_size (int): 大于 1 时推理阶段使用 ModelLoader.infer_pose_batch 批量推理。
+            keyframe_inference: 可选的 KeyframeInference，只对关键帧推理，其余帧由插值/预测填充
+                                （此时忽略 batch_size）。
+            instrumentation: 可选的 Instrumentation，记录每帧 decode / inference / draw / record 等阶段的耗时；
+                             为 None 时各计时点都是空操作。
+        """
+        self.video_loader = video_loader
+        self.model = model
+        self.recorder = recorder
+        self.display = display
+        self.pcutoff = pcutoff
+        self.queue_size = max(1, int(queue_size))
+        self.batch_size = max(1, int(batch_size))
+        self.keyframe_inference = keyframe_inference
+        self.instrumentation = instrumentation
+
+        self._stop_event = threading.Event()
+        self._threads = []
+        self._queues = []
+
+    def _put(self, q, item):
+        """向队列放入元素；队列满时阻塞，但在流水线被停止时及时返回 False。"""
+        while not self._stop_event.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q):
+        """从队列取出元素；流水线被停止时返回结束标记。"""
+        while not self._stop_event.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _END_OF_STREAM
+
+    def _run_stage(self, name, body, out_queue):
+        """执行一个阶段，并保证无论成功、失败都向下游发送结束信号。"""
+        if self.instrumentation is not None:
+            self.instrumentation.activate()
+        try:
+            body()
+            self._put(out_queue, _END_OF_STREAM)
+        except Exception as e:
+            self._put(out_queue, _StageFailure(name, e))
+
+    def _record_decode(self, frame_index, begin):
+        """记录取帧（等待解码线程）的耗时；帧号在取到帧之后才知道，因此不使用 span。"""
+        if self.instrumentation is not None:
+            self.instrumentation.add(frame_index, "decode", time.perf_counter() - begin)
+
+    def _keyframe_inference_stage(self, out_queue):
+        sequence = 0
+        keyframe_inference = self.keyframe_inference
+        keyframe_inference.reset()
+        while not self._stop_event.is_set():
+            begin = time.perf_counter()
+            frame = self.video_loader.get_frame()
+            if frame is None:
+                results = keyframe_inference.flush()
+            else:
+                frame_index = getattr(self.video_loader, "last_frame_index", None)
+                frame_index = sequence if frame_index is None else frame_index
+                self._record_decode(frame_index, begin)
+                set_frame(frame_index)
+                with span("inference"):
+                    results = keyframe_inference.process(frame_index, frame)
+                sequence += 1
+            for item in results:
+                if not self._put(out_queue, item):
+                    return
+            if frame is None:
+                return
+
+    def _inference_stage(self, out_queue):
+        if self.keyframe_inference is not None:
+            return self._keyframe_inference_stage(out_queue)
+        sequence = 0
+        while not self._stop_event.is_set():
+            frames = []
+            frame_indices = []
+            while len(frames) < self.batch_size:
+                begin = time.perf_counter()
+                frame = self.video_loader.get_frame()
+                if frame is None:
+                    break
+                # 使用帧在原视频中的索引（读取范围/stride 生效时与序号不同）
+                frame_index = getattr(self.video_loader, "last_frame_index", None)
+                frame_index = sequence if frame_index is None else frame_index
+                self._record_decode(frame_index, begin)
+                frames.append(frame)
+                frame_indices.append(frame_index)
+                sequence += 1
+            if not frames:
+                return
+
+            if self.batch_size > 1:
+                begin = time.perf_counter()
+                set_frame(None)
+                poses = self.model.infer_pose_batch(frames)
+                if self.instrumentation is not None:
+                    # 一个批次的耗时平均分摊到批内各帧
+                    seconds = (time.perf_counter() - begin) / len(frames)
+                    for frame_index in frame_indices:
+                        self.instrumentation.add(frame_index, "inference", seconds)
+            else:
+                set_frame(frame_indices[0])
+                with span("inference"):
+                    poses = [self.model.infer_pose(frames[0])]
+
+            for frame_index, frame, pose in zip(frame_indices, frames, poses):
+                if not self._put(out_queue, (frame_index, frame, pose, False)):
+                    return
+            if len(frames) < self.batch_size:
+                return
+
+    def _draw_record_stage(self, in_queue, out_queue):
+        while True:
+            item = self._get(in_queue)
+            if item is _END_OF_STREAM:
+                return
+            if isinstance(item, _StageFailure):
+                self._put(out_queue, item)
+                return
+            frame_index, frame, pose, interpolated = item
+            set_frame(frame_index)
+            if self.display:
+                with span("draw"):
+                    frame = draw_keypoints(frame, pose, pcutoff=self.pcutoff)
+            with span("record"):
+                self.recorder.add_frame(frame)
+                diameter = self.recorder.add_frame_pose(pose, frame_index, interpolated=interpolated)
+            if self.instrumentation is not None:
+                self.instrumentation.frame_done()
+            if not self._put(out_queue, (frame_index, frame, pose, diameter)):
+                return
+
+    def _start(self):
+        infer_queue = queue.Queue(maxsize=self.queue_size)
+        output_queue = queue.Queue(maxsize=self.queue_size)
+        self._queues = [infer_queue, output_queue]
+        self._threads = [
+            threading.Thread(
+                target=self._run_stage,
+                args=("inference", lambda: self._inference_stage(infer_queue), infer_queue),
+                name="pipeline-inference",
+                daemon=True,
+            ),
+            threading.Thread(
+                target=self._run_stage,
+                args=("draw_record", lambda: self._draw_record_stage(infer_queue, output_queue), output_queue),
+                name="pipeline-draw-record",
+                daemon=True,
+            ),
+        ]
+        for thread in self._threads:
+            thread.start()
+        return output_queue
+
+    def stop(self):
+        """停止所有阶段线程、清空队列并释放视频加载器。"""
+        self._stop_event.set()
+        for thread in self._threads:
+            thread.join()
+        self.video_loader.release()
+        for q in self._queues:
+            while True:
+                try:
+                    q.get_nowait()
+                except queue.Empty:
+                    break
+        self._threads = []
+        self._queues = []
+
+    def run(self):
+        """
+        启动流水线并按帧顺序产出结果。
+        返回:
+            生成器，每次产出 (frame_index, frame, pose, diameter)，frame_index 为帧在原视频中的索引。
+            任一阶段出错时，异常会在这里重新抛出。
+        """
+        self._stop_event.clear()
+        if hasattr(self.model, "reset_roi"):
+            self.model.reset_roi()
+        output_queue = self._start()
+        failed = False
+        try:
+            while True:
+                item = self._get(output_queue)
+                if item is _END_OF_STREAM:
+                    break
+                if isinstance(item, _StageFailure):
+                    raise RuntimeError(f"流水线阶段 '{item.stage_name}' 出错: {item.error}") from item.error
+                yield item
+        except GeneratorExit:
+            # 调用方提前结束迭代（例如停止后保存已处理的部分），记录器由调用方保存或放弃
+            raise
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            self.stop()
+            if failed and hasattr(self.recorder, "close"):
+                # 出错时停止记录器的编码线程并删除未保存的临时文件
+                self.recorder.close()
@@ -0,0 +1,56 @@
+import time
+
+import cv2
+
+from utils import RateLimiter
+
+
+class PreviewPolicy:
+    def __init__(self, target_fps=10.0, scale=1.0):
+        """
+        预览策略：推理在每一帧上进行，但只按 target_fps 把帧推送到界面，
+        使浏览器端的编码与传输不再处于推理的关键路径上。
+        参数:
+            target_fps (float): 预览帧率上限，<= 0 表示每帧都显示。
+            scale (float): 预览帧的缩放比例，1.0 表示不缩放。
+        """
+        self.target_fps = target_fps
+        self.scale = scale
+        self._limiter = RateLimiter(target_fps)
+        self.frames_inferred = 0
+        self.frames_displayed = 0
+        self._start_time = None
+
+    def offer(self, frame):
+        """
+        提交一帧已处理的帧。
+        返回:
+            需要显示时返回（可能已缩小的）预览帧，否则返回 None。
+        """
+        if self._start_time is None:
+            self._start_time = time.monotonic()
+        self.frames_inferred += 1
+        if not self._limiter.ready():
+            return None
+        self.frames_displayed += 1
+        return self.downscale(frame)
+
+    def final(self, frame):
+        """处理结束时总是显示最后一帧（不受预览帧率限制，但同样计入已显示帧数）。"""
+        self.frames_displayed += 1
+        return self.downscale(frame)
+
+    def downscale(self, frame):
+        """按 scale 缩小预览帧。"""
+        if self.scale >= 1.0 or frame is None:
+            return frame
+        height, width = frame.shape[:2]
+        size = (max(1, int(width * self.scale)), max(1, int(height * self.scale)))
+        return cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+
+    def stats_text(self):
+        """返回推理/显示帧数与吞吐量的文字说明。"""
+        elapsed = time.monotonic() - self._start_time if self._start_time is not None else 0.0
+        throughput = self.frames_inferred / elapsed if elapsed > 0 else 0.0
+        return (f"已推理 {self.frames_inferred} 帧，已显示 {self.frames_displayed} 帧，"
+                f"处理速度 {throughput:.1f} FPS")
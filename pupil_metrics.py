@@ -0,0 +1,172 @@
+from functools import lru_cache
+
+import numpy as np
+
+DEFAULT_POINT_NAMES = ('Lpupil', 'LDpupil', 'Dpupil', 'DRpupil',
+                       'Rpupil', 'RVupil', 'Vpupil', 'VLpupil')
+
+# 配对列表（对角/轴向），用于估算直径
+DIAMETER_PAIRS = (
+    ('Lpupil', 'Rpupil'),
+    ('LDpupil', 'RVupil'),
+    ('Dpupil', 'Vpupil'),
+    ('DRpupil', 'VLpupil'),
+)
+
+
+@lru_cache(maxsize=None)
+def pair_indices(point_names):
+    """把配对名称转换为两个索引数组，按 point_names 缓存。"""
+    name_to_index = {name: idx for idx, name in enumerate(point_names)}
+    first = np.array([name_to_index[p1] for p1, _ in DIAMETER_PAIRS])
+    second = np.array([name_to_index[p2] for _, p2 in DIAMETER_PAIRS])
+    return first, second
+
+
+def _as_pose_stack(poses):
+    """接受 (8, 3) 或 (N, 8, 3)，统一返回 (N, 8, 3) 的浮点数组。"""
+    poses = np.asarray(poses, dtype=np.float64)
+    if poses.ndim == 2:
+        poses = poses[np.newaxis]
+    if poses.ndim != 3 or poses.shape[2] != 3:
+        raise ValueError(f"Expected pose shape (N, P, 3), got {poses.shape}")
+    return poses
+
+
+def confidence_mask(poses, pcutoff=None):
+    """
+    返回 (N, P) 的布尔数组，表示每个关键点的置信度是否高于 pcutoff。
+    pcutoff 为 None 时所有点都视为有效。
+    """
+    poses = _as_pose_stack(poses)
+    if pcutoff is None:
+        return np.ones(poses.shape[:2], dtype=bool)
+    return poses[:, :, 2] > pcutoff
+
+
+def pupil_diameters(poses, point_names=None, pcutoff=None):
+    """
+    批量估算瞳孔直径：对每帧取多个对角点对的欧几里得距离平均。
+
+    参数：
+        poses: numpy array, shape (N, 8, 3) 或 (8, 3)，每行为[x, y, confidence]
+        point_names: 可选，对应8个点的名称，默认 DEFAULT_POINT_NAMES
+        pcutoff: 可选，只使用两个端点置信度都高于该值的点对；没有有效点对的帧为 NaN
+
+    返回：
+        numpy array, shape (N,)
+    """
+    poses = _as_pose_stack(poses)
+    first, second = pair_indices(tuple(point_names or DEFAULT_POINT_NAMES))
+
+    delta = poses[:, first, :2] - poses[:, second, :2]
+    distances = np.sqrt(delta[..., 0] ** 2 + delta[..., 1] ** 2)
+    if pcutoff is None:
+        return distances.mean(axis=1)
+
+    mask = confidence_mask(poses, pcutoff)
+    valid = mask[:, first] & mask[:, second]
+    counts = valid.sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(counts > 0, np.where(valid, distances, 0.0).sum(axis=1) / counts, np.nan)
+
+
+def pupil_centers(poses, pcutoff=None):
+    """
+    批量计算瞳孔中心（有效关键点坐标的均值）。
+    返回:
+        numpy array, shape (N, 2)；没有有效点的帧为 NaN。
+    """
+    poses = _as_pose_stack(poses)
+    mask = confidence_mask(poses, pcutoff)
+    counts = mask.sum(axis=1)
+    sums = np.einsum('np,npk->nk', mask.astype(np.float64), poses[:, :, :2])
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(counts[:, None] > 0, sums / counts[:, None], np.nan)
+
+
+def fit_ellipses(poses, pcutoff=None, min_points=5):
+    """
+    对每帧的有效关键点做最小二乘二次曲线拟合，得到椭圆参数。
+    先把每帧的点平移、缩放到单位尺度以保证数值稳定，再对 6x6 散布矩阵批量求最小特征向量。
+
+    参数:
+        poses: (N, 8, 3) 或 (8, 3)
+        pcutoff: 可选，低于该置信度的点不参与拟合
+        min_points: 拟合所需的最少有效点数（椭圆有 5 个自由度）
+    返回:
+        dict，每个值都是 shape (N,) 的数组：
+            center_x, center_y, major_axis, minor_axis（全长）, angle（长轴与 x 轴夹角，弧度）,
+            area, eccentricity。点数不足或拟合结果不是椭圆的帧为 NaN。
+    """
+    poses = _as_pose_stack(poses)
+    weights = confidence_mask(poses, pcutoff).astype(np.float64)
+    counts = weights.sum(axis=1)
+    safe_counts = np.maximum(counts, 1)
+
+    # 归一化：平移到有效点的质心，按均方根半径缩放
+    xy = poses[:, :, :2]
+    mean = np.einsum('np,npk->nk', weights, xy) / safe_counts[:, None]
+    centered = (xy - mean[:, None, :]) * weights[:, :, None]
+    scale = np.sqrt(np.einsum('npk,npk->n', centered, centered) / safe_counts)
+    scale = np.where(scale > 0, scale, 1.0)
+    x = centered[:, :, 0] / scale[:, None]
+    y = centered[:, :, 1] / scale[:, None]
+
+    # 设计矩阵 [x², xy, y², x, y, 1]，无效点对应的行为 0，不影响拟合
+    design = np.stack([x * x, x * y, y * y, x, y, weights], axis=2) * weights[:, :, None]
+    scatter = np.matmul(design.transpose(0, 2, 1), design)
+    _, eigenvectors = np.linalg.eigh(scatter)
+    conic = eigenvectors[:, :, 0]
+    # 统一符号，使 A + C > 0
+    conic = conic * np.where(conic[:, 0] + conic[:, 2] < 0, -1.0, 1.0)[:, None]
+    a, b, c, d, e, f = conic.T
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        den = b * b - 4 * a * c
+        cx = (2 * c * d - b * e) / den
+        cy = (2 * a * e - b * d) / den
+        num = 2 * (a * e * e + c * d * d - b * d * e + den * f)
+        root = np.sqrt((a - c) ** 2 + b * b)
+        axis_1 = -np.sqrt(num * (a + c + root)) / den
+        axis_2 = -np.sqrt(num * (a + c - root)) / den
+        semi_major = np.fmax(axis_1, axis_2) * scale
+        semi_minor = np.fmin(axis_1, axis_2) * scale
+        angle = 0.5 * np.arctan2(-b, c - a)
+        eccentricity = np.sqrt(1 - (semi_minor / semi_major) ** 2)
+
+    valid = (counts >= min_points) & (den < 0) & (semi_minor > 0)
+    nan = np.full(len(poses), np.nan)
+    return {
+        'center_x': np.where(valid, cx * scale + mean[:, 0], nan),
+        'center_y': np.where(valid, cy * scale + mean[:, 1], nan),
+        'major_axis': np.where(valid, 2 * semi_major, nan),
+        'minor_axis': np.where(valid, 2 * semi_minor, nan),
+        'angle': np.where(valid, angle, nan),
+        'area': np.where(valid, np.pi * semi_major * semi_minor, nan),
+        'eccentricity': np.where(valid, eccentricity, nan),
+    }
+
+
+def compute_pupil_metrics(poses, point_names=None, pcutoff=None):
+    """
+    一次性计算整段记录的瞳孔指标。
+    参数:
+        poses: (N, 8, 3) 姿态数组
+        point_names: 可选，关键点名称
+        pcutoff: 可选，置信度阈值，低于该值的关键点被屏蔽
+    返回:
+        dict，每个值都是 shape (N,) 的数组：diameter, center_x, center_y, valid_points，
+        以及 fit_ellipses 返回的椭圆参数（键名加 ellipse_ 前缀）。
+    """
+    poses = _as_pose_stack(poses)
+    centers = pupil_centers(poses, pcutoff)
+    metrics = {
+        'diameter': pupil_diameters(poses, point_names, pcutoff),
+        'center_x': centers[:, 0],
+        'center_y': centers[:, 1],
+        'valid_points': confidence_mask(poses, pcutoff).sum(axis=1),
+    }
+    for key, value in fit_ellipses(poses, pcutoff).items():
+        metrics[f'ellipse_{key}'] = value
+    return metrics
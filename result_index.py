@@ -0,0 +1,237 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+from utils import directory_sha256, file_sha256, get_absolute_path, write_json_atomic
+
+# 索引格式版本，改变键的组成或存储方式时递增以使旧条目失效
+RESULT_INDEX_VERSION = 1
+
+
+class ResultIndex:
+    def __init__(self, index_dir=None):
+        """
+        按内容寻址的处理结果索引。
+        键由视频内容哈希、模型目录内容哈希、resize、pcutoff 与其它影响结果的处理设置组成；
+        相同的视频与模型再次处理时直接返回已有的 CSV/MP4，并可读取保存的直径序列用于绘图。
+        每个条目保存为 <key>.json（元数据，修改时间作为最近使用时间）与 <key>.npz（帧索引与直径）。
+        参数:
+            index_dir (str): 索引目录，默认 cache/results。
+        """
+        self.index_dir = index_dir or get_absolute_path(os.path.join("cache", "results"))
+        os.makedirs(self.index_dir, exist_ok=True)
+
+    def _meta_path(self, key):
+        return os.path.join(self.index_dir, f"{key}.json")
+
+    def _series_path(self, key):
+        return os.path.join(self.index_dir, f"{key}.npz")
+
+    def make_key(self, video_path, model_path, resize, pcutoff, **settings):
+        """
+        计算结果键。
+        参数:
+            video_path (str): 输入视频。
+            model_path (str): 模型目录。
+            resize, pcutoff: 模型参数。
+            settings: 其它会影响结果的设置（model_type、处理范围、stride、关键帧间隔等），值需可 JSON 序列化。
+        """
+        payload = json.dumps(
+            {
+                "version": RESULT_INDEX_VERSION,
+                "video": file_sha256(video_path),
+                "model": directory_sha256(model_path),
+                "resize": float(resize),
+                "pcutoff": float(pcutoff),
+                **settings,
+            },
+            sort_keys=True,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+    def key_for_run(self, video_path, model_path, resize, pcutoff, model_type="base", roi_mode=False, display=True,
+                    start_time=0, end_time=0, stride=1, keyframe_interval=1, motion_threshold=0,
+                    start_frame=None, end_frame=None):
+        """
+        按一次处理的参数计算键；界面与批处理都通过这里计算，保证两边的结果可以互相复用。
+        start_frame / end_frame 只在指定时计入键，不改变只按时间指定范围的已有条目的键。
+        """
+        keyframe_interval = max(1, int(keyframe_interval or 1))
+        frame_range = {}
+        if start_frame or end_frame is not None:
+            frame_range = {"start_frame": int(start_frame or 0), "end_frame": None if end_frame is None else int(end_frame)}
+        return self.make_key(
+            video_path, model_path, resize, pcutoff,
+            model_type=model_type, roi_mode=bool(roi_mode), display=bool(display),
+            start_time=float(start_time or 0), end_time=float(end_time or 0), stride=max(1, int(stride or 1)),
+            keyframe_interval=keyframe_interval,
+            motion_threshold=float(motion_threshold or 0) if keyframe_interval > 1 else 0.0,
+            **frame_range,
+        )
+
+    def lookup(self, key):
+        """
+        查找结果。
+        返回:
+            条目元数据 dict（含 csv_path、video_path 等）；未命中或输出文件已被删除、修改时返回 None。
+        """
+        meta_path = self._meta_path(key)
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if meta.get("version") != RESULT_INDEX_VERSION:
+            return None
+        for path_key, size_key in (("csv_path", "csv_size"), ("video_path", "video_size")):
+            path = meta.get(path_key)
+            if path is None:
+                continue
+            try:
+                if os.path.getsize(path) != meta.get(size_key):
+                    raise OSError
+            except OSError:
+                print(f"结果文件 {path} 已不存在或被修改，丢弃索引条目 {key}")
+                self.remove(key)
+                return None
+        # 更新修改时间，作为淘汰的依据
+        try:
+            os.utime(meta_path)
+        except OSError:
+            pass
+        return meta
+
+    def add(self, key, csv_path, video_path, frame_indices, diameters, **info):
+        """
+        登记一次处理的结果。
+        参数:
+            key (str): make_key 计算的键。
+            csv_path, video_path (str): 已保存的结果文件（video_path 可为 None）。
+            frame_indices, diameters: 直径序列，命中时用于直接绘图。
+            info: 额外保存的描述信息（视频名、模型名等）。
+        """
+        np.savez(self._series_path(key) + ".tmp.npz",
+                 frame_indices=np.asarray(frame_indices, dtype=np.int64),
+                 diameters=np.asarray(diameters, dtype=np.float32))
+        os.replace(self._series_path(key) + ".tmp.npz", self._series_path(key))
+        meta = {
+            "version": RESULT_INDEX_VERSION,
+            "key": key,
+            "csv_path": os.path.abspath(csv_path),
+            "csv_size": os.path.getsize(csv_path),
+            "video_path": None if video_path is None or not os.path.exists(video_path) else os.path.abspath(video_path),
+            "created": time.time(),
+            "frames": len(diameters),
+            **info,
+        }
+        meta["video_size"] = None if meta["video_path"] is None else os.path.getsize(meta["video_path"])
+        # 元数据最后写入，作为条目完整可用的标记
+        write_json_atomic(self._meta_path(key), meta)
+
+    def load_series(self, key):
+        """读取保存的直径序列，返回 (frame_indices, diameters)；不存在时返回 None。"""
+        try:
+            with np.load(self._series_path(key)) as data:
+                return data["frame_indices"], data["diameters"]
+        except (OSError, KeyError, ValueError):
+            return None
+
+    def entries(self):
+        """列出所有条目，返回 [(key, meta, last_used)]，按最近使用时间从旧到新排序。"""
+        result = []
+        for name in os.listdir(self.index_dir):
+            if not name.endswith(".json"):
+                continue
+            key = name[:-len(".json")]
+            try:
+                with open(self._meta_path(key), "r", encoding="utf-8") as f:
+                    meta = json.load(f)
+                last_used = os.path.getmtime(self._meta_path(key))
+            except (OSError, ValueError):
+                continue
+            result.append((key, meta, last_used))
+        result.sort(key=lambda entry: entry[2])
+        return result
+
+    def remove(self, key, delete_outputs=False):
+        """
+        删除一个条目。
+        参数:
+            delete_outputs (bool): 是否同时删除 output 中的 CSV/MP4（以及只剩它们的结果目录）。
+        """
+        meta = None
+        if delete_outputs:
+            try:
+                with open(self._meta_path(key), "r", encoding="utf-8") as f:
+                    meta = json.load(f)
+            except (OSError, ValueError):
+                pass
+        for path in (self._meta_path(key), self._series_path(key)):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        if meta is not None:
+            result_dirs = set()
+            for path in (meta.get("csv_path"), meta.get("video_path")):
+                if path and os.path.exists(path):
+                    os.remove(path)
+                    result_dirs.add(os.path.dirname(path))
+            for result_dir in result_dirs:
+                if os.path.isdir(result_dir) and not os.listdir(result_dir):
+                    shutil.rmtree(result_dir, ignore_errors=True)
+
+    def evict(self, max_entries=None, max_age_seconds=None, delete_outputs=False):
+        """
+        淘汰条目：先删除超过 max_age_seconds 未使用的条目，再按最近使用时间删除多余的条目，
+        使剩余条目数不超过 max_entries。
+        返回:
+            被删除的键列表。
+        """
+        removed = []
+        now = time.time()
+        entries = self.entries()
+        for key, _, last_used in entries:
+            if max_age_seconds is not None and now - last_used > max_age_seconds:
+                self.remove(key, delete_outputs)
+                removed.append(key)
+        remaining = [key for key, _, _ in entries if key not in removed]
+        if max_entries is not None:
+            for key in remaining[:max(0, len(remaining) - max_entries)]:
+                self.remove(key, delete_outputs)
+                removed.append(key)
+        return removed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="查看或清理处理结果索引")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("list", help="列出所有结果")
+    evict_parser = subparsers.add_parser("evict", help="淘汰旧结果")
+    evict_parser.add_argument("--max-entries", type=int, default=None, help="最多保留的条目数")
+    evict_parser.add_argument("--older-than-days", type=float, default=None, help="删除超过该天数未使用的条目")
+    evict_parser.add_argument("--delete-outputs", action="store_true", help="同时删除 output 中的结果文件")
+    remove_parser = subparsers.add_parser("remove", help="删除指定条目")
+    remove_parser.add_argument("keys", nargs="+")
+    remove_parser.add_argument("--delete-outputs", action="store_true", help="同时删除 output 中的结果文件")
+    args = parser.parse_args()
+
+    index = ResultIndex()
+    if args.command == "list":
+        for key, meta, last_used in index.entries():
+            print(f"{key}  {time.strftime('%Y-%m-%d %H:%M', time.localtime(last_used))}  "
+                  f"{meta.get('video_name', '-')}  {meta.get('model_name', '-')}  {meta.get('frames', 0)} 帧  "
+                  f"{meta.get('csv_path')}")
+    elif args.command == "evict":
+        max_age = None if args.older_than_days is None else args.older_than_days * 86400
+        removed = index.evict(args.max_entries, max_age, args.delete_outputs)
+        print(f"已删除 {len(removed)} 个条目")
+    elif args.command == "remove":
+        for key in args.keys:
+            index.remove(key, args.delete_outputs)
+        print(f"已删除 {len(args.keys)} 个条目")
@@ -0,0 +1,223 @@
+import argparse
+import multiprocessing
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+from tqdm import tqdm
+
+from frame_cache import FrameCache
+from pupil_metrics import DEFAULT_POINT_NAMES
+from tracking_data_recorder import TrackingDataRecorder
+from utils import draw_keypoints, file_sha256_entry, get_absolute_path, seed_file_sha256
+from video_index import VideoIndex
+from video_loader import LocalVideoLoader
+
+
+def split_frame_range(total_frames, num_shards, start=0, end=None, stride=1):
+    """
+    把 [start, end) 内按 stride 取到的帧均匀切分为 num_shards 段，分段边界对齐到 stride。
+    返回:
+        list[(start, end)]，最后一段的 end 等于传入的 end；end 为 None 时表示一直读到视频末尾
+        （防止元数据帧数不准）。
+    """
+    stop = total_frames if end is None else min(end, total_frames)
+    num_samples = max(0, (stop - start + stride - 1) // stride)
+    num_shards = max(1, min(int(num_shards), max(1, num_samples)))
+    bounds = start + np.linspace(0, num_samples, num_shards + 1).astype(int) * stride
+    shards = [(int(bounds[i]), int(bounds[i + 1])) for i in range(num_shards)]
+    shards[-1] = (shards[-1][0], end)
+    return shards
+
+
+def _build_tf_config(num_threads):
+    """限制每个工作进程的 TensorFlow 线程数，避免多个进程相互抢占 CPU。"""
+    import tensorflow as tf
+    return tf.compat.v1.ConfigProto(
+        intra_op_parallelism_threads=num_threads,
+        inter_op_parallelism_threads=1,
+    )
+
+
+def _infer_shard(video_path, start_frame, end_frame, model_path, model_kwargs, threads_per_worker, out_path,
+                 use_frame_cache=False, stride=1, video_hash=None):
+    """
+    工作进程入口：用独立的 ModelLoader 推理一个帧区间，并把帧号与姿态保存为 .npz（frame_indices、poses）。
+    video_hash 为主进程算好的视频哈希缓存条目，帧缓存生成缓存键时直接使用，各分片不再各自读取整个视频计算哈希。
+    返回:
+        (out_path, 推理的帧数)
+    """
+    from model_loader import ModelLoader
+
+    model_kwargs = dict(model_kwargs)
+    if threads_per_worker:
+        model_kwargs.setdefault("tf_config", _build_tf_config(threads_per_worker))
+    model = ModelLoader(model_path, **model_kwargs)
+    if video_hash is not None:
+        seed_file_sha256(video_hash)
+    frame_cache = FrameCache() if use_frame_cache else None
+    loader = LocalVideoLoader(video_path, start_frame=start_frame, end_frame=end_frame, frame_cache=frame_cache,
+                              stride=stride)
+
+    frame_indices = []
+    poses = []
+    while (frame := loader.get_frame()) is not None:
+        frame_indices.append(loader.last_frame_index)
+        poses.append(model.infer_pose(frame))
+    loader.release()
+
+    # 空分片也保存为 (0, P, 3)，合并时可以与其它分片直接拼接
+    poses = np.asarray(poses, dtype=np.float32) if poses else np.empty((0, len(DEFAULT_POINT_NAMES), 3), np.float32)
+    np.savez(out_path, frame_indices=np.asarray(frame_indices, dtype=np.int64), poses=poses)
+    return out_path, len(poses)
+
+
+def process_video_sharded(video_path, model_path, num_workers=None, num_shards=None,
+                          model_kwargs=None, output_name=None, display=True, pcutoff=0.5,
+                          use_frame_cache=False, start_frame=0, end_frame=None, stride=1,
+                          start_time=None, end_time=None):
+    """
+    把一个视频按帧区间切分，在多个进程中并行推理，再合并为一份有序的 CSV 与标注视频。
+    每个分片的帧与串行读取完全一致，因此逐帧结果与串行运行相同（DLCLive 预热帧除外）。
+    参数:
+        video_path (str): 视频文件路径。
+        model_path (str): 模型目录。
+        num_workers (int): 工作进程数，默认使用全部 CPU 核心。
+        num_shards (int): 分片数，默认等于 num_workers。
+        model_kwargs (dict): 传给 ModelLoader 的其它参数（resize 等）。
+        output_name (str): 输出文件名前缀，默认使用视频文件名。
+        display (bool): 是否在输出视频中绘制关键点。
+        pcutoff (float): 绘制关键点的置信度阈值。
+        use_frame_cache (bool): 是否让各分片使用解码帧缓存（按分片范围分别缓存）。
+        start_frame, end_frame, stride: 只处理 [start_frame, end_frame) 内每隔 stride 的帧。
+        start_time, end_time: 按时间（秒）指定处理范围，优先于 start_frame / end_frame。
+    返回:
+        TrackingDataRecorder: 合并后的记录器（已保存）。
+    """
+    num_workers = num_workers or os.cpu_count() or 1
+    num_shards = num_shards or num_workers
+    model_kwargs = dict(model_kwargs or {})
+    threads_per_worker = max(1, (os.cpu_count() or 1) // num_workers)
+
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        cap.release()
+        raise IOError(f"无法打开视频文件: {video_path}")
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    cap.release()
+
+    stride = max(1, int(stride))
+    if start_time is not None or end_time is not None:
+        index = VideoIndex.load_or_build(video_path)
+        if start_time is not None:
+            start_frame = index.frame_at_time(start_time)
+        if end_time is not None:
+            end_frame = index.frame_at_time(end_time)
+    shards = split_frame_range(total_frames, num_shards, start_frame, end_frame, stride)
+    print(f"视频 '{video_path}' 共 {total_frames} 帧，切分为 {len(shards)} 个分片，使用 {num_workers} 个进程。")
+
+    output_root = get_absolute_path("output")
+    os.makedirs(output_root, exist_ok=True)
+    # 帧缓存的键包含视频内容哈希，在主进程中只计算一次
+    video_hash = file_sha256_entry(video_path) if use_frame_cache else None
+    shard_dir = tempfile.mkdtemp(prefix=".shards_", dir=output_root)
+    try:
+        # TensorFlow 不支持 fork 后继续使用，统一使用 spawn 启动工作进程
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=num_workers, mp_context=context) as executor:
+            futures = [
+                executor.submit(
+                    _infer_shard, video_path, start, end, model_path, model_kwargs, threads_per_worker,
+                    os.path.join(shard_dir, f"shard_{i:05d}.npz"), use_frame_cache, stride, video_hash,
+                )
+                for i, (start, end) in enumerate(shards)
+            ]
+            shard_files = []
+            for future in tqdm(futures, desc="分片推理"):
+                shard_files.append(future.result()[0])
+
+        frame_indices, poses = [], []
+        for path in shard_files:
+            with np.load(path) as shard:
+                frame_indices.append(shard["frame_indices"])
+                poses.append(shard["poses"])
+        frame_indices = np.concatenate(frame_indices)
+        poses = np.concatenate(poses, axis=0)
+    finally:
+        shutil.rmtree(shard_dir, ignore_errors=True)
+
+    order = np.argsort(frame_indices, kind="stable")
+    frame_indices, poses = frame_indices[order], poses[order]
+    if np.any(np.diff(frame_indices) == 0):
+        raise RuntimeError("分片推理结果中有重复的帧")
+
+    # 合并：按原始顺序重新解码一遍视频，按帧号取出对应的姿态，绘制关键点并写入记录器。
+    # 任一帧在分片结果中缺失（分片少读了帧）或分片多出重新解码时没有的帧时报错，而不是错位地写出结果
+    partial = start_frame > 0 or end_frame is not None or stride > 1
+    recorder = TrackingDataRecorder(fps=fps / stride, include_frame_index=partial)
+    loader = LocalVideoLoader(video_path, start_frame=start_frame, end_frame=end_frame, stride=stride)
+    merged = 0
+    try:
+        with tqdm(total=len(frame_indices), desc="合并分片") as progress:
+            while (frame := loader.get_frame()) is not None:
+                frame_index = loader.last_frame_index
+                row = np.searchsorted(frame_indices, frame_index)
+                if row >= len(frame_indices) or frame_indices[row] != frame_index:
+                    raise RuntimeError(f"分片推理结果中缺少第 {frame_index} 帧")
+                pose = poses[row]
+                if display:
+                    frame = draw_keypoints(frame, pose, pcutoff=pcutoff)
+                recorder.add_frame(frame)
+                recorder.add_frame_pose(pose, frame_index)
+                merged += 1
+                progress.update(1)
+        if merged != len(frame_indices):
+            raise RuntimeError(f"重新解码得到 {merged} 帧，与分片推理的 {len(frame_indices)} 帧不一致")
+    except BaseException:
+        recorder.discard_video()
+        raise
+    finally:
+        loader.release()
+
+    if output_name is None:
+        output_name = os.path.splitext(os.path.basename(video_path))[0]
+    recorder.save(output_name)
+    return recorder
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="多进程分片处理单个长视频")
+    parser.add_argument("video", help="视频文件路径")
+    parser.add_argument("--model", required=True, help="模型目录")
+    parser.add_argument("--workers", type=int, default=None, help="工作进程数，默认等于 CPU 核心数")
+    parser.add_argument("--shards", type=int, default=None, help="分片数，默认等于工作进程数")
+    parser.add_argument("--resize", type=float, default=1.0)
+    parser.add_argument("--pcutoff", type=float, default=0.5)
+    parser.add_argument("--no-display", action="store_true", help="输出视频中不绘制关键点")
+    parser.add_argument("--frame-cache", action="store_true", help="使用解码帧缓存")
+    parser.add_argument("--start-frame", type=int, default=0, help="起始帧（含）")
+    parser.add_argument("--end-frame", type=int, default=None, help="结束帧（不含）")
+    parser.add_argument("--start-time", type=float, default=None, help="起始时间（秒），优先于 --start-frame")
+    parser.add_argument("--end-time", type=float, default=None, help="结束时间（秒），优先于 --end-frame")
+    parser.add_argument("--stride", type=int, default=1, help="每隔 stride 帧处理一帧")
+    args = parser.parse_args()
+
+    process_video_sharded(
+        args.video,
+        args.model,
+        num_workers=args.workers,
+        num_shards=args.shards,
+        model_kwargs={"resize": args.resize, "pcutoff": args.pcutoff},
+        display=not args.no_display,
+        pcutoff=args.pcutoff,
+        use_frame_cache=args.frame_cache,
+        start_frame=args.start_frame,
+        end_frame=args.end_frame,
+        stride=args.stride,
+        start_time=args.start_time,
+        end_time=args.end_time,
+    )
@@ -0,0 +1,293 @@
+import argparse
+import multiprocessing
+import os
+import queue
+import time
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+from tqdm import tqdm
+
+from tracking_data_recorder import TrackingDataRecorder
+from utils import draw_keypoints
+
+# 控制通道上的消息类型
+_POSE = "pose"
+_DONE = "done"
+_ERROR = "error"
+
+
+class SharedFrameRing:
+    def __init__(self, num_slots, frame_shape, dtype=np.uint8, name=None):
+        """
+        共享内存中的定长帧环形缓冲区：num_slots 个预先分配、形状与 dtype 固定的帧槽。
+        进程之间只通过控制队列传递槽号，帧数据本身不经过 pickle；读取方直接得到指向共享内存的 ndarray 视图。
+        槽的归属由调用方的协议保证：空闲槽号放在 free 队列中，写入方取出、写入后把槽号交给读取方，
+        读取方用完后再放回 free 队列。
+        参数:
+            num_slots (int): 槽数。
+            frame_shape (tuple): 每帧的形状，例如 (480, 640, 3)。
+            dtype: 帧的数据类型。
+            name (str): 为 None 时创建新的共享内存；否则按名称连接到已有的共享内存（子进程中使用）。
+        """
+        self.num_slots = int(num_slots)
+        self.frame_shape = tuple(int(n) for n in frame_shape)
+        self.dtype = np.dtype(dtype)
+        nbytes = self.num_slots * int(np.prod(self.frame_shape)) * self.dtype.itemsize
+        self._owner = name is None
+        self._shm = shared_memory.SharedMemory(name=name, create=self._owner, size=nbytes if self._owner else 0)
+        self.frames = np.ndarray((self.num_slots,) + self.frame_shape, dtype=self.dtype, buffer=self._shm.buf)
+
+    @classmethod
+    def attach(cls, spec):
+        """按 spec() 的描述连接到已有的缓冲区。"""
+        return cls(spec["num_slots"], spec["frame_shape"], spec["dtype"], name=spec["name"])
+
+    def spec(self):
+        """传给子进程的描述（可 pickle，只包含名称与形状）。"""
+        return {"name": self._shm.name, "num_slots": self.num_slots, "frame_shape": self.frame_shape,
+                "dtype": self.dtype.str}
+
+    def __getitem__(self, slot):
+        return self.frames[slot]
+
+    def write(self, slot, frame):
+        """把一帧写入槽（一次内存复制）；形状或 dtype 不符时抛出 ValueError。"""
+        if frame.shape != self.frame_shape or frame.dtype != self.dtype:
+            raise ValueError(f"帧 {frame.shape}/{frame.dtype} 与缓冲区 {self.frame_shape}/{self.dtype} 不一致")
+        np.copyto(self.frames[slot], frame)
+
+    def close(self):
+        # 先释放视图，否则 SharedMemory.close 会因仍有导出的缓冲区而失败
+        self.frames = None
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+
+
+def probe_source(source):
+    """
+    读取视频文件或摄像头的帧形状与帧率，用于分配缓冲区。
+    返回:
+        (frame_shape, fps)
+    """
+    cap = cv2.VideoCapture(int(source) if str(source).isdigit() else source)
+    try:
+        if not cap.isOpened():
+            raise IOError(f"无法打开视频源: {source}")
+        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+        if not width or not height:
+            # 部分摄像头不报告分辨率，读一帧确定
+            ret, frame = cap.read()
+            if not ret:
+                raise IOError(f"无法从视频源读取帧: {source}")
+            height, width = frame.shape[:2]
+        return (height, width, 3), fps
+    finally:
+        cap.release()
+
+
+def _producer_main(ring_spec, source, loader_kwargs, free_queue, ready_queue, result_queue, num_consumers):
+    """
+    解码进程：从 LocalVideoLoader / CameraVideoLoader 读取帧，写入空闲槽，把 (序号, 帧号, 槽号) 交给推理进程。
+    结束时为每个推理进程放入一个 None。
+    """
+    from video_loader import CameraVideoLoader, LocalVideoLoader
+
+    ring = SharedFrameRing.attach(ring_spec)
+    loader = None
+    try:
+        if str(source).isdigit():
+            loader = CameraVideoLoader(int(source), **loader_kwargs)
+        else:
+            loader = LocalVideoLoader(source, **loader_kwargs)
+        seq = 0
+        while (frame := loader.get_frame()) is not None:
+            slot = free_queue.get()
+            ring.write(slot, frame)
+            ready_queue.put((seq, loader.last_frame_index, slot))
+            seq += 1
+    except Exception as e:
+        result_queue.put((_ERROR, "decode", f"{type(e).__name__}: {e}"))
+    finally:
+        if loader is not None:
+            loader.release()
+        for _ in range(num_consumers):
+            ready_queue.put(None)
+        ring.close()
+
+
+def _consumer_main(ring_spec, model_path, model_kwargs, threads, batch_size, ready_queue, result_queue):
+    """
+    推理进程：加载一次 ModelLoader，直接在共享内存的帧视图上推理，只把姿态和槽号发回主进程。
+    batch_size > 1 时一次取出最多 batch_size 个就绪的槽批量推理；槽号连续时使用切片视图，不复制帧。
+    """
+    ring = SharedFrameRing.attach(ring_spec)
+    try:
+        from model_loader import ModelLoader
+        from sharded_processing import _build_tf_config
+
+        model_kwargs = dict(model_kwargs)
+        if threads:
+            model_kwargs.setdefault("tf_config", _build_tf_config(threads))
+        model = ModelLoader(model_path, **model_kwargs)
+
+        finished = False
+        while not finished:
+            items = [ready_queue.get()]
+            while items[-1] is not None and len(items) < batch_size:
+                try:
+                    items.append(ready_queue.get_nowait())
+                except queue.Empty:
+                    break
+            if items[-1] is None:
+                items.pop()
+                finished = True
+            if not items:
+                continue
+            slots = [slot for _, _, slot in items]
+            if len(items) == 1:
+                poses = [model.infer_pose(ring[slots[0]])]
+            elif slots == list(range(slots[0], slots[0] + len(slots))):
+                poses = model.infer_pose_batch(ring.frames[slots[0]:slots[-1] + 1])
+            else:
+                poses = model.infer_pose_batch([ring[slot] for slot in slots])
+            for (seq, frame_index, slot), pose in zip(items, poses):
+                result_queue.put((_POSE, seq, frame_index, slot, np.asarray(pose)))
+    except Exception as e:
+        result_queue.put((_ERROR, "inference", f"{type(e).__name__}: {e}"))
+    finally:
+        result_queue.put((_DONE,))
+        ring.close()
+
+
+def process_video_shm(source, model_path, num_consumers=2, num_slots=None, batch_size=1, model_kwargs=None,
+                      display=True, pcutoff=0.5, output_name=None, loader_kwargs=None):
+    """
+    解码与推理分别在独立进程中运行的处理流程，帧通过共享内存环形缓冲区传递。
+    解码进程把帧写入空闲槽；num_consumers 个推理进程各自加载模型，直接读取槽中的帧推理；
+    主进程按序号重排结果，从槽中复制帧用于绘制与录制后立即释放该槽。
+    队列上只传递槽号、帧号与姿态，不传递帧数据。
+    参数:
+        source: 视频文件路径或摄像头编号。
+        model_path (str): 模型目录。
+        num_consumers (int): 推理进程数。
+        num_slots (int): 槽数，默认 num_consumers * batch_size 的 4 倍（至少 8）。
+        batch_size (int): 每个推理进程一次最多推理的帧数。
+        model_kwargs (dict): 传给 ModelLoader 的其它参数。
+        display (bool): 是否在输出视频中绘制关键点。
+        pcutoff (float): 绘制关键点的置信度阈值。
+        output_name (str): 输出文件名前缀，默认使用视频文件名。
+        loader_kwargs (dict): 传给视频加载器的其它参数（start_frame、stride 等）。
+    返回:
+        TrackingDataRecorder: 记录器（已保存）。
+    """
+    num_consumers = max(1, int(num_consumers))
+    batch_size = max(1, int(batch_size))
+    # 槽数需多于所有推理进程同时持有的帧数，否则解码进程会因拿不到空闲槽而停顿
+    num_slots = max(num_slots or 0, num_consumers * batch_size * 4, 8)
+    loader_kwargs = dict(loader_kwargs or {})
+    frame_shape, fps = probe_source(source)
+    stride = max(1, int(loader_kwargs.get("stride", 1)))
+    threads = max(1, (os.cpu_count() or 1) // (num_consumers + 1))
+
+    ring = SharedFrameRing(num_slots, frame_shape)
+    # TensorFlow 不支持 fork 后继续使用，统一使用 spawn 启动子进程
+    context = multiprocessing.get_context("spawn")
+    free_queue, ready_queue, result_queue = context.Queue(), context.Queue(), context.Queue()
+    for slot in range(num_slots):
+        free_queue.put(slot)
+
+    processes = [context.Process(target=_producer_main, name="shm-decode",
+                                 args=(ring.spec(), source, loader_kwargs, free_queue, ready_queue, result_queue,
+                                       num_consumers))]
+    processes += [context.Process(target=_consumer_main, name=f"shm-infer-{i}",
+                                  args=(ring.spec(), model_path, model_kwargs or {}, threads, batch_size,
+                                        ready_queue, result_queue))
+                  for i in range(num_consumers)]
+    for process in processes:
+        process.start()
+
+    # 只处理部分范围时，在 CSV 中写出每行对应的原视频帧索引
+    partial = stride > 1 or any(loader_kwargs.get(key) for key in ("start_frame", "end_frame", "start_time", "end_time"))
+    recorder = TrackingDataRecorder(fps=fps / stride, include_frame_index=partial)
+    pending = {}  # 序号 -> (帧号, 帧, 姿态)，等待按顺序写入
+    next_seq = 0
+    consumers_done = 0
+    progress = tqdm(desc="共享内存流水线")
+    try:
+        while consumers_done < num_consumers:
+            try:
+                message = result_queue.get(timeout=1.0)
+            except queue.Empty:
+                # 子进程异常退出（例如被系统杀掉）时不会发送消息，避免无限等待
+                dead = [p.name for p in processes if p.exitcode not in (None, 0)]
+                if dead:
+                    raise RuntimeError(f"子进程异常退出: {', '.join(dead)}")
+                continue
+            if message[0] == _DONE:
+                consumers_done += 1
+                continue
+            if message[0] == _ERROR:
+                raise RuntimeError(f"{'解码' if message[1] == 'decode' else '推理'}进程出错: {message[2]}")
+            _, seq, frame_index, slot, pose = message
+            # 录制是异步编码的，需要复制出槽中的帧，复制后立即释放槽
+            frame = ring[slot].copy()
+            free_queue.put(slot)
+            pending[seq] = (frame_index, frame, pose)
+            while next_seq in pending:
+                frame_index, frame, pose = pending.pop(next_seq)
+                if display:
+                    frame = draw_keypoints(frame, pose, pcutoff=pcutoff)
+                recorder.add_frame(frame)
+                recorder.add_frame_pose(pose, frame_index)
+                next_seq += 1
+                progress.update(1)
+    except BaseException:
+        recorder.discard_video()
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        raise
+    finally:
+        progress.close()
+        for process in processes:
+            process.join()
+        ring.close()
+
+    if output_name is None:
+        output_name = f"camera{source}" if str(source).isdigit() else os.path.splitext(os.path.basename(source))[0]
+    recorder.save(output_name)
+    return recorder
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="解码与推理分进程运行，帧通过共享内存传递")
+    parser.add_argument("source", help="视频文件路径或摄像头编号")
+    parser.add_argument("--model", required=True, help="模型目录")
+    parser.add_argument("--consumers", type=int, default=2, help="推理进程数")
+    parser.add_argument("--slots", type=int, default=None, help="共享内存帧槽数")
+    parser.add_argument("--batch-size", type=int, default=1, help="每个推理进程一次最多推理的帧数")
+    parser.add_argument("--resize", type=float, default=1.0)
+    parser.add_argument("--pcutoff", type=float, default=0.5)
+    parser.add_argument("--no-display", action="store_true", help="输出视频中不绘制关键点")
+    parser.add_argument("--stride", type=int, default=1, help="每隔 stride 帧处理一帧")
+    args = parser.parse_args()
+
+    begin = time.perf_counter()
+    result = process_video_shm(
+        args.source,
+        args.model,
+        num_consumers=args.consumers,
+        num_slots=args.slots,
+        batch_size=args.batch_size,
+        model_kwargs={"resize": args.resize, "pcutoff": args.pcutoff},
+        display=not args.no_display,
+        pcutoff=args.pcutoff,
+        loader_kwargs={"stride": args.stride} if args.stride > 1 else None,
+    )
+    elapsed = time.perf_counter() - begin
+    print(f"共 {result.num_frames} 帧，用时 {elapsed:.1f} 秒 ({result.num_frames / elapsed:.1f} 帧/秒)")
@@ -0,0 +1,75 @@
+import importlib
+import threading
+import time
+from contextlib import contextmanager
+
+# 启动较慢的第三方模块，界面启动后在后台预加载，首次使用时无需再等待
+HEAVY_MODULES = ("tensorflow", "dlclive", "pandas", "plotly.graph_objects")
+
+
+class StartupTimer:
+    def __init__(self):
+        """
+        记录启动过程中各阶段（导入、构建界面、启动服务、后台预加载）的耗时，并输出启动报告。
+        可在多个线程中同时记录。
+        """
+        self.start_time = time.perf_counter()
+        self.phases = []  # [(阶段名, 线程名, 开始时刻, 耗时)]
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        """计时一个阶段：with timer.phase("import gradio"): ..."""
+        begin = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - begin
+            with self._lock:
+                self.phases.append((name, threading.current_thread().name, begin - self.start_time, elapsed))
+
+    def elapsed(self):
+        """从进程开始计时到现在的秒数。"""
+        return time.perf_counter() - self.start_time
+
+    def report(self, title="启动耗时报告"):
+        """返回按开始时间排序的各阶段耗时文本。"""
+        with self._lock:
+            phases = sorted(self.phases, key=lambda phase: phase[2])
+        lines = [f"{'-' * 8}{title}{'-' * 8}"]
+        for name, thread_name, offset, elapsed in phases:
+            lines.append(f"  [{thread_name:>12}] +{offset:6.2f}s  {name:<32} {elapsed:6.2f}s")
+        lines.append(f"  总计 {self.elapsed():.2f}s")
+        return "\n".join(lines)
+
+
+# 进程级的计时器，由 mainwindow 最先导入，从而覆盖所有导入阶段
+timer = StartupTimer()
+
+
+def preload_modules(module_names=HEAVY_MODULES, startup_timer=None, on_done=None):
+    """
+    在后台线程中依次导入较慢的模块，使界面先启动，首次推理/绘图时不再等待导入。
+    导入失败（例如未安装 TensorRT 相关依赖）只打印警告，实际使用时会再次报错。
+    参数:
+        module_names: 要预加载的模块名。
+        startup_timer: 记录耗时的 StartupTimer，默认使用进程级计时器。
+        on_done: 全部导入完成后调用的回调。
+    返回:
+        已启动的线程。
+    """
+    startup_timer = startup_timer or timer
+
+    def _preload():
+        for name in module_names:
+            try:
+                with startup_timer.phase(f"preload {name}"):
+                    importlib.import_module(name)
+            except Exception as e:
+                print(f"警告: 预加载模块 {name} 失败: {e}")
+        if on_done is not None:
+            on_done()
+
+    thread = threading.Thread(target=_preload, name="preload", daemon=True)
+    thread.start()
+    return thread
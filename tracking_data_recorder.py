@@ -1,21 +1,121 @@
+import queue
+import shutil
+import tempfile
+import threading
 from datetime import datetime
 
 import numpy as np
-import pandas as pd
-from numpy.core.records import record
-from tensorflow import timestamp
 import cv2
+from instrumentation import span
+from tracking_store import TrackingStoreWriter
 from utils import *
 
 
+def _umask():
+    # os.umask 只能通过设置来读取，在导入时读取一次，避免与其它线程创建文件相互干扰
+    mask = os.umask(0)
+    os.umask(mask)
+    return mask
+
+
+_UMASK = _umask()
+
+
+class _StreamingVideoWriter:
+    """
+    在独立的编码线程上边接收边编码的视频写入器。
+    第一帧到达时打开 cv2.VideoWriter，写入临时文件；finish() 后再把文件移动到最终位置。
+    """
+
+    _END = object()
+
+    def __init__(self, path, fps, frame_shape, queue_size=64):
+        height, width = frame_shape[:2]
+        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+        self.path = path
+        self.frames_written = 0
+        self.error = None
+        self._writer = cv2.VideoWriter(path, fourcc, fps, (width, height))
+        if not self._writer.isOpened():
+            raise IOError(f"无法创建视频文件: {path}")
+        # 队列满时 write() 阻塞，编码跟不上时对上游形成背压
+        self._queue = queue.Queue(maxsize=max(1, queue_size))
+        self._thread = threading.Thread(target=self._encode_loop, name="TrackingDataRecorder-encoder", daemon=True)
+        self._thread.start()
+
+    def _encode_loop(self):
+        try:
+            while True:
+                frame = self._queue.get()
+                if frame is self._END:
+                    break
+                self._writer.write(frame)
+                self.frames_written += 1
+        except Exception as e:
+            self.error = e
+            # 继续取走剩余的帧，避免生产者阻塞
+            while self._queue.get() is not self._END:
+                pass
+        finally:
+            self._writer.release()
+
+    def write(self, frame):
+        if self.error is not None:
+            raise RuntimeError(f"视频编码失败: {self.error}") from self.error
+        self._queue.put(frame)
+
+    def finish(self):
+        """等待队列中的帧全部编码完成并关闭文件。"""
+        self._queue.put(self._END)
+        self._thread.join()
+        if self.error is not None:
+            raise RuntimeError(f"视频编码失败: {self.error}") from self.error
+
+
 class TrackingDataRecorder:
-    def __init__(self,fps, point_names=None):
+    def __init__(self,fps, point_names=None, initial_capacity=1024, csv_chunk_size=100000,
+                 stream_video=True, encoder_queue_size=64, include_frame_index=False, track_interpolation=False,
+                 write_store=False, source_fps=None, store_chunk_size=65536):
+        """
+        参数:
+            fps: 输出视频的帧率。
+            point_names: 关键点名称。
+            initial_capacity: 姿态数组的初始容量（帧）。
+            csv_chunk_size: save_csv 每次写出的行数。
+            stream_video: 为 True 时在收到第一帧时打开视频写入器，由后台编码线程边收边编码，
+                          不在内存中缓存帧；为 False 时沿用旧行为，在 save_video 时一次性编码。
+            encoder_queue_size: 流式模式下等待编码的最大帧数。
+            include_frame_index: 为 True 时 CSV 第一列写出每行对应的原视频帧索引
+                                 （只处理部分范围或使用 stride 时需要）。
+            track_interpolation: 为 True 时 CSV 最后一列 interpolated 标记该行姿态是否由关键帧插值/预测得到。
+            write_store: 为 True 时在处理过程中每 store_chunk_size 帧把数据追加写入分块列式存储
+                         （见 tracking_store），save 时与 CSV 一起保存为 <file_name>.track 目录。
+            source_fps: 原视频帧率，列式存储用它把帧号换算为时间，默认等于 fps。
+            store_chunk_size: 列式存储每块的行数。
+        """
         if point_names is None:
             point_names = ['Lpupil', 'LDpupil', 'Dpupil', 'DRpupil', 'Rpupil', 'RVupil', 'Vpupil', 'VLpupil']
         self.point_names = point_names
-        self.pose_records = []  # 存储每一帧的数据（列表嵌套字典）
+        # 列式存储：姿态保存在连续的 float32 数组 (N, 8, 3) 中，直径单独一列，容量不足时按倍数扩容
+        self._poses = np.empty((max(1, initial_capacity), len(point_names), 3), dtype=np.float32)
+        self._diameters = np.empty(max(1, initial_capacity), dtype=np.float32)
+        self._frame_indices = np.empty(max(1, initial_capacity), dtype=np.int64)
+        self._interpolated = np.empty(max(1, initial_capacity), dtype=bool)
+        self._num_poses = 0
+        self.include_frame_index = include_frame_index
+        self.track_interpolation = track_interpolation
+        self.csv_chunk_size = csv_chunk_size
         self.frame_records = []
         self.fps = fps
+        self.stream_video = stream_video
+        self.encoder_queue_size = encoder_queue_size
+        self._video_stream = None
+        self.write_store = write_store
+        self.source_fps = source_fps
+        self.store_chunk_size = store_chunk_size
+        self._store_writer = None
+        self._store_rows = 0  # 已交给列式存储的行数
+        self.store_path = None
         self.save_data_root = get_absolute_path("output")
         if not os.path.exists(self.save_data_root):
             os.mkdir(self.save_data_root)
@@ -23,40 +123,218 @@ class TrackingDataRecorder:
     def add_frame(self, frame):
         """
         收集绘制好的帧（如OpenCV的ndarray图像）
+        流式模式下帧直接交给编码线程，不保留在内存中。
         """
-        self.frame_records.append(frame)
+        if not self.stream_video:
+            self.frame_records.append(frame)
+            return
+        if self._video_stream is None:
+            self._video_stream = _StreamingVideoWriter(self._new_video_path(), self.fps, frame.shape,
+                                                       self.encoder_queue_size)
+        # 编码队列满时这里会阻塞，计时反映编码线程的背压
+        with span("recorder.video"):
+            self._video_stream.write(frame)
+
+    def _new_video_path(self):
+        """流式写入使用的临时视频文件（位于 output 目录下，save_video 时移动到最终位置）。"""
+        fd, partial_path = tempfile.mkstemp(prefix=".recording_", suffix=".mp4", dir=self.save_data_root)
+        os.close(fd)
+        # mkstemp 创建的文件只有所有者可读写，改为普通新建文件的权限，移动到最终位置后他人也可读取
+        os.chmod(partial_path, 0o666 & ~_UMASK)
+        return partial_path
+
+    def _new_store_path(self):
+        """列式存储的临时目录（save 时移动到结果目录）。"""
+        path = tempfile.mkdtemp(prefix=".store_", dir=self.save_data_root)
+        os.chmod(path, 0o777 & ~_UMASK)
+        return path
+
+    def _flush_store(self):
+        """把尚未写入列式存储的行交给写入器（写入器按块写出）。"""
+        if self._store_writer is None:
+            self._store_writer = TrackingStoreWriter(self._new_store_path(), self.point_names,
+                                                     self.source_fps or self.fps, self.store_chunk_size)
+        start, end = self._store_rows, self._num_poses
+        self._store_writer.append(self._frame_indices[start:end], self._poses[start:end],
+                                  self._diameters[start:end], self._interpolated[start:end])
+        self._store_rows = end
+
+    def save_store(self, path):
+        """写出剩余的行并把列式存储移动到 path。"""
+        self._flush_store()
+        self._store_writer.close()
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        shutil.move(self._store_writer.path, path)
+        self._store_writer = None
+        self._store_rows = 0
+        self.store_path = path
+        print(f"[INFO] Tracking store saved to {path}")
+
+    def discard_video(self):
+        """放弃流式写入中的视频与列式存储（例如处理被中断时），并删除临时文件。"""
+        if self._store_writer is not None:
+            shutil.rmtree(self._store_writer.path, ignore_errors=True)
+            self._store_writer = None
+            self._store_rows = 0
+        if self._video_stream is None:
+            return
+        try:
+            self._video_stream.finish()
+        except RuntimeError:
+            pass
+        if os.path.exists(self._video_stream.path):
+            os.remove(self._video_stream.path)
+        self._video_stream = None
 
-    def add_frame_pose(self, pose_data: np.ndarray):
+    def close(self):
+        """
+        释放尚未保存的资源：停止编码线程，删除流式写入的临时视频与列式存储。
+        已经保存（或放弃）过的记录器上调用没有影响；流水线出错退出时会调用它。
+        """
+        self.discard_video()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def __del__(self):
+        # 既没有保存也没有放弃就被丢弃时（例如界面的生成器被放弃），不留下编码线程与隐藏的临时文件
+        try:
+            self.close()
+        except Exception:
+            pass
+
+    def _ensure_capacity(self, required):
+        """保证列式数组至少能容纳 required 帧，不足时容量翻倍。"""
+        capacity = len(self._diameters)
+        if required <= capacity:
+            return
+        while capacity < required:
+            capacity *= 2
+        poses = np.empty((capacity,) + self._poses.shape[1:], dtype=np.float32)
+        poses[:self._num_poses] = self._poses[:self._num_poses]
+        diameters = np.empty(capacity, dtype=np.float32)
+        diameters[:self._num_poses] = self._diameters[:self._num_poses]
+        frame_indices = np.empty(capacity, dtype=np.int64)
+        frame_indices[:self._num_poses] = self._frame_indices[:self._num_poses]
+        interpolated = np.empty(capacity, dtype=bool)
+        interpolated[:self._num_poses] = self._interpolated[:self._num_poses]
+        self._poses = poses
+        self._diameters = diameters
+        self._frame_indices = frame_indices
+        self._interpolated = interpolated
+
+    def add_frame_pose(self, pose_data: np.ndarray, frame_index=None, interpolated=False):
         """
         添加一帧追踪结果 (shape: 8x3), 每一行为 [x, y, confidence]
+        frame_index 为该帧在原视频中的索引，默认等于记录的行号。
+        interpolated 表示该姿态是由关键帧插值/预测得到，而不是模型推理的结果。
+        返回:
+            该帧估算的瞳孔直径，调用方可直接复用，无需再次计算。
         """
         if pose_data.shape != (len(self.point_names), 3):
             raise ValueError(f"Expected frame shape ({len(self.point_names)}, 3), got {pose_data.shape}")
 
-        frame_dict = {}
-        for i, name in enumerate(self.point_names):
-            x, y, conf = pose_data[i]
-            frame_dict[f"{name}_x"] = x
-            frame_dict[f"{name}_y"] = y
-            frame_dict[f"{name}_conf"] = conf
-        frame_dict[f"diameter"] = estimate_pupil_diameter(pose_data)
-        self.pose_records.append(frame_dict)
+        with span("recorder.diameter"):
+            diameter = estimate_pupil_diameter(pose_data, self.point_names)
+        self._ensure_capacity(self._num_poses + 1)
+        self._poses[self._num_poses] = pose_data
+        self._diameters[self._num_poses] = diameter
+        self._frame_indices[self._num_poses] = self._num_poses if frame_index is None else frame_index
+        self._interpolated[self._num_poses] = interpolated
+        self._num_poses += 1
+        if self.write_store and self._num_poses - self._store_rows >= self.store_chunk_size:
+            self._flush_store()
+        return diameter
+
+    @property
+    def num_frames(self):
+        """已记录的姿态帧数。"""
+        return self._num_poses
+
+    @property
+    def poses(self):
+        """已记录的姿态，shape (N, 8, 3) 的 float32 视图。"""
+        return self._poses[:self._num_poses]
+
+    @property
+    def diameters(self):
+        """已记录的瞳孔直径，shape (N,) 的 float32 视图。"""
+        return self._diameters[:self._num_poses]
+
+    @property
+    def frame_indices(self):
+        """每条记录对应的原视频帧索引，shape (N,) 的视图。"""
+        return self._frame_indices[:self._num_poses]
+
+    @property
+    def interpolated(self):
+        """每条记录是否为插值/预测结果，shape (N,) 的布尔视图。"""
+        return self._interpolated[:self._num_poses]
+
+    def _column_names(self):
+        columns = []
+        for name in self.point_names:
+            columns += [f"{name}_x", f"{name}_y", f"{name}_conf"]
+        columns.append("diameter")
+        return columns
+
+    def _rows_dataframe(self, start, end):
+        """把 [start, end) 范围内的记录转换为 DataFrame（列顺序与旧版逐帧字典一致）。"""
+        data = np.empty((end - start, len(self.point_names) * 3 + 1), dtype=np.float32)
+        data[:, :-1] = self._poses[start:end].reshape(end - start, -1)
+        data[:, -1] = self._diameters[start:end]
+        # pandas 导入较慢，只在导出数据时才加载
+        import pandas as pd
+        df = pd.DataFrame(data, columns=self._column_names())
+        if self.include_frame_index:
+            df.insert(0, "frame_index", self._frame_indices[start:end])
+        if self.track_interpolation:
+            df["interpolated"] = self._interpolated[start:end]
+        return df
+
+    @property
+    def pose_records(self):
+        """兼容旧接口：按需生成每帧一个字典的列表。"""
+        return self.to_dataframe().to_dict("records")
 
     def to_dataframe(self):
         """
         将记录转为 pandas DataFrame
         """
-        return pd.DataFrame(self.pose_records)
+        return self._rows_dataframe(0, self._num_poses)
 
     def save_csv(self, file_name="tracking_output"):
         """
         保存数据到 CSV 文件
+        按 csv_chunk_size 分块写出，峰值内存只与块大小有关。
         """
-        df = self.to_dataframe()
-        df.to_csv(file_name, index=False)
+        chunk_size = max(1, self.csv_chunk_size)
+        if self._num_poses == 0:
+            self._rows_dataframe(0, 0).to_csv(file_name, index=False)
+        for start in range(0, self._num_poses, chunk_size):
+            end = min(start + chunk_size, self._num_poses)
+            self._rows_dataframe(start, end).to_csv(
+                file_name, index=False, mode="w" if start == 0 else "a", header=start == 0
+            )
         print(f"[INFO] Tracking data saved to {file_name}")
 
     def save_video(self, file_name="tracking_output"):
+        if self.stream_video:
+            if self._video_stream is None:
+                print("没有帧可保存！")
+                return
+            # 帧已在处理过程中编码完毕，这里只需等待队列清空并移动文件
+            self._video_stream.finish()
+            os.replace(self._video_stream.path, file_name)
+            self._video_stream = None
+            print(f"视频已保存到 {file_name}")
+            return
+
         if not self.frame_records:
             print("没有帧可保存！")
             return
@@ -73,6 +351,11 @@ class TrackingDataRecorder:
         print(f"视频已保存到 {file_name}")
 
     def save(self,file_name="tracking_output"):
+        """
+        保存 CSV 与视频到 output/<file_name>_<时间>/ 目录。
+        返回:
+            (csv_path, video_path)
+        """
         record_time = datetime.now().strftime("%Y%m%d_%H%M%S")
         dir_name = file_name+"_"+record_time
         dir_name = os.path.join(self.save_data_root, dir_name)
@@ -82,3 +365,6 @@ class TrackingDataRecorder:
         video_path = os.path.join(dir_name, f"{file_name}.mp4")
         self.save_csv(csv_path)
         self.save_video(video_path)
+        if self.write_store:
+            self.save_store(os.path.join(dir_name, f"{file_name}.track"))
+        return csv_path, video_path
@@ -0,0 +1,257 @@
+import argparse
+import json
+import os
+import shutil
+
+import numpy as np
+
+from utils import write_json_atomic
+
+# 存储格式版本，改变列或文件布局时递增
+TRACKING_STORE_VERSION = 1
+
+_META_NAME = "meta.json"
+# 每列的 dtype 与每行的形状（poses 的形状由关键点数决定）
+_COLUMN_DTYPES = {
+    "frame_index": np.int64,
+    "time": np.float64,
+    "poses": np.float32,
+    "diameter": np.float32,
+    "interpolated": np.bool_,
+}
+
+
+def _chunk_file(column, chunk_id):
+    return f"{column}_{chunk_id:05d}.npy"
+
+
+class TrackingStoreWriter:
+    def __init__(self, path, point_names, fps, chunk_size=65536):
+        """
+        分块列式追踪数据写入器。
+        数据保存在目录 path 中：每列每块一个 .npy 文件（frame_index、time、poses、diameter、interpolated），
+        meta.json 记录关键点、帧率与每块的行数和帧号/时间范围。
+        行先在内存中缓冲，满 chunk_size 行写出一块并原子地更新 meta.json，
+        因此处理过程中目录始终是一个可读取的存储（只包含已写出的块）。
+        .npy 不压缩，以便读取时直接内存映射；float32 二进制本身已比文本 CSV 小得多，也无需解析。
+        参数:
+            path (str): 存储目录。
+            point_names (list[str]): 关键点名称。
+            fps (float): 原视频帧率，用于把帧号换算为时间（秒）。
+            chunk_size (int): 每块的行数。
+        """
+        self.path = path
+        self.point_names = list(point_names)
+        self.fps = fps
+        self.chunk_size = max(1, int(chunk_size))
+        self._chunks = []
+        self._buffer = {column: [] for column in _COLUMN_DTYPES}
+        self._buffered_rows = 0
+        os.makedirs(path, exist_ok=True)
+        self._write_meta()
+
+    def append(self, frame_indices, poses, diameters, interpolated=None, times=None):
+        """
+        追加若干行（按帧号递增）。
+        参数:
+            frame_indices: (N,) 原视频帧号。
+            poses: (N, P, 3) 姿态。
+            diameters: (N,) 瞳孔直径。
+            interpolated: (N,) 是否为插值结果，默认全为 False。
+            times: (N,) 每行的时间（秒），默认 frame_index / fps。
+        """
+        frame_indices = np.asarray(frame_indices, dtype=np.int64)
+        if not len(frame_indices):
+            return
+        if times is None:
+            times = frame_indices / float(self.fps) if self.fps else np.full(len(frame_indices), np.nan)
+        if interpolated is None:
+            interpolated = np.zeros(len(frame_indices), dtype=bool)
+        for column, values in (("frame_index", frame_indices), ("time", times), ("poses", poses),
+                               ("diameter", diameters), ("interpolated", interpolated)):
+            self._buffer[column].append(np.array(values, dtype=_COLUMN_DTYPES[column]))
+        self._buffered_rows += len(frame_indices)
+        while self._buffered_rows >= self.chunk_size:
+            self._write_chunk(self.chunk_size)
+
+    def _write_chunk(self, rows):
+        """把缓冲区前 rows 行写成一块。"""
+        chunk_id = len(self._chunks)
+        columns = {}
+        for column, parts in self._buffer.items():
+            values = np.concatenate(parts) if len(parts) > 1 else parts[0]
+            columns[column] = values[:rows]
+            self._buffer[column] = [values[rows:]] if len(values) > rows else []
+            np.save(os.path.join(self.path, _chunk_file(column, chunk_id)), values[:rows])
+        self._buffered_rows -= rows
+        self._chunks.append({
+            "rows": rows,
+            "first_frame": int(columns["frame_index"][0]),
+            "last_frame": int(columns["frame_index"][-1]),
+            "first_time": float(columns["time"][0]),
+            "last_time": float(columns["time"][-1]),
+        })
+        # 块文件写完后再更新元数据，读取方只会看到完整的块
+        self._write_meta()
+
+    def _write_meta(self):
+        write_json_atomic(os.path.join(self.path, _META_NAME), {
+            "version": TRACKING_STORE_VERSION,
+            "point_names": self.point_names,
+            "fps": self.fps,
+            "columns": list(_COLUMN_DTYPES),
+            "chunks": self._chunks,
+        })
+
+    def close(self):
+        """写出缓冲区中剩余的行。"""
+        if self._buffered_rows:
+            self._write_chunk(self._buffered_rows)
+
+
+class TrackingStore:
+    def __init__(self, path):
+        """
+        TrackingStoreWriter 写出的存储的只读访问。
+        各块按需以内存映射方式打开，范围查询只读取相关块中落在范围内的行，不会加载整个文件。
+        用法:
+            store = TrackingStore("output/xxx/xxx.track")
+            data = store.time_range(600, 660)          # {"frame_index": ..., "time": ..., "diameter": ...}
+            poses = store.frame_range(0, 1000, columns=("poses",))["poses"]
+        参数:
+            path (str): 存储目录。
+        """
+        self.path = path
+        with open(os.path.join(path, _META_NAME), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("version") != TRACKING_STORE_VERSION:
+            raise ValueError(f"不支持的存储版本: {meta.get('version')}")
+        self.point_names = meta["point_names"]
+        self.fps = meta["fps"]
+        self.columns = meta["columns"]
+        self.chunks = meta["chunks"]
+        self._arrays = {}
+
+    def __len__(self):
+        return sum(chunk["rows"] for chunk in self.chunks)
+
+    def _column(self, column, chunk_id):
+        """内存映射打开一块中的一列。"""
+        key = (column, chunk_id)
+        if key not in self._arrays:
+            if column not in self.columns:
+                raise KeyError(f"未知的列: {column}")
+            self._arrays[key] = np.load(os.path.join(self.path, _chunk_file(column, chunk_id)), mmap_mode="r")
+        return self._arrays[key]
+
+    def _range(self, key_column, first_key, last_key, start, end, columns):
+        """在按 key_column 递增排列的行中取出 [start, end) 范围内的各列。"""
+        parts = {column: [] for column in columns}
+        for chunk_id, chunk in enumerate(self.chunks):
+            if chunk[last_key] < start or (end is not None and chunk[first_key] >= end):
+                continue
+            keys = self._column(key_column, chunk_id)
+            lo = np.searchsorted(keys, start, side="left")
+            hi = len(keys) if end is None else np.searchsorted(keys, end, side="left")
+            if hi <= lo:
+                continue
+            for column in columns:
+                parts[column].append(self._column(column, chunk_id)[lo:hi])
+        result = {}
+        for column in columns:
+            if parts[column]:
+                result[column] = np.concatenate(parts[column]) if len(parts[column]) > 1 else np.array(parts[column][0])
+            else:
+                shape = (0, len(self.point_names), 3) if column == "poses" else (0,)
+                result[column] = np.empty(shape, dtype=_COLUMN_DTYPES[column])
+        return result
+
+    def frame_range(self, start_frame=0, end_frame=None, columns=("frame_index", "time", "diameter")):
+        """
+        读取帧号在 [start_frame, end_frame) 内的行。
+        返回:
+            {列名: 数组}，数组是普通 ndarray（只复制范围内的行）。
+        """
+        return self._range("frame_index", "first_frame", "last_frame", start_frame, end_frame, columns)
+
+    def time_range(self, start_time=0.0, end_time=None, columns=("frame_index", "time", "diameter")):
+        """读取时间（秒）在 [start_time, end_time) 内的行，返回值同 frame_range。"""
+        return self._range("time", "first_time", "last_time", start_time, end_time, columns)
+
+    def read(self, column):
+        """读取整列。"""
+        return self.frame_range(columns=(column,))[column]
+
+    def to_dataframe(self, start_frame=0, end_frame=None):
+        """把 [start_frame, end_frame) 内的行转为与追踪 CSV 相同列名的 DataFrame。"""
+        import pandas as pd
+        data = self.frame_range(start_frame, end_frame, columns=self.columns)
+        df = pd.DataFrame({"frame_index": data["frame_index"], "time": data["time"]})
+        for i, name in enumerate(self.point_names):
+            df[f"{name}_x"] = data["poses"][:, i, 0]
+            df[f"{name}_y"] = data["poses"][:, i, 1]
+            df[f"{name}_conf"] = data["poses"][:, i, 2]
+        df["diameter"] = data["diameter"]
+        df["interpolated"] = data["interpolated"]
+        return df
+
+
+def convert_csv(csv_path, store_path, fps, chunk_size=65536):
+    """
+    把已有的追踪 CSV 转换为分块列式存储（按 chunk_size 行分块读取，内存占用与文件大小无关）。
+    没有 frame_index 列的 CSV 以行号作为帧号。
+    """
+    import pandas as pd
+    if os.path.exists(store_path):
+        shutil.rmtree(store_path)
+    writer = None
+    row = 0
+    for df in pd.read_csv(csv_path, chunksize=chunk_size):
+        point_names = [column[:-len("_x")] for column in df.columns if column.endswith("_x")]
+        if writer is None:
+            writer = TrackingStoreWriter(store_path, point_names, fps, chunk_size)
+        frame_indices = df["frame_index"].to_numpy() if "frame_index" in df else np.arange(row, row + len(df))
+        poses = np.stack([df[[f"{name}_x", f"{name}_y", f"{name}_conf"]].to_numpy() for name in point_names], axis=1)
+        interpolated = df["interpolated"].to_numpy(dtype=bool) if "interpolated" in df else None
+        writer.append(frame_indices, poses, df["diameter"].to_numpy(), interpolated)
+        row += len(df)
+    if writer is not None:
+        writer.close()
+    return store_path
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="查询或转换分块列式追踪数据")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    query_parser = subparsers.add_parser("query", help="按帧号或时间范围查询")
+    query_parser.add_argument("store", help="存储目录（.track）")
+    query_parser.add_argument("--start-time", type=float, default=None, help="起始时间（秒）")
+    query_parser.add_argument("--end-time", type=float, default=None, help="结束时间（秒，不含）")
+    query_parser.add_argument("--start-frame", type=int, default=0, help="起始帧（含）")
+    query_parser.add_argument("--end-frame", type=int, default=None, help="结束帧（不含）")
+    query_parser.add_argument("--output", default=None, help="把查询结果保存为 CSV")
+    convert_parser = subparsers.add_parser("convert", help="把追踪 CSV 转换为列式存储")
+    convert_parser.add_argument("csv", help="追踪 CSV 文件")
+    convert_parser.add_argument("--fps", type=float, required=True, help="原视频帧率")
+    convert_parser.add_argument("--output", default=None, help="存储目录，默认与 CSV 同名的 .track 目录")
+    args = parser.parse_args()
+
+    if args.command == "convert":
+        output = args.output or os.path.splitext(args.csv)[0] + ".track"
+        convert_csv(args.csv, output, args.fps)
+        print(f"已转换为 {output}（{len(TrackingStore(output))} 行）")
+    else:
+        store = TrackingStore(args.store)
+        if args.start_time is not None or args.end_time is not None:
+            data = store.time_range(args.start_time or 0.0, args.end_time)
+        else:
+            data = store.frame_range(args.start_frame, args.end_frame)
+        diameters = data["diameter"]
+        print(f"共 {len(store)} 行，范围内 {len(diameters)} 行")
+        if len(diameters):
+            print(f"帧 {data['frame_index'][0]}–{data['frame_index'][-1]}，时间 {data['time'][0]:.2f}–{data['time'][-1]:.2f} 秒，"
+                  f"直径均值 {np.nanmean(diameters):.3f}，中位数 {np.nanmedian(diameters):.3f}")
+        if args.output:
+            import pandas as pd
+            pd.DataFrame(data).to_csv(args.output, index=False)
+            print(f"已保存到 {args.output}")
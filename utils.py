@@ -1,5 +1,10 @@
+import hashlib
+import importlib.util
+import json
 import os
 import sys
+import time
+import uuid
 import warnings
 
 import cv2
@@ -7,6 +12,8 @@ import numpy as np
 from PIL import ImageColor
 import colorcet as cc
 
+from pupil_metrics import DEFAULT_POINT_NAMES, pair_indices
+
 def get_pretrain_models():
     """
     获取 pretrain_model 文件夹下的所有模型子目录名称。
@@ -32,6 +39,9 @@ def get_pretrain_models():
     return model_name
 
 def draw_keypoints(frame, pose, radius=4, pcutoff=0.5):
+    if not frame.flags.writeable:
+        # 来自内存映射缓存的帧是只读的，绘制前先复制
+        frame = frame.copy()
     cmap = "bmy"
     all_colors = getattr(cc, cmap)
     colors = [
@@ -51,6 +61,7 @@ def draw_keypoints(frame, pose, radius=4, pcutoff=0.5):
 def estimate_pupil_diameter(frame_data: np.ndarray, point_names=None):
     """
     根据追踪的8个关键点坐标估算瞳孔直径（取多个对角点对的欧几里得距离平均）
+    整段记录的批量计算请使用 pupil_metrics.pupil_diameters / compute_pupil_metrics。
 
     参数：
         frame_data: numpy array, shape (8, 3)，每行为[x, y, confidence]
@@ -59,57 +70,37 @@ def estimate_pupil_diameter(frame_data: np.ndarray, point_names=None):
     返回：
         estimated_diameter: float
     """
-    if point_names is None:
-        point_names = ['Lpupil', 'LDpupil', 'Dpupil', 'DRpupil',
-                       'Rpupil', 'RVupil', 'Vpupil', 'VLpupil']
-
-    name_to_index = {name: idx for idx, name in enumerate(point_names)}
-
-    # 配对列表（对角/轴向）
-    pairs = [
-        ('Lpupil', 'Rpupil'),
-        ('LDpupil', 'RVupil'),
-        ('Dpupil', 'Vpupil'),
-        ('DRpupil', 'VLpupil')
-    ]
-
-    distances = []
-    for p1, p2 in pairs:
-        idx1, idx2 = name_to_index[p1], name_to_index[p2]
-        x1, y1 = frame_data[idx1][:2]
-        x2, y2 = frame_data[idx2][:2]
-        dist = np.sqrt((x1 - x2) ** 2 + (y1 - y2) ** 2)
-        distances.append(dist)
-
+    first, second = pair_indices(tuple(point_names or DEFAULT_POINT_NAMES))
+    delta = frame_data[first, :2] - frame_data[second, :2]
     # 平均距离作为估算直径
-    estimated_diameter = np.mean(distances)
-    return estimated_diameter
+    return np.sqrt(delta[:, 0] ** 2 + delta[:, 1] ** 2).mean()
 
 def check_tensorrt_available():
     """
-    Checks if NVIDIA TensorRT is available in the current Python environment.
+    Checks if NVIDIA TensorRT is installed in the current Python environment.
+    Only the package spec is looked up, the (slow) import itself happens when a
+    TensorRT model is loaded, where CUDA/cuDNN problems are reported by DLCLive.
 
     Returns:
-        bool: True if TensorRT can be imported, False otherwise.
+        bool: True if the `tensorrt` package can be found, False otherwise.
     """
     try:
-        import tensorrt as trt
-        print(f"TensorRT found and available! Version: {trt.__version__}")
-        return True
-    except ImportError:
+        found = importlib.util.find_spec("tensorrt") is not None
+    except (ImportError, ValueError) as e:
+        print(f"An error occurred while looking up TensorRT: {e}")
+        return False
+    if found:
+        print("TensorRT found and available!")
+    else:
         print("TensorRT module not found. It might not be installed or configured correctly.")
         print("   Please ensure you have installed the `tensorrt` Python package and its dependencies.")
-        return False
-    except Exception as e:
-        # Catch other potential runtime errors during import (e.g., missing CUDA libraries)
-        print(f"An error occurred while trying to import TensorRT: {e}")
-        print("   This might indicate an issue with your TensorRT installation or underlying CUDA/cuDNN setup.")
-        return False
-
+    return found
 
-import plotly.graph_objects as go
 
 def generate_plotly_lineplot(frame_indices, diameters, window_size=50, use_sliding_window=False):
+    # plotly 导入较慢，首次绘图时才加载（启动时由后台预加载）
+    import plotly.graph_objects as go
+
     total_frames = len(frame_indices)
 
     # 如果启用滑动窗口：只保留最近 window_size 个数据
@@ -153,6 +144,78 @@ def generate_plotly_lineplot(frame_indices, diameters, window_size=50, use_slidi
 
     return fig
 
+class RateLimiter:
+    """
+    简单的限频器：ready() 距上次返回 True 至少经过 1/rate_hz 秒时才再次返回 True。
+    rate_hz <= 0 表示不限频。
+    """
+
+    def __init__(self, rate_hz):
+        self.interval = 1.0 / rate_hz if rate_hz and rate_hz > 0 else 0.0
+        self._last = None
+
+    def ready(self, now=None):
+        now = time.monotonic() if now is None else now
+        if self._last is None or now - self._last >= self.interval:
+            self._last = now
+            return True
+        return False
+
+    def reset(self):
+        self._last = None
+
+_file_hash_cache = {}
+
+def file_sha256(path, chunk_size=8 * 1024 * 1024):
+    """
+    计算文件内容的 SHA-256。
+    结果按 (路径, 大小, 修改时间) 缓存在进程内，同一文件重复调用不会重新读取。
+    """
+    return file_sha256_entry(path, chunk_size)[1]
+
+
+def file_sha256_entry(path, chunk_size=8 * 1024 * 1024):
+    """
+    计算文件哈希，并返回缓存条目 (缓存键, 哈希)。
+    条目可传给其它进程（例如 spawn 的工作进程）的 seed_file_sha256，使其不必重新读取整个文件。
+    """
+    stat = os.stat(path)
+    cache_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if cache_key not in _file_hash_cache:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            while chunk := f.read(chunk_size):
+                digest.update(chunk)
+        _file_hash_cache[cache_key] = digest.hexdigest()
+    return cache_key, _file_hash_cache[cache_key]
+
+
+def seed_file_sha256(entry):
+    """把 file_sha256_entry 返回的条目放入本进程的哈希缓存；文件之后有变化时缓存键不同，仍会重新计算。"""
+    cache_key, digest = entry
+    _file_hash_cache[tuple(cache_key)] = digest
+
+def directory_sha256(path):
+    """
+    计算目录内容的 SHA-256（按相对路径排序，包含每个文件的路径与内容哈希），用于识别模型目录。
+    各文件的哈希由 file_sha256 缓存，重复调用只需遍历目录。
+    """
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            file_path = os.path.join(root, name)
+            relative = os.path.relpath(file_path, path).replace(os.sep, "/")
+            digest.update(relative.encode("utf-8") + b"\0" + file_sha256(file_path).encode("ascii") + b"\n")
+    return digest.hexdigest()
+
+def write_json_atomic(path, data):
+    """先写入临时文件再原子地重命名，读取方不会看到写了一半的文件。"""
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
 def get_absolute_path(path_name):
     if hasattr(sys, '_MEIPASS'):
         base_path = os.path.dirname(sys.executable)
@@ -0,0 +1,211 @@
+import hashlib
+import os
+import struct
+
+import cv2
+import numpy as np
+
+from utils import get_absolute_path
+
+# 索引格式版本，改变内容时递增以使旧索引失效
+INDEX_FORMAT_VERSION = 1
+
+# 需要向下递归查找的 MP4 容器 box
+_CONTAINER_BOXES = {b"moov", b"trak", b"mdia", b"minf", b"stbl"}
+
+
+def _iter_boxes(f, start, end):
+    """遍历 [start, end) 范围内的 MP4 box，产出 (类型, 内容起始偏移, 内容结束偏移)。"""
+    offset = start
+    while offset + 8 <= end:
+        f.seek(offset)
+        header = f.read(8)
+        if len(header) < 8:
+            return
+        size, box_type = struct.unpack(">I4s", header)
+        header_size = 8
+        if size == 1:
+            size = struct.unpack(">Q", f.read(8))[0]
+            header_size = 16
+        elif size == 0:
+            size = end - offset
+        if size < header_size:
+            return
+        yield box_type, offset + header_size, min(offset + size, end)
+        offset += size
+
+
+def _read_box(f, start, end):
+    f.seek(start)
+    return f.read(end - start)
+
+
+def _parse_video_track(f, start, end):
+    """解析一个 trak box，若为视频轨则返回其样本表，否则返回 None。"""
+    tables = {}
+
+    def walk(box_start, box_end):
+        for box_type, content_start, content_end in _iter_boxes(f, box_start, box_end):
+            if box_type in _CONTAINER_BOXES:
+                walk(content_start, content_end)
+            elif box_type in (b"hdlr", b"mdhd", b"stts", b"stss", b"ctts"):
+                # QuickTime 文件的 minf 中还有一个数据引用 hdlr，只保留 mdia 中的第一个
+                tables.setdefault(box_type, _read_box(f, content_start, content_end))
+
+    walk(start, end)
+    hdlr = tables.get(b"hdlr")
+    if hdlr is None or hdlr[8:12] != b"vide" or b"stts" not in tables or b"mdhd" not in tables:
+        return None
+
+    mdhd = tables[b"mdhd"]
+    timescale = struct.unpack(">I", mdhd[20:24] if mdhd[0] == 1 else mdhd[12:16])[0]
+
+    # stts: 每个样本的解码时长（按 run-length 编码）
+    stts = tables[b"stts"]
+    entry_count = struct.unpack(">I", stts[4:8])[0]
+    runs = np.frombuffer(stts, dtype=">u4", count=entry_count * 2, offset=8).reshape(-1, 2)
+    deltas = np.repeat(runs[:, 1].astype(np.int64), runs[:, 0].astype(np.int64))
+    dts = np.concatenate([[0], np.cumsum(deltas)[:-1]])
+
+    # ctts: 解码时间到显示时间的偏移（含 B 帧的视频才有）
+    pts = dts
+    if b"ctts" in tables:
+        ctts = tables[b"ctts"]
+        entry_count = struct.unpack(">I", ctts[4:8])[0]
+        counts = np.frombuffer(ctts, dtype=">u4", count=entry_count * 2, offset=8)[0::2].astype(np.int64)
+        # 与 ffmpeg 一致，version 0 的偏移也按有符号数解释（不少编码器会写入负偏移）
+        offsets = np.frombuffer(ctts, dtype=">i4", count=entry_count * 2, offset=8)[1::2].astype(np.int64)
+        composition = np.repeat(offsets, counts)
+        if len(composition) == len(dts):
+            pts = dts + composition
+
+    # stss: 关键帧（同步样本）编号，从 1 开始；没有 stss 表示每一帧都是关键帧
+    num_samples = len(pts)
+    if b"stss" in tables:
+        stss = tables[b"stss"]
+        entry_count = struct.unpack(">I", stss[4:8])[0]
+        sync_samples = np.frombuffer(stss, dtype=">u4", count=entry_count, offset=8).astype(np.int64) - 1
+    else:
+        sync_samples = np.arange(num_samples)
+
+    # 解码器按显示顺序输出帧，把关键帧从解码顺序映射到显示顺序
+    order = np.argsort(pts, kind="stable")
+    display_rank = np.empty(num_samples, dtype=np.int64)
+    display_rank[order] = np.arange(num_samples)
+    sync_samples = sync_samples[(sync_samples >= 0) & (sync_samples < num_samples)]
+    keyframes = np.sort(display_rank[sync_samples])
+    timestamps = (pts[order] - pts[order[0]]) / float(timescale)
+    return keyframes, timestamps
+
+
+def parse_mp4_index(video_path):
+    """
+    只读取 MP4/MOV 的 moov box（不读取媒体数据），解析出视频轨的关键帧与每帧显示时间戳。
+    返回:
+        (keyframes, timestamps)：关键帧的帧索引数组（显示顺序）和每帧的时间戳（秒）；
+        不是 MP4 或解析失败时返回 None。
+    """
+    try:
+        file_size = os.path.getsize(video_path)
+        with open(video_path, "rb") as f:
+            for box_type, start, end in _iter_boxes(f, 0, file_size):
+                if box_type != b"moov":
+                    continue
+                for child_type, child_start, child_end in _iter_boxes(f, start, end):
+                    if child_type == b"trak":
+                        track = _parse_video_track(f, child_start, child_end)
+                        if track is not None:
+                            return track
+                return None
+    except (OSError, struct.error, ValueError, IndexError):
+        return None
+    return None
+
+
+class VideoIndex:
+    def __init__(self, frame_count, fps, timestamps, keyframes=None):
+        """
+        视频的关键帧/时间戳索引。
+        参数:
+            frame_count (int): 帧数。
+            fps (float): 帧率。
+            timestamps (np.ndarray): 每帧的显示时间（秒）。
+            keyframes (np.ndarray): 关键帧的帧索引；None 表示未知（非 MP4 容器）。
+        """
+        self.frame_count = int(frame_count)
+        self.fps = float(fps)
+        self.timestamps = np.asarray(timestamps, dtype=np.float64)
+        self.keyframes = None if keyframes is None else np.asarray(keyframes, dtype=np.int64)
+
+    @staticmethod
+    def _index_path(video_path, index_dir):
+        stat = os.stat(video_path)
+        key = f"{os.path.abspath(video_path)}|{stat.st_size}|{stat.st_mtime_ns}|{INDEX_FORMAT_VERSION}"
+        return os.path.join(index_dir, hashlib.sha256(key.encode("utf-8")).hexdigest()[:32] + ".npz")
+
+    @classmethod
+    def build(cls, video_path):
+        """解析容器元数据建立索引；无法解析时退化为按帧率推算的时间戳。"""
+        cap = cv2.VideoCapture(video_path)
+        if not cap.isOpened():
+            cap.release()
+            raise IOError(f"无法打开视频文件: {video_path}")
+        metadata_frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        cap.release()
+
+        parsed = parse_mp4_index(video_path)
+        if parsed is not None:
+            keyframes, timestamps = parsed
+            return cls(len(timestamps), fps, timestamps, keyframes)
+        timestamps = np.arange(metadata_frame_count) / fps if fps > 0 else np.zeros(metadata_frame_count)
+        return cls(metadata_frame_count, fps, timestamps, None)
+
+    @classmethod
+    def load_or_build(cls, video_path, index_dir=None):
+        """
+        读取已保存的索引，不存在时建立并保存。
+        索引按 (路径, 文件大小, 修改时间) 保存在 cache/index 目录下。
+        """
+        index_dir = index_dir or get_absolute_path(os.path.join("cache", "index"))
+        index_path = cls._index_path(video_path, index_dir)
+        try:
+            with np.load(index_path) as data:
+                keyframes = data["keyframes"] if bool(data["has_keyframes"]) else None
+                return cls(int(data["frame_count"]), float(data["fps"]), data["timestamps"], keyframes)
+        except (OSError, KeyError, ValueError):
+            pass
+
+        index = cls.build(video_path)
+        try:
+            os.makedirs(index_dir, exist_ok=True)
+            tmp_path = f"{index_path}.{os.getpid()}.tmp.npz"
+            np.savez(
+                tmp_path,
+                frame_count=index.frame_count,
+                fps=index.fps,
+                timestamps=index.timestamps,
+                has_keyframes=index.keyframes is not None,
+                keyframes=index.keyframes if index.keyframes is not None else np.empty(0, dtype=np.int64),
+            )
+            os.replace(tmp_path, index_path)
+        except OSError as e:
+            print(f"警告: 保存视频索引失败: {e}")
+        return index
+
+    def nearest_keyframe(self, frame_idx):
+        """返回不晚于 frame_idx 的最近关键帧；关键帧未知时返回 None。"""
+        if self.keyframes is None or len(self.keyframes) == 0:
+            return None
+        pos = int(np.searchsorted(self.keyframes, frame_idx, side="right")) - 1
+        return int(self.keyframes[max(pos, 0)])
+
+    def frame_at_time(self, seconds):
+        """返回显示时间不早于 seconds 的第一帧的索引。"""
+        return int(np.searchsorted(self.timestamps, seconds - 1e-9, side="left"))
+
+    def timestamp_of(self, frame_idx):
+        """返回帧的显示时间（秒）。"""
+        if 0 <= frame_idx < len(self.timestamps):
+            return float(self.timestamps[frame_idx])
+        return frame_idx / self.fps if self.fps > 0 else 0.0
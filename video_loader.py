@@ -1,6 +1,16 @@
+import queue
+import threading
+import time
+from collections import deque
+
 import cv2
 from tqdm import tqdm
 
+from video_index import VideoIndex
+
+# 解码线程放入队列的结束标记
+_END_OF_STREAM = object()
+
 
 class BasicVideoLoader():
     def __init__(self):
@@ -17,22 +27,40 @@ class BasicVideoLoader():
 
     def get_frame(self):
         """
-        获取当前帧。
+        获取下一帧。
         返回:
-            tuple: (bool, frame) 其中 bool 表示是否成功读取，frame 是图像帧。
+            frame 图像帧；没有更多帧时返回 None。读取到的帧在原视频/采集序列中的编号记录在 last_frame_index。
         """
         pass
 
     def draw_labeled_frame(self, frame, point_list):
         """
-        在帧上绘制标签。
+        在帧上绘制标记点。
         参数:
-            frame: 要绘制的图像帧。
-            point_list: 追踪关键点的坐标。
+            frame: 要绘制的图像帧 (numpy array)。
+            point_list: 一个包含 (x, y) 坐标元组的列表。
         返回:
-            frame: 绘制了标签的图像帧。
+            绘制了标记的图像帧。如果输入帧为None或point_list为空，则返回原始帧。
         """
-        pass
+        if frame is None:
+            return None
+
+        # 创建帧的副本以避免修改原始列表中的帧
+        labeled_frame = frame.copy()
+
+        if point_list:  # 确保 point_list 不为 None 或空
+            for point in point_list:
+                try:
+                    # 确保坐标是整数
+                    center_x = int(point[0])
+                    center_y = int(point[1])
+                    cv2.circle(labeled_frame, (center_x, center_y), radius=5, color=(0, 0, 255), thickness=-1)  # 红色实心圆点
+                except IndexError:
+                    print(f"警告: 点 {point} 的格式不正确，应为 (x, y)。")
+                except Exception as e:
+                    print(f"警告: 绘制点 {point} 时出错: {e}")
+
+        return labeled_frame
 
     def release(self):
         """释放视频捕捉对象。"""
@@ -44,81 +72,324 @@ class BasicVideoLoader():
         self.release()
 
 class LocalVideoLoader(BasicVideoLoader):
-    def __init__(self, video_path: str):
+    def __init__(self, video_path: str, preload: bool = False, prefetch_size: int = 64,
+                 start_frame: int = 0, end_frame: int = None, frame_cache=None,
+                 stride: int = 1, start_time: float = None, end_time: float = None, use_index: bool = True):
         """
         初始化本地视频加载器。
-        所有帧将被预加载到内存中。
+        默认以流式方式读取：后台解码线程把帧填入一个容量为 prefetch_size 的有界队列，
+        get_frame() 从队列中取帧，内存占用与视频长度无关。
         参数:
             video_path (str): 本地视频文件的路径。
+            preload (bool): 为 True 时沿用旧行为，把所有帧预加载到内存中（适合短视频）。
+            prefetch_size (int): 流式模式下预取队列的最大帧数。
+            start_frame (int): 从该帧（含）开始读取。
+            end_frame (int): 读取到该帧（不含）为止，None 表示读到视频末尾。
+            frame_cache (FrameCache): 可选的解码帧缓存。命中时直接从内存映射文件读取帧，
+                                      未命中时在解码的同时写入缓存。
+            stride (int): 每隔 stride 帧取一帧。跳过的帧只 grab 不解码输出；
+                          跨过关键帧时直接跳转到关键帧。
+            start_time (float): 按时间（秒）指定起点，优先于 start_frame。
+            end_time (float): 按时间（秒）指定终点（不含），优先于 end_frame。
+            use_index (bool): 首次打开时建立并保存关键帧/时间戳索引（见 video_index.VideoIndex），
+                              用于时间范围换算和跳转到最近的关键帧。
         """
         super().__init__()  # 调用基类构造函数
         self.video_path = video_path
+        self.preload = preload
+        self.prefetch_size = max(1, int(prefetch_size))
+        self.start_frame = max(0, int(start_frame))
+        self.end_frame = end_frame
+        self.stride = max(1, int(stride))
+        self.start_time = start_time
+        self.end_time = end_time
+        self.use_index = use_index
+        self.index = None
         self.current_frame_idx = 0  # 当前要提供的帧的索引
-        self.frame_list = []  # 存储所有加载的帧
+        self.last_frame_index = None  # 最近一次 get_frame() 返回的帧在原视频中的索引
+        self.frame_list = []  # 预加载模式下存储所有加载的帧
+        self._frame_indices = []  # 预加载模式下每帧在原视频中的索引
         self.metadata_frame_count = 0  # 从视频元数据获取的总帧数
         self.fps = 0
+
+        # 解码帧缓存：命中时 _cached_frames 为只读的内存映射数组
+        self.frame_cache = frame_cache
+        self._cache_key = None
+        self._cached_frames = None
+
+        # 流式模式下的解码线程状态
+        self._frame_queue = None
+        self._decode_thread = None
+        self._stop_event = threading.Event()
+        self._decoded_count = 0
+        self._stream_finished = False
         self.load_video(video_path)
 
+    def _open_capture(self):
+        """打开 VideoCapture 并读取元数据，失败时抛出 IOError。"""
+        cap = cv2.VideoCapture(self.video_path)
+        if not cap.isOpened():
+            cap.release()  # 确保释放
+            self.metadata_frame_count = 0
+            raise IOError(f"无法打开视频文件: {self.video_path}")
+        self.metadata_frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.fps = cap.get(cv2.CAP_PROP_FPS)
+        if self.start_frame > 0:
+            cap = self._seek(cap, self.start_frame)
+        return cap
+
+    def _seek(self, cap, frame_idx):
+        """
+        把 cap 定位到 frame_idx。
+        有索引时先跳转到不晚于 frame_idx 的最近关键帧，再逐帧 grab 到目标帧；
+        若解码器报告的位置不一致，则从头逐帧 grab，保证读到的帧与从头顺序读取时完全一致。
+        """
+        keyframe = self.index.nearest_keyframe(frame_idx) if self.index is not None else None
+        target = frame_idx if keyframe is None else keyframe
+        cap.set(cv2.CAP_PROP_POS_FRAMES, target)
+        if int(cap.get(cv2.CAP_PROP_POS_FRAMES)) == target:
+            for _ in range(frame_idx - target):
+                if not cap.grab():
+                    break
+            return cap
+        print(f"警告: 无法精确跳转到第 {frame_idx} 帧，改为从头逐帧定位。")
+        cap.release()
+        cap = cv2.VideoCapture(self.video_path)
+        for _ in range(frame_idx):
+            if not cap.grab():
+                break
+        return cap
+
+    def _skip_to(self, cap, position, target):
+        """
+        从 position 前进到 target（不含 target 之前的帧的输出）。
+        若两者之间有关键帧，直接跳转到最近的关键帧，只 grab 剩余的帧。
+        返回:
+            (cap, 新位置)；视频提前结束时新位置为 None。
+        """
+        keyframe = self.index.nearest_keyframe(target) if self.index is not None else None
+        if keyframe is not None and keyframe > position:
+            cap = self._seek(cap, target)
+            return cap, target
+        while position < target:
+            if not cap.grab():
+                return cap, None
+            position += 1
+        return cap, position
+
+    def _iter_frames(self, cap):
+        """
+        按 start_frame / end_frame / stride 依次解码帧，产出 (原视频帧索引, 帧)。
+        生成器结束时释放 cap；完整读完时提交解码帧缓存，中途被关闭时放弃缓存。
+        """
+        position = self.start_frame
+        end = self.end_frame
+        cache_writer = None
+        first = True
+        completed = False
+        try:
+            while end is None or position < end:
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                cache_writer = self._write_to_cache(cache_writer, frame, first=first)
+                first = False
+                yield position, frame
+                target = position + self.stride
+                position += 1
+                if target > position:
+                    if end is not None and target >= end:
+                        break
+                    cap, position = self._skip_to(cap, position, target)
+                    if position is None:
+                        break
+            completed = True
+        finally:
+            cap.release()
+            if cache_writer is not None:
+                # 只有完整读完的视频才写入缓存
+                if completed:
+                    cache_writer.commit()
+                else:
+                    cache_writer.abort()
+
+    def get_expected_frame_count(self):
+        """根据元数据、读取范围与 stride 估算本次将提供的帧数。"""
+        end = self.metadata_frame_count
+        if self.end_frame is not None:
+            end = min(end, int(self.end_frame))
+        span = max(0, end - self.start_frame)
+        return (span + self.stride - 1) // self.stride
+
+    def get_timestamp(self, frame_index):
+        """返回原视频中第 frame_index 帧的显示时间（秒）。"""
+        if self.index is not None:
+            return self.index.timestamp_of(frame_index)
+        return frame_index / self.fps if self.fps else 0.0
+
     def load_video(self, source: str):
         """
-        从指定路径加载视频的所有帧到内存中。
+        加载指定路径的视频。
+        流式模式下只打开文件并启动后台解码线程；预加载模式下把所有帧读入内存。
         参数:
             source (str): 视频文件的路径。
         """
+        self._stop_decoder()
         self.video_path = source
-        self.cap = cv2.VideoCapture(self.video_path)
-
-        if not self.cap.isOpened():
-            # 如果视频无法打开，清空列表并重置计数器
-            self.frame_list = []
-            self.current_frame_idx = 0
-            self.metadata_frame_count = 0
-            self.cap.release()  # 确保释放
-            raise IOError(f"无法打开视频文件: {self.video_path}")
-
-        self.metadata_frame_count = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
-
         # 重置/清空列表和索引，以支持可能的重载操作
         self.frame_list = []
+        self._frame_indices = []
         self.current_frame_idx = 0
-        self.fps = self.cap.get(cv2.CAP_PROP_FPS)
+        self.last_frame_index = None
+        self._cached_frames = None
+
+        if self.use_index or self.start_time is not None or self.end_time is not None:
+            self.index = VideoIndex.load_or_build(source)
+            if self.start_time is not None:
+                self.start_frame = self.index.frame_at_time(self.start_time)
+            if self.end_time is not None:
+                self.end_frame = self.index.frame_at_time(self.end_time)
+
+        if self.frame_cache is not None:
+            self._cache_key = self.frame_cache.make_key(
+                source, start_frame=self.start_frame, end_frame=self.end_frame, stride=self.stride
+            )
+            cached = self.frame_cache.lookup(self._cache_key)
+            if cached is not None:
+                self._cached_frames, meta = cached
+                self.fps = meta["fps"]
+                self.metadata_frame_count = meta["metadata_frame_count"]
+                print(f"视频 '{self.video_path}' 命中解码帧缓存，共 {len(self._cached_frames)} 帧。")
+                return
+
+        self.cap = self._open_capture()
+
+        if self.preload:
+            self._preload_all_frames()
+        else:
+            self._start_decoder()
 
+    def _preload_all_frames(self):
+        """把所有帧读入 self.frame_list（旧的预加载行为）。"""
         print(f"正在加载视频 '{self.video_path}' (元数据总帧数: {self.metadata_frame_count})...")
 
-        # 使用 tqdm 创建进度条
-        # 我们将迭代 metadata_frame_count 次，但只添加成功读取的帧
-        for i in tqdm(range(self.metadata_frame_count), desc=f"加载 {self.video_path}"):
-            ret, frame = self.cap.read()
-            if ret:
-                self.frame_list.append(frame)
-            else:
-                # 如果读取失败（例如视频提前结束或损坏）
-                print(f"\n警告: 在索引 {i} 处读取帧失败 (元数据总帧数: {self.metadata_frame_count})。")
-                print("视频可能已损坏或实际帧数少于元数据。停止加载。")
-                break  # 停止尝试读取更多帧
-
-        self.cap.release()  # 所有帧已加载到列表，释放 VideoCapture 对象
+        # 使用 tqdm 创建进度条，_iter_frames 读完后会释放 VideoCapture 对象
+        frames = self._iter_frames(self.cap)
+        for frame_index, frame in tqdm(frames, total=self.get_expected_frame_count(), desc=f"加载 {self.video_path}"):
+            self._frame_indices.append(frame_index)
+            self.frame_list.append(frame)
 
         num_loaded_frames = len(self.frame_list)
         if num_loaded_frames == 0 and self.metadata_frame_count > 0:
             print(f"警告: 视频 '{self.video_path}' 元数据表明有 {self.metadata_frame_count} 帧, 但未能成功加载任何帧。")
-        elif num_loaded_frames < self.metadata_frame_count:
+        elif num_loaded_frames < self.get_expected_frame_count():
+            print(f"\n警告: 视频 '{self.video_path}' 可能已损坏或实际帧数少于元数据。")
             print(
                 f"提示: 视频 '{self.video_path}' 成功加载了 {num_loaded_frames} 帧 (元数据总帧数: {self.metadata_frame_count})。")
         else:
             print(f"视频 '{self.video_path}' 加载成功，共 {num_loaded_frames} 帧。")
 
+    def _start_decoder(self):
+        """启动后台解码线程，把帧依次放入有界队列。"""
+        self._stop_event = threading.Event()
+        self._frame_queue = queue.Queue(maxsize=self.prefetch_size)
+        self._decoded_count = 0
+        self._stream_finished = False
+        self._decode_thread = threading.Thread(
+            target=self._decode_loop,
+            args=(self.cap, self._frame_queue, self._stop_event),
+            name="LocalVideoLoader-decoder",
+            daemon=True,
+        )
+        self._decode_thread.start()
+        print(f"正在流式读取视频 '{self.video_path}' (元数据总帧数: {self.metadata_frame_count}, 预取 {self.prefetch_size} 帧)...")
+
+    def _decode_loop(self, cap, frame_queue, stop_event):
+        """解码线程主循环。队列满时阻塞，从而把内存限制在 prefetch_size 帧以内。"""
+        frames = self._iter_frames(cap)
+        try:
+            for item in frames:
+                if stop_event.is_set():
+                    break
+                self._decoded_count += 1
+                # 带超时的 put，以便在 stop_event 被设置时能及时退出
+                while not stop_event.is_set():
+                    try:
+                        frame_queue.put(item, timeout=0.1)
+                        break
+                    except queue.Full:
+                        continue
+        finally:
+            frames.close()
+            if not stop_event.is_set():
+                frame_queue.put(_END_OF_STREAM)
+
+    def _write_to_cache(self, cache_writer, frame, first):
+        """
+        把解码出的帧写入缓存。第一帧到达时创建写入器（需要帧形状）。
+        返回:
+            当前的写入器；写入失败（帧数超出元数据等）时放弃缓存并返回 None。
+        """
+        if self.frame_cache is None:
+            return None
+        if first:
+            cache_writer = self.frame_cache.create_writer(
+                self._cache_key, frame.shape, frame.dtype, self.get_expected_frame_count(),
+                fps=self.fps, metadata_frame_count=self.metadata_frame_count,
+            )
+        if cache_writer is not None and not cache_writer.write(frame):
+            cache_writer.abort()
+            return None
+        return cache_writer
+
+    def _stop_decoder(self):
+        """停止解码线程并丢弃队列中剩余的帧。"""
+        if self._decode_thread is None:
+            return
+        self._stop_event.set()
+        # 清空队列，避免解码线程卡在 put 上
+        while self._decode_thread.is_alive():
+            try:
+                while True:
+                    self._frame_queue.get_nowait()
+            except queue.Empty:
+                pass
+            self._decode_thread.join(timeout=0.1)
+        self._decode_thread = None
+        self._frame_queue = None
+
     def get_frame(self):
         """
-        从预加载的帧列表中获取下一帧。
+        获取下一帧。
+        流式模式下从预取队列中取帧（队列为空时等待解码线程）；预加载模式下从帧列表中取帧。
         返回:
             list frame 如果成功获取帧，，frame 是图像帧；
-                           否则 (已到达列表末尾或列表为空)  frame 为 None。
+                           否则 (已到达视频末尾或视频为空)  frame 为 None。
         """
+        if self._cached_frames is not None:
+            if self.current_frame_idx >= len(self._cached_frames):
+                return None
+            frame = self._cached_frames[self.current_frame_idx]
+            self.last_frame_index = self.start_frame + self.current_frame_idx * self.stride
+            self.current_frame_idx += 1
+            return frame
+
+        if not self.preload:
+            if self._stream_finished or self._frame_queue is None:
+                return None
+            item = self._frame_queue.get()
+            if item is _END_OF_STREAM:
+                self._stream_finished = True
+                return None
+            self.last_frame_index, frame = item
+            self.current_frame_idx += 1
+            return frame
+
         # 检查当前索引是否在已加载帧列表的有效范围内
         if self.current_frame_idx < len(self.frame_list):
             # 获取当前帧
             frame_to_return = self.frame_list[self.current_frame_idx]
+            self.last_frame_index = self._frame_indices[self.current_frame_idx]
             # 移动到下一帧的索引，为下一次调用做准备
             self.current_frame_idx += 1
             return frame_to_return
@@ -126,37 +397,12 @@ class LocalVideoLoader(BasicVideoLoader):
             # 没有更多帧可供读取 (已到达列表末尾，或列表为空)
             return None
 
-    def draw_labeled_frame(self, frame, point_list):
-        """
-        在帧上绘制标记点。
-        参数:
-            frame: 要绘制的图像帧 (numpy array)。
-            point_list: 一个包含 (x, y) 坐标元组的列表。
-        返回:
-            绘制了标记的图像帧。如果输入帧为None或point_list为空，则返回原始帧。
-        """
-        if frame is None:
-            return None
-
-        # 创建帧的副本以避免修改原始列表中的帧
-        labeled_frame = frame.copy()
-
-        if point_list:  # 确保 point_list 不为 None 或空
-            for point in point_list:
-                try:
-                    # 确保坐标是整数
-                    center_x = int(point[0])
-                    center_y = int(point[1])
-                    cv2.circle(labeled_frame, (center_x, center_y), radius=5, color=(0, 0, 255), thickness=-1)  # 红色实心圆点
-                except IndexError:
-                    print(f"警告: 点 {point} 的格式不正确，应为 (x, y)。")
-                except Exception as e:
-                    print(f"警告: 绘制点 {point} 时出错: {e}")
-
-        return labeled_frame
-
     def get_total_loaded_frames(self):
-        """返回实际加载到内存中的帧数。"""
+        """返回实际加载到内存中的帧数（流式模式下为目前已解码的帧数）。"""
+        if self._cached_frames is not None:
+            return len(self._cached_frames)
+        if not self.preload:
+            return self._decoded_count
         return len(self.frame_list)
 
     def get_metadata_frame_count(self):
@@ -164,61 +410,174 @@ class LocalVideoLoader(BasicVideoLoader):
         return self.metadata_frame_count
 
     def reset_frame_counter(self):
-        """重置帧计数器，以便从头开始重新遍历已加载的帧。"""
+        """重置帧计数器，以便从头开始重新遍历已加载的帧。流式模式下会重新打开视频并重启解码线程。"""
+        if not self.preload and self._cached_frames is None:
+            self._stop_decoder()
+            self.cap = self._open_capture()
+            self._start_decoder()
         self.current_frame_idx = 0
+        self.last_frame_index = None
         print("帧计数器已重置，将从第一帧开始读取。")
 
+    def release(self):
+        """停止解码线程并释放视频捕捉对象。"""
+        self._stop_decoder()
+        super().release()
+
 
 class CameraVideoLoader(BasicVideoLoader):
-    #TODO 摄像头采集实现
-    def __init__(self, camera_index: int = 0):
+    def __init__(self, source=0, buffer_size: int = 2, realtime: bool = None, read_timeout: float = 5.0):
         """
-        初始化摄像头视频加载器。
+        低延迟的摄像头视频加载器。
+        后台采集线程持续读取帧，放入容量为 buffer_size 的环形缓冲区（满时丢弃最旧的帧）；
+        get_frame() 总是返回最新的一帧并丢弃其余未取走的旧帧，因此推理永远处理最新画面，不会落后于实时。
+        每帧都记录采集时间戳，丢帧数与延迟统计见 stats()。
         参数:
-            camera_index (int): 摄像头的索引 (通常从 0 开始)。
+            source (int | str): 摄像头索引；也可以是视频文件路径，用于在没有摄像头时模拟采集。
+            buffer_size (int): 环形缓冲区容量（帧）。
+            realtime (bool): 是否按视频帧率节流采集，默认对视频文件开启（模拟摄像头的实时帧率）、对摄像头关闭。
+            read_timeout (float): get_frame 等待新帧的最长时间（秒），超时视为采集已停止。
         """
         super().__init__()
-        self.camera_index = camera_index
-        self.load_video(camera_index)
+        self.camera_index = source
+        self.buffer_size = max(1, int(buffer_size))
+        self.realtime = realtime
+        self.read_timeout = read_timeout
+        self.fps = 0
+        self.last_frame_index = None
+        self.last_timestamp = None
+        self._buffer = deque(maxlen=self.buffer_size)  # [(序号, 采集时间, frame)]
+        self._condition = threading.Condition()
+        self._capture_thread = None
+        self._stop_event = threading.Event()
+        self._capture_finished = False
+        self.load_video(source)
 
-    def load_video(self, source: int):
+    def load_video(self, source):
         """
-        打开指定的摄像头。
+        打开摄像头（或用作模拟的视频文件）并启动采集线程。
         参数:
-            source (int): 摄像头的索引。
+            source (int | str): 摄像头索引或视频文件路径。
         """
+        self._stop_capture()
+        if isinstance(source, str) and source.isdigit():
+            # "0" 这样的字符串会被 cv2.VideoCapture 当作文件名，转换为设备索引
+            source = int(source)
         self.camera_index = source
-        self.cap = cv2.VideoCapture(self.camera_index)
+        self.cap = cv2.VideoCapture(source)
         if not self.cap.isOpened():
-            raise IOError(f"无法打开摄像头索引: {self.camera_index}")
+            raise IOError(f"无法打开摄像头索引: {source}")
+        is_file = isinstance(source, str)
+        if not is_file:
+            # 尽量减小驱动内部的缓冲，避免读到过时的帧
+            self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS) or 0
+        realtime = is_file if self.realtime is None else self.realtime
+
         self.frame_count = 0
-        print(f"摄像头 {self.camera_index} 打开成功。")
+        self.frames_delivered = 0
+        self.frames_dropped = 0
+        self.last_latency = 0.0
+        self._latency_sum = 0.0
+        self._max_latency = 0.0
+        self._buffer.clear()
+        self._capture_finished = False
+        self._stop_event.clear()
+        self._capture_thread = threading.Thread(
+            target=self._capture_loop, args=(self.cap, realtime), name="CameraVideoLoader-capture", daemon=True
+        )
+        self._capture_thread.start()
+        print(f"摄像头 {source} 打开成功。")
+
+    def _capture_loop(self, cap, realtime):
+        """采集线程：持续读取帧并放入环形缓冲区。"""
+        interval = 1.0 / self.fps if realtime and self.fps > 0 else 0.0
+        start_time = time.perf_counter()
+        sequence = 0
+        try:
+            while not self._stop_event.is_set():
+                if interval:
+                    # 模拟摄像头：按帧率节流，落后时不补读
+                    delay = start_time + sequence * interval - time.perf_counter()
+                    if delay > 0:
+                        self._stop_event.wait(delay)
+                ret, frame = cap.read()
+                timestamp = time.perf_counter()
+                if not ret:
+                    break
+                with self._condition:
+                    if len(self._buffer) == self._buffer.maxlen:
+                        self.frames_dropped += 1
+                    self._buffer.append((sequence, timestamp, frame))
+                    self.frame_count += 1
+                    self._condition.notify()
+                sequence += 1
+        finally:
+            with self._condition:
+                self._capture_finished = True
+                self._condition.notify_all()
+
+    def _stop_capture(self):
+        if self._capture_thread is None:
+            return
+        self._stop_event.set()
+        self._capture_thread.join()
+        self._capture_thread = None
 
     def get_frame(self):
         """
-        从摄像头捕获当前帧。
+        获取最新采集到的一帧，缓冲区中更旧的帧被丢弃（计入 frames_dropped）。
+        帧的采集序号记录在 last_frame_index，采集时间（time.perf_counter）记录在 last_timestamp。
         返回:
-            tuple: (bool, frame) 如果成功捕获帧，则 bool 为 True，frame 为图像帧；否则为 False, None。
+            frame 图像帧；采集已停止（视频文件读完、摄像头断开或超时）时返回 None。
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._buffer or self._capture_finished, self.read_timeout):
+                return None
+            if not self._buffer:
+                return None
+            sequence, timestamp, frame = self._buffer.pop()
+            self.frames_dropped += len(self._buffer)
+            self._buffer.clear()
+
+        self.last_frame_index = sequence
+        self.last_timestamp = timestamp
+        self.last_latency = time.perf_counter() - timestamp
+        self._latency_sum += self.last_latency
+        self._max_latency = max(self._max_latency, self.last_latency)
+        self.frames_delivered += 1
+        return frame
+
+    def get_expected_frame_count(self):
+        """实时采集的帧数未知，返回 None。"""
+        return None
+
+    def stats(self):
+        """
+        返回采集统计:
+            captured: 采集的帧数；delivered: get_frame 返回的帧数；dropped: 未被处理即被丢弃的帧数；
+            last_latency / mean_latency / max_latency: 从采集到被 get_frame 取走的延迟（秒）。
         """
-        if self.cap is None or not self.cap.isOpened():
-            # print("错误：摄像头未初始化。请先调用 load_video。")
-            print("摄像头未初始化。已默认调用 load_video。")
-            self.load_video(self.camera_index)
-        ret, frame = self.cap.read()
-        if ret:
-            self.frame_count += 1
-        return ret, frame
+        return {
+            "captured": self.frame_count,
+            "delivered": self.frames_delivered,
+            "dropped": self.frames_dropped,
+            "last_latency": self.last_latency,
+            "mean_latency": self._latency_sum / self.frames_delivered if self.frames_delivered else 0.0,
+            "max_latency": self._max_latency,
+        }
 
-    def draw_labeled_frame(self, frame, point_list):
-        #TODO 绘制标注帧
-        pass
+    def release(self):
+        """停止采集线程并释放摄像头。"""
+        self._stop_capture()
+        super().release()
 
 if __name__ == '__main__':
     import numpy as np
     video_path = "example.mp4"
     loader = LocalVideoLoader(video_path)
     frame_list = []
-    while frame :=loader.get_frame():
+    while (frame := loader.get_frame()) is not None:
         frame_list.append(np.array(frame))
     print(frame_list[-1].shape)
 